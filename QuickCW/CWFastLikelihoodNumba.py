@@ -8,13 +8,14 @@ from numba.typed import List
 import scipy.linalg
 
 from enterprise import constants as const
-from QuickCW.lapack_wrappers import solve_triangular
+from QuickCW.lapack_wrappers import solve_triangular,solve_triangular_inplace,matmul_inplace,matmul_inplace32,cholesky_inplace
+from QuickCW.QuickCorrectionUtils import check_merged
 
 import QuickCW.const_mcmc as cm
 
 class FastLikeMaster:
     """class to store pta things so they do not have to be recomputed when red noise is recomputed"""
-    def __init__(self,psrs,pta,params,x0,includeCW=True,prior_recovery=False):
+    def __init__(self,psrs,pta,params,x0,includeCW=True,prior_recovery=False,use_float32=False,float32_lnL_tol=1.e-2,compress_f_max=None,compress_dphase_max=1.e-2,sigma_cache_mb=0.,ecorr_kernel=False,ecorr_lnL_tol=1.e-3,phase_series=False,log10_h_max=-11.):
         """
         get Class for generating the fast CW likelihood.
         
@@ -23,9 +24,19 @@ class FastLikeMaster:
         :param x0:              CWInfo object, which is partially redundant with params but better handled by numba
         :param includeCW:       Switch if we want to include the contribution of the CW signal or not [True]
         :param prior_recovery:  If True, we return constant likelihood to be used for prior recovery diagnostic test [False]
+        :param use_float32:     If True, evaluate the filters in single precision with single precision copies of TNvs and isqrNvecs, the double precision ones are freed once the startup check passes [False]
+        :param float32_lnL_tol: Largest log likelihood difference to the double precision path allowed by the accuracy check of use_float32 [1.e-2]
+        :param compress_f_max:  If not None, average the TOAs into epochs for the filter inner products, keeping them accurate up to this GW frequency [None]
+        :param compress_dphase_max: Largest phase change of the filter products across an epoch at compress_f_max [1.e-2]
+        :param sigma_cache_mb:  Memory budget in MB for caching the noise dependent blocks of the Cholesky of Sigma by noise parameters, 0 to disable [0.]
+        :param ecorr_kernel:    If True, fold the ECORR basis columns into a block diagonal white noise applied with a Sherman-Morrison update per epoch, so they are not part of Sigma [False]
+        :param ecorr_lnL_tol:   Largest log likelihood difference to the ECORR basis model allowed by the accuracy check of ecorr_kernel before printing a warning [1.e-3]
+        :param phase_series:    If True, use the series expansion of the phase evolution in the filter kernels for pulsars where its truncation error is below cm.phase_series_tol [False]
+        :param log10_h_max:     Upper bound of the prior on the CW amplitude, the startup accuracy checks of compress_f_max and use_float32 are done at this amplitude [-11.]
         """
         self.Npsr = x0.Npsr
         self.pta = pta
+        self.log10_h_max = log10_h_max
 
         #include switch to easily turn off CW for TD Bayes factor calculation
         self.includeCW = includeCW
@@ -54,16 +65,46 @@ class FastLikeMaster:
         self.TNTs = self.pta.get_TNT(params)
         Ts = self.pta.get_basis()
 
+        #the residuals are needed for the per epoch ECORR sums
+        self.toas = List([psr.toas for psr in psrs])
+        self.residuals = List([psr.residuals for psr in psrs])
+
+        self.ecorr_kernel = ecorr_kernel
+        self.ecorr_lnL_tol = ecorr_lnL_tol
+        self.ecorr_checked = False
+        if self.ecorr_kernel and compress_f_max is not None:
+            raise ValueError("The ECORR kernel cannot be combined with epoch compression")
+        self.set_ecorr_kernel_info(params,Ts)
+
+        #move the basis columns with a fixed prior to the front, so their part of the Cholesky of Sigma only has to be computed once
+        self.set_fixed_Sigma_blocks(params,Ts)
+
+        #compute phiinv for the red noise and GWB powerlaws in numba instead of going through enterprise, if the model can be reproduced
+        self.use_native_phiinv = self.set_powerlaw_phiinv_info(params,x0)
+        if self.use_native_phiinv:
+            print("Using the native powerlaw phiinv for noise updates (matches pta.get_phiinv at the starting point)")
+        else:
+            print("Native powerlaw phiinv is NOT active, using pta.get_phiinv for noise updates")
+
+        #least recently used cache of the noise dependent blocks of the Cholesky of Sigma of each pulsar
+        self.sigma_cache = get_SigmaCache(self.n_fixeds,self.TNTs,sigma_cache_mb)
+
+        #reference counted Cholesky factors of Sigma shared by all the FastLikeInfo objects made by this master
+        self.chol_store = get_CholStore(self.Npsr)
+
+        #everything recompute_noise_native needs besides FLI and x0, so compiled code can recompute the noise blocks too
+        if self.use_native_phiinv:
+            self.native_noise_args = (self.sigma_cache,self.n_fixeds,self.phi_fixeds,self.rn_cols,self.rn_freqs,self.rn_dfs,self.gw_cols,self.gw_freqs,self.gw_dfs,
+                                      self.phiinvs_native,self.logdetphis_native,self.Sigma_perms,self.Sigma_schurs,self.logdet_Sigma_fixeds,self.lapack_ints)
+        else:
+            self.native_noise_args = None
+
         #invchol_Sigma_Ts = List()
         self.Nrs = List()
         self.isqrNvecs = List()
         #unify types outside numba to avoid slowing down compilation
         #also add more components to logdet
 
-        #put toas and residuals into a numba typed List of arrays, which shouldn't require any actual copies
-        self.toas = List([psr.toas for psr in psrs])
-        self.residuals = List([psr.residuals for psr in psrs])
-
         self.resres_rNr = 0.
         self.TNvs = List()
         self.dotTNrs = List()
@@ -74,81 +115,597 @@ class FastLikeMaster:
             self.TNvs.append((Ts[i].T/np.sqrt(self.Nvecs[i])).copy().T) #store F contiguous version
             self.dotTNrs.append(np.dot(self.Nrs[i],self.TNvs[i]))
 
+            if self.ecorr_kernel:
+                #the epoch sums of the basis projected through the Sherman-Morrison update, in the column order of Sigma
+                self.ecorr_Qs[i] = np.ascontiguousarray(self.ecorr_Qs[i][:,self.Sigma_perms[i]])
+                self.dotTNrs[i] -= self.ecorr_Qs[i].T@(self.ecorr_ws[i]*self.ecorr_Nrs[i])
+
         #put the rnr part of resres onto logdet
         self.logdet = self.resres_rNr+self.logdet
 
+        if self.ecorr_kernel:
+            #the basis model is compared to in check_ecorr_kernel_accuracy
+            self.logdet_basis = self.logdet
+            for i in range(self.Npsr):
+                #rNr with the block diagonal white noise, and its log determinant relative to the diagonal one
+                #minus the ECORR part of logdet phi, which enterprise includes
+                self.logdet -= np.sum(self.ecorr_ws[i]*self.ecorr_Nrs[i]**2)+np.sum(np.log(self.ecorr_ws[i]))
+
         self.max_toa = np.max(self.toas[0])
         for i in range(self.Npsr):
             #find the latest arriving signal to prohibit signals that have already merged
             self.max_toa = max(self.max_toa,np.max(self.toas[i]))
 
+        #everything not involving the filters is already set from the full data, so the filter inputs can be replaced by epoch averages now
+        self.compress_f_max = compress_f_max
+        self.compress_dphase_max = compress_dphase_max
+        self.compression_checked = False
+        self.n_toas_full = np.array([toas.size for toas in self.toas])
+        if self.compress_f_max is not None:
+            self.compress_epochs()
+
+        #single precision copies for the mixed precision filter path, keep empty arrays if not used so the types are fixed
+        self.use_float32 = use_float32
+        self.float32_lnL_tol = float32_lnL_tol
+        self.float32_checked = False
+        self.TNvs32 = List()
+        self.isqrNvecs32 = List()
+        for i in range(self.Npsr):
+            if self.use_float32:
+                self.TNvs32.append(np.asfortranarray(self.TNvs[i],dtype=np.float32))
+                self.isqrNvecs32.append(self.isqrNvecs[i].astype(np.float32))
+            else:
+                self.TNvs32.append(np.zeros((2,2),dtype=np.float32,order='F')) #placeholder, numba would type a 0x0 or 1x1 array as C contiguous
+                self.isqrNvecs32.append(np.zeros(0,dtype=np.float32))
+
+        #scratch space for the filter kernels, shared by all FastLikeInfo objects created from this
+        self.ws = FilterWorkspace(self.TNvs,self.toas,nb.config.NUMBA_NUM_THREADS)
+        self.ws.use_phase_series = phase_series
+        if self.ecorr_kernel:
+            self.ws.set_ecorr(self.ecorr_epochs,self.ecorr_ws,self.ecorr_Qs,self.ecorr_Nrs)
+
+        #no reduced order quadratures until set_roq is called
+        self.roq = get_empty_ROQInfo(self.Npsr)
+
+    def set_fixed_Sigma_blocks(self,params,Ts):
+        """find the basis columns whose prior does not depend on any parameter (e.g. timing model and fixed ECORR), permute them to the front of Ts and TNTs,
+        and precompute the leading columns of the Cholesky of Sigma and the Schur complement of the fixed block,
+        so recompute_FastLike only has to factorize the trailing block belonging to the red noise and GWB columns
+
+        :param params:          Dictionary of noise parameters
+        :param Ts:              List of basis matrices, permuted in place
+        """
+        pls = self.pta.get_phiinv(params, logdet=True, method='partition')
+        #any prior depending on a parameter changes if all parameters are shifted
+        pls_shift = self.pta.get_phiinv({key:val+0.5 for key,val in params.items()}, logdet=True, method='partition')
+
+        self.Sigma_perms = List()
+        self.n_fixeds = np.zeros(self.Npsr,dtype=np.int64)
+        self.chol_Sigma_fixeds = List()
+        self.Sigma_schurs = List()
+        self.logdet_Sigma_fixeds = np.zeros(self.Npsr)
+        for i in range(self.Npsr):
+            phiinv_loc = pls[i][0]
+            n_col = Ts[i].shape[1]
+            if phiinv_loc.ndim == 1:
+                is_fixed = phiinv_loc==pls_shift[i][0]
+                #ECORR columns folded into the white noise are left out of Sigma entirely
+                is_kept = ~self.ecorr_col_masks[i]
+                perm = np.concatenate((np.where(is_fixed&is_kept)[0],np.where(~is_fixed&is_kept)[0]))
+                n_fixed = np.sum(is_fixed&is_kept)
+                n_col = perm.size
+            else:
+                #correlated priors are always factorized in full
+                perm = np.arange(n_col)
+                n_fixed = 0
+
+            Ts[i] = Ts[i][:,perm]
+            TNT = self.TNTs[i][np.ix_(perm,perm)]
+            self.TNTs[i] = TNT
+            self.Sigma_perms.append(perm)
+            self.n_fixeds[i] = n_fixed
+
+            if n_fixed>0:
+                phiinv_fixed = phiinv_loc[perm[:n_fixed]]
+                chol_Sigma11 = scipy.linalg.cholesky(TNT[:n_fixed,:n_fixed]+np.diag(phiinv_fixed),lower=True)
+                chol_Sigma21 = scipy.linalg.solve_triangular(chol_Sigma11,TNT[:n_fixed,n_fixed:],lower=True).T
+                self.chol_Sigma_fixeds.append(np.asfortranarray(np.vstack((chol_Sigma11,chol_Sigma21))))
+                self.Sigma_schurs.append(np.ascontiguousarray(TNT[n_fixed:,n_fixed:]-chol_Sigma21@chol_Sigma21.T))
+                self.logdet_Sigma_fixeds[i] = logdet_Sigma_helper(chol_Sigma11)
+            else:
+                self.chol_Sigma_fixeds.append(np.zeros((n_col,0),order='F'))
+                self.Sigma_schurs.append(np.ascontiguousarray(TNT))
+
+        #scratch space for passing arguments to lapack from each pulsar's thread in recompute_chol_Sigmas
+        self.lapack_ints = np.zeros((self.Npsr,4),dtype=np.int32)
+
+    def set_ecorr_kernel_info(self,params,Ts):
+        """find the ECORR basis columns of each pulsar and, if ecorr_kernel, fold them into the white noise:
+        with the epoch indicator vectors u_e and ECORR variances J_e the noise is N = D + sum_e J_e u_e u_e^T,
+        so N^-1 = D^-1 - sum_e w_e D^-1 u_e u_e^T D^-1 with w_e = 1/(1/J_e + u_e^T D^-1 u_e). Every product with N^-1 is then a diagonal one
+        minus a correction from per epoch sums, which reproduces the basis model with the ECORR columns removed from Sigma.
+        TNTs are replaced in place by T^T N^-1 T, the ECORR rows and columns of which are dropped by set_fixed_Sigma_blocks
+
+        :param params:          Dictionary of noise parameters
+        :param Ts:              List of basis matrices
+        """
+        self.ecorr_col_masks = []
+        self.ecorr_epochs = List()
+        self.ecorr_ws = List()
+        self.ecorr_Qs = List()
+        self.ecorr_Nrs = List()
+        if not self.ecorr_kernel:
+            for i in range(self.Npsr):
+                self.ecorr_col_masks.append(np.zeros(Ts[i].shape[1],dtype=np.bool_))
+            return
+
+        #the basis model is kept until check_ecorr_kernel_accuracy compares to it
+        self.Ts_basis = [T.copy() for T in Ts]
+        self.TNTs_basis = [TNT.copy() for TNT in self.TNTs]
+
+        pls = self.pta.get_phiinv(params, logdet=True, method='partition')
+        for i in range(self.Npsr):
+            if pls[i][0].ndim != 1:
+                raise ValueError("The ECORR kernel needs diagonal priors")
+            sc = self.pta._signalcollections[i]
+            ecorr_cols = []
+            for signal in sc._signals:
+                if signal.signal_name=='basis ecorr' and signal in sc._idx:
+                    ecorr_cols.append(np.array(sc._idx[signal],dtype=np.int64))
+            if len(ecorr_cols)>0:
+                ecorr_cols = np.unique(np.concatenate(ecorr_cols))
+            else:
+                ecorr_cols = np.zeros(0,dtype=np.int64)
+
+            U = Ts[i][:,ecorr_cols]
+            if not (np.all((U==0.)|(U==1.)) and np.all(np.sum(U,axis=1)<=1.)):
+                raise ValueError("The ECORR kernel needs every TOA to be in at most one ECORR epoch")
+            epochs = np.full(U.shape[0],-1,dtype=np.int64)
+            toa_idxs,epoch_idxs = np.nonzero(U)
+            epochs[toa_idxs] = epoch_idxs
+
+            TNT = self.TNTs[i]
+            ecorr_Js = 1/pls[i][0][ecorr_cols]
+            ecorr_w = 1/(1/ecorr_Js+np.diag(TNT)[ecorr_cols])
+            #u_e^T D^-1 T for every basis column, permuted to the order of Sigma once set_fixed_Sigma_blocks is done
+            Q = TNT[ecorr_cols]
+            self.TNTs[i] = TNT-Q.T@(ecorr_w[:,None]*Q)
+
+            col_mask = np.zeros(Ts[i].shape[1],dtype=np.bool_)
+            col_mask[ecorr_cols] = True
+            self.ecorr_col_masks.append(col_mask)
+            self.ecorr_epochs.append(epochs)
+            self.ecorr_ws.append(ecorr_w)
+            self.ecorr_Qs.append(Q)
+            self.ecorr_Nrs.append(U.T@(self.residuals[i]/self.Nvecs[i]))
+
+    def check_ecorr_kernel_accuracy(self,FLI,x0,params,n_check=100):
+        """compare the likelihoods with the ECORR kernel to the ones from the ECORR basis model at x0 and random projection parameters,
+        print the reduction of the size of Sigma and the log likelihood error of each pulsar, and warn if it is above ecorr_lnL_tol
+
+        :param FLI:             FastLikeInfo object set up at x0 with the ECORR kernel
+        :param x0:              CWInfo object
+        :param params:          Dictionary of noise parameters consistent with x0
+        :param n_check:         Number of sets of projection parameters to compare at [100]
+
+        :return max_diffs:      Largest absolute difference in log likelihood from each pulsar
+        """
+        use_float32 = FLI.use_float32
+        FLI.use_float32 = False
+        FLI.update_intrinsic_params(x0)
+
+        #factorize the full Sigma of the basis model directly
+        pls = self.pta.get_phiinv(params, logdet=True, method='partition')
+        TNvs_basis = List()
+        dotTNrs_basis = List()
+        chol_Sigmas_basis = List()
+        logdet_array_basis = np.zeros(self.Npsr)
+        for i in range(self.Npsr):
+            TNvs_basis.append((self.Ts_basis[i].T/np.sqrt(self.Nvecs[i])).copy().T)
+            dotTNrs_basis.append(np.dot(self.Nrs[i],TNvs_basis[i]))
+            chol_Sigma = np.asfortranarray(scipy.linalg.cholesky(self.TNTs_basis[i]+np.diag(pls[i][0]),lower=True))
+            chol_Sigmas_basis.append(chol_Sigma)
+            logdet_array_basis[i] = pls[i][1]+logdet_Sigma_helper(chol_Sigma)
+        NN_basis = np.zeros_like(FLI.NN)
+        MMs_basis = np.zeros_like(FLI.MMs)
+        resres_array_basis = np.zeros(self.Npsr)
+        ws_basis = FilterWorkspace(TNvs_basis,self.toas,self.ws.n_slice)
+        update_intrinsic_params2(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas,NN_basis,MMs_basis,TNvs_basis,chol_Sigmas_basis,np.arange(self.Npsr),
+                                 resres_array_basis,dotTNrs_basis,self.TNvs32,self.isqrNvecs32,False,ws_basis,get_empty_ROQInfo(self.Npsr))
+
+
+        #use a separate generator so the check does not change the random numbers seen by the sampler
+        rng = np.random.default_rng(1234)
+        cos_incs = rng.uniform(-1.,1.,n_check)
+        log10_hs = np.full(n_check,x0.log10_h)
+        phase0s = rng.uniform(0.,2*np.pi,n_check)
+        psis = rng.uniform(0.,np.pi,n_check)
+        cw_p_phases = rng.uniform(0.,2*np.pi,(n_check,self.Npsr))
+        def get_log_Ls(NN,MMs,resres_array,logdet_array,logdet_base):
+            return get_lnlikelihood_batch_helper(x0.log10_fgw,cos_incs,log10_hs,phase0s,psis,cw_p_phases,np.sum(resres_array),logdet_base+np.sum(logdet_array),
+                                                 FLI.F_ps,FLI.F_cs,FLI.amp_psr_facs,NN,MMs,includeCW=FLI.includeCW,prior_recovery=FLI.prior_recovery)
+
+        log_Ls_basis = get_log_Ls(NN_basis,MMs_basis,resres_array_basis,logdet_array_basis,self.logdet_basis)
+        max_diffs = np.zeros(self.Npsr)
+        for i in range(self.Npsr):
+            #only use the ECORR kernel for pulsar i
+            NN_loc = NN_basis.copy()
+            MMs_loc = MMs_basis.copy()
+            resres_loc = resres_array_basis.copy()
+            logdet_loc = logdet_array_basis.copy()
+            NN_loc[i] = FLI.NN[i]
+            MMs_loc[i] = FLI.MMs[i]
+            #the ECORR kernel moves part of resres and logdet of each pulsar into logdet_base
+            resres_loc[i] = FLI.resres_array[i]-np.sum(self.ecorr_ws[i]*self.ecorr_Nrs[i]**2)
+            logdet_loc[i] = FLI.logdet_array[i]-np.sum(np.log(self.ecorr_ws[i]))
+            max_diffs[i] = np.max(np.abs(get_log_Ls(NN_loc,MMs_loc,resres_loc,logdet_loc,self.logdet_basis)-log_Ls_basis))
+            print("ECORR kernel pulsar %d: Sigma %dx%d -> %dx%d, max log likelihood error %.3e"%(i,TNvs_basis[i].shape[1],TNvs_basis[i].shape[1],
+                                                                                              self.TNvs[i].shape[1],self.TNvs[i].shape[1],max_diffs[i]))
+        max_diff = np.max(np.abs(get_log_Ls(FLI.NN,FLI.MMs,FLI.resres_array,FLI.logdet_array,FLI.logdet_base)-log_Ls_basis))
+        if max_diff<=self.ecorr_lnL_tol:
+            print("ECORR kernel check passed, max log likelihood difference to the basis model %.3e"%max_diff)
+        else:
+            print("WARNING: the ECORR kernel changed the log likelihood by %.3e>%.3e compared to the basis model"%(max_diff,self.ecorr_lnL_tol))
+
+        FLI.use_float32 = use_float32
+        FLI.update_intrinsic_params(x0)
+
+        #the basis model is not needed anymore
+        self.ecorr_checked = True
+        self.Ts_basis = None
+        self.TNTs_basis = None
+        return max_diffs
+
+    def set_powerlaw_phiinv_info(self,params,x0):
+        """precompute the columns, frequencies and frequency spacings of the red_noise and gw powerlaw bases of each pulsar,
+        and the constant part of phi coming from every other basis, so get_phiinvs_powerlaw can replace pta.get_phiinv.
+        The result is cross-checked against pta.get_phiinv at params
+
+        :param params:          Dictionary of noise parameters
+        :param x0:              CWInfo object consistent with params
+
+        :return success:        True if the native phiinv reproduces enterprise, False if pta.get_phiinv has to be used
+        """
+        self.phi_fixeds = List()
+        self.rn_cols = List()
+        self.rn_freqs = List()
+        self.rn_dfs = List()
+        self.gw_cols = List()
+        self.gw_freqs = List()
+        self.gw_dfs = List()
+        self.phiinvs_native = List()
+        self.logdetphis_native = np.zeros(self.Npsr)
+
+        pls = self.pta.get_phiinv(params, logdet=True, method='partition')
+        try:
+            for i in range(self.Npsr):
+                if pls[i][0].ndim != 1:
+                    raise ValueError("correlated prior")
+                sc = self.pta._signalcollections[i]
+                is_powerlaw = np.zeros(pls[i][0].size,dtype=np.bool_)
+                cols = {}
+                freqs = {}
+                for signal in sc._signals:
+                    #FourierBasisGP sets signal_name to 'red noise' for every instance, the name given to it is the signal_id
+                    if signal.signal_id in ['red_noise','gw']:
+                        cols[signal.signal_id] = np.array(sc._idx[signal],dtype=np.int64)
+                        freqs[signal.signal_id] = np.array(signal._labels[''],dtype=np.float64)
+                        is_powerlaw[cols[signal.signal_id]] = True
+                for name,col_list,freq_list,df_list in [('red_noise',self.rn_cols,self.rn_freqs,self.rn_dfs),('gw',self.gw_cols,self.gw_freqs,self.gw_dfs)]:
+                    col_list.append(cols[name])
+                    freq_list.append(freqs[name])
+                    #same frequency spacing as enterprise.signals.utils.powerlaw with 2 components per frequency
+                    df_list.append(np.repeat(np.diff(np.concatenate((np.array([0.]),freqs[name][::2]))),2))
+                phi_fixed = 1/pls[i][0]
+                phi_fixed[is_powerlaw] = 0.
+                self.phi_fixeds.append(phi_fixed)
+                self.phiinvs_native.append(np.zeros(phi_fixed.size))
+        except (AttributeError,KeyError,ValueError,IndexError) as err:
+            print("Could not set up the native phiinv (%s: %s), using pta.get_phiinv"%(type(err).__name__,err))
+            return False
+
+        #cross check against enterprise
+        get_phiinvs_powerlaw(x0.rn_gammas,x0.rn_log10_As,x0.gwb_gamma,x0.gwb_log10_A,np.zeros(self.Npsr,dtype=np.bool_),self.phi_fixeds,
+                             self.rn_cols,self.rn_freqs,self.rn_dfs,self.gw_cols,self.gw_freqs,self.gw_dfs,self.phiinvs_native,self.logdetphis_native)
+        for i in range(self.Npsr):
+            if not (np.allclose(self.phiinvs_native[i],pls[i][0],rtol=1.e-10,atol=0.) and np.isclose(self.logdetphis_native[i],pls[i][1],rtol=1.e-12,atol=1.e-8)):
+                print("Native phiinv does not match pta.get_phiinv for pulsar %d, using pta.get_phiinv"%i)
+                return False
+        return True
+
+    def compress_epochs(self):
+        """replace the TOAs, Nrs, isqrNvecs and TNvs used by the filter inner products with one weighted average per epoch.
+        Epochs are short enough that the filter products change phase by at most compress_dphase_max at compress_f_max within them,
+        so the filters can be taken constant over an epoch. The full data is kept until check_compression_accuracy is done."""
+        #the filter products oscillate at up to twice the GW frequency
+        dt_max = self.compress_dphase_max/(4*np.pi*self.compress_f_max)
+
+        self.toas_full = self.toas
+        self.Nrs_full = self.Nrs
+        self.isqrNvecs_full = self.isqrNvecs
+        self.TNvs_full = self.TNvs
+
+        self.toas = List()
+        self.Nrs = List()
+        self.isqrNvecs = List()
+        self.TNvs = List()
+        Nvecs = List()
+        for i in range(self.Npsr):
+            sort_idxs = np.argsort(self.toas_full[i],kind='stable')
+            toas_sort = self.toas_full[i][sort_idxs]
+            starts = get_epoch_starts(toas_sort,dt_max)
+            isqrNvec = self.isqrNvecs_full[i][sort_idxs]
+
+            #sums over each epoch of 1/N, t/N, r/N and T/N, from which the filter inner products follow if the filters are constant over the epoch
+            invN_sum = np.add.reduceat(isqrNvec**2,starts)
+            toas_loc = np.add.reduceat(toas_sort*isqrNvec**2,starts)/invN_sum
+            Nr_sum = np.add.reduceat(self.Nrs_full[i][sort_idxs]*isqrNvec,starts)
+            TN_sum = np.add.reduceat(self.TNvs_full[i][sort_idxs]*isqrNvec[:,None],starts,axis=0)
+
+            isqrNvec_loc = np.sqrt(invN_sum)
+            self.toas.append(toas_loc)
+            self.isqrNvecs.append(isqrNvec_loc)
+            self.Nrs.append(Nr_sum/isqrNvec_loc)
+            self.TNvs.append(np.asfortranarray(TN_sum/isqrNvec_loc[:,None]))
+            Nvecs.append(1/invN_sum)
+        self.Nvecs = Nvecs
+
+    def check_compression_accuracy(self,FLI,x0,n_check=100):
+        """compare the likelihoods from the epoch averaged filters to the ones from the full data at compress_f_max and random projection parameters,
+        and print the compression ratio and log likelihood error of each pulsar. The epoch averaging only changes the CW terms,
+        so the amplitude is set to log10_h_max, where the CW terms and their errors are largest
+
+        :param FLI:             FastLikeInfo object set up at x0 with the epoch averaged data
+        :param x0:              CWInfo object
+        :param n_check:         Number of sets of projection parameters to compare at [100]
+
+        :return max_diffs:      Largest absolute difference in log likelihood from each pulsar
+        """
+        use_float32 = FLI.use_float32
+        FLI.use_float32 = False
+        #the epoch averaging error is largest at the highest frequency, lower the chirp mass if needed so the source has not merged there
+        log10_fgw_old = x0.log10_fgw
+        log10_mc_old = x0.log10_mc
+        x0.log10_fgw = np.log10(self.compress_f_max)
+        while check_merged(x0.log10_fgw,x0.log10_mc,self.max_toa):
+            x0.log10_mc -= 0.1
+
+        FLI.update_intrinsic_params(x0)
+        NN_comp = FLI.NN.copy()
+        MMs_comp = FLI.MMs.copy()
+        NN_full = np.zeros_like(NN_comp)
+        MMs_full = np.zeros_like(MMs_comp)
+        ws_full = FilterWorkspace(self.TNvs_full,self.toas_full,self.ws.n_slice)
+        update_intrinsic_params2(x0,self.isqrNvecs_full,self.Nrs_full,self.pos,self.pdist,self.toas_full,NN_full,MMs_full,self.TNvs_full,FLI.chol_Sigmas,np.arange(self.Npsr),
+                                 FLI.resres_array.copy(),self.dotTNrs,self.TNvs32,self.isqrNvecs32,False,ws_full,get_empty_ROQInfo(self.Npsr))
+
+        #use a separate generator so the check does not change the random numbers seen by the sampler
+        rng = np.random.default_rng(1234)
+        cos_incs = rng.uniform(-1.,1.,n_check)
+        log10_hs = np.full(n_check,self.log10_h_max)
+        phase0s = rng.uniform(0.,2*np.pi,n_check)
+        psis = rng.uniform(0.,np.pi,n_check)
+        cw_p_phases = rng.uniform(0.,2*np.pi,(n_check,self.Npsr))
+        def get_log_Ls(NN,MMs):
+            return get_lnlikelihood_batch_helper(x0.log10_fgw,cos_incs,log10_hs,phase0s,psis,cw_p_phases,FLI.resres,FLI.logdet,FLI.F_ps,FLI.F_cs,FLI.amp_psr_facs,NN,MMs,
+                                                 includeCW=FLI.includeCW,prior_recovery=FLI.prior_recovery)
+
+        log_Ls_full = get_log_Ls(NN_full,MMs_full)
+        max_diffs = np.zeros(self.Npsr)
+        for i in range(self.Npsr):
+            #only use the epoch averages for pulsar i
+            NN_loc = NN_full.copy()
+            MMs_loc = MMs_full.copy()
+            NN_loc[i] = NN_comp[i]
+            MMs_loc[i] = MMs_comp[i]
+            max_diffs[i] = np.max(np.abs(get_log_Ls(NN_loc,MMs_loc)-log_Ls_full))
+            print("Epoch compression pulsar %d: %d TOAs -> %d epochs (ratio %.1f), max log likelihood error %.3e"%(i,self.n_toas_full[i],self.toas[i].size,self.n_toas_full[i]/self.toas[i].size,max_diffs[i]))
+        max_diff = np.max(np.abs(get_log_Ls(NN_comp,MMs_comp)-log_Ls_full))
+        print("Epoch compression: %d TOAs -> %d epochs, max log likelihood error %.3e at f_gw=%.3e and log10_h=%.2f"%(np.sum(self.n_toas_full),sum([toas.size for toas in self.toas]),max_diff,self.compress_f_max,self.log10_h_max))
+
+        x0.log10_fgw = log10_fgw_old
+        x0.log10_mc = log10_mc_old
+        FLI.use_float32 = use_float32
+        FLI.update_intrinsic_params(x0)
+
+        #the full data is not needed anymore
+        self.compression_checked = True
+        self.toas_full = None
+        self.Nrs_full = None
+        self.isqrNvecs_full = None
+        self.TNvs_full = None
+        return max_diffs
+
+    def set_roq(self,roq):
+        """use the reduced order quadratures in roq (see QuickROQHelpers) for FastLikeInfo objects created after this"""
+        if self.ecorr_kernel:
+            raise ValueError("Reduced order quadratures cannot be combined with the ECORR kernel")
+        self.roq = roq
+
     def get_new_FastLike(self,x0,params):
-        chol_Sigmas = List()
+        chol_handles = np.zeros(self.Npsr,dtype=np.int64)
         phiinvs = List()
         for i in range(self.Npsr):
-            chol_Sigmas.append(np.identity((self.TNvs[i].shape[1])).T) #temporary but can't be 0 or else the initialization of FLI will crash
-            phiinvs.append(np.ones(self.TNvs[i].shape[1]))
+            chol_Sigma = np.identity((self.dotTNrs[i].size)).T #temporary but can't be 0 or else the initialization of FLI will crash
+            #the leading columns belonging to fixed priors never change
+            chol_Sigma[:,:self.n_fixeds[i]] = self.chol_Sigma_fixeds[i]
+            phiinvs.append(np.ones(self.dotTNrs[i].size))
+            chol_handles[i] = self.chol_store.new_slot(i,chol_Sigma,phiinvs[i])
 
         FLI = FastLikeInfo(self.logdet,self.pos,self.pdist,self.toas,self.Nvecs,self.Nrs,self.max_toa,x0,
-                           self.Npsr,self.isqrNvecs,self.TNvs,self.dotTNrs,chol_Sigmas,phiinvs,self.includeCW,self.prior_recovery)
-        return self.recompute_FastLike(FLI,x0,params)
+                           self.Npsr,self.isqrNvecs,self.TNvs,self.dotTNrs,self.chol_store,chol_handles,phiinvs,self.ws,self.TNvs32,self.isqrNvecs32,self.roq,self.use_float32,
+                           self.includeCW,self.prior_recovery)
+        FLI = self.recompute_FastLike(FLI,x0,params)
+        if self.compress_f_max is not None and not self.compression_checked:
+            self.check_compression_accuracy(FLI,x0)
+        if self.ecorr_kernel and not self.ecorr_checked:
+            self.check_ecorr_kernel_accuracy(FLI,x0,params)
+        if self.use_float32 and not self.float32_checked:
+            self.check_float32_accuracy(FLI,x0)
+        return FLI
+
+    def check_float32_accuracy(self,FLI,x0,n_check=100,n_shape=4):
+        """compare the likelihoods from the single precision filter path to the double precision one at x0 and n_shape-1 random sky locations and pulsar distances,
+        with random projection parameters at the amplitude log10_h_max, where the filter errors matter most.
+        If they agree within float32_lnL_tol the double precision TNvs and isqrNvecs are freed,
+        otherwise switch back to double precision with a warning and free the single precision copies instead
+
+        :param FLI:             FastLikeInfo object set up at x0 with use_float32=True
+        :param x0:              CWInfo object
+        :param n_check:         Number of sets of projection parameters to compare at [100]
+        :param n_shape:         Number of shape parameter points to compare at, including x0 [4]
+
+        :return max_diff:       Largest absolute difference in log likelihood
+        """
+        #use a separate generator so the check does not change the random numbers seen by the sampler
+        rng = np.random.default_rng(1234)
+        cos_incs = rng.uniform(-1.,1.,n_check)
+        log10_hs = np.full(n_check,self.log10_h_max)
+        phase0s = rng.uniform(0.,2*np.pi,n_check)
+        psis = rng.uniform(0.,np.pi,n_check)
+        cw_p_phases = rng.uniform(0.,2*np.pi,(n_check,self.Npsr))
+        #the frequency and chirp mass are kept, so the source has not merged at any of the points
+        cos_gwthetas = rng.uniform(-1.,1.,n_shape)
+        gwphis = rng.uniform(0.,2*np.pi,n_shape)
+        cw_p_dists = rng.normal(0.,1.,(n_shape,self.Npsr))
+
+        cos_gwtheta_old = x0.cos_gwtheta
+        gwphi_old = x0.gwphi
+        cw_p_dists_old = x0.cw_p_dists.copy()
+        max_diff = 0.
+        for itrs in range(n_shape):
+            if itrs>0:
+                x0.cos_gwtheta = cos_gwthetas[itrs]
+                x0.gwphi = gwphis[itrs]
+                x0.cw_p_dists = cw_p_dists[itrs]
+            FLI.use_float32 = True
+            FLI.update_intrinsic_params(x0)
+            log_Ls32 = FLI.get_lnlikelihood_batch(cos_incs,log10_hs,phase0s,psis,cw_p_phases)
+            FLI.use_float32 = False
+            FLI.update_intrinsic_params(x0)
+            log_Ls64 = FLI.get_lnlikelihood_batch(cos_incs,log10_hs,phase0s,psis,cw_p_phases)
+            max_diff = max(max_diff,np.max(np.abs(log_Ls32-log_Ls64)))
+        x0.cos_gwtheta = cos_gwtheta_old
+        x0.gwphi = gwphi_old
+        x0.cw_p_dists = cw_p_dists_old
+
+        self.float32_checked = True
+        if max_diff<=self.float32_lnL_tol:
+            print("Single precision filter check passed, max log likelihood difference %.3e at log10_h=%.2f"%(max_diff,self.log10_h_max))
+            FLI.use_float32 = True
+            #the FastLikeInfo objects share the lists, so this frees the double precision copies for all of them,
+            #the placeholders keep the types fixed and numba would type a 0x0 or 1x1 array as C contiguous
+            for i in range(self.Npsr):
+                self.TNvs[i] = np.zeros((2,2),order='F')
+                self.isqrNvecs[i] = np.zeros(0)
+        else:
+            print("WARNING: single precision filters changed the log likelihood by %.3e>%.3e at log10_h=%.2f, falling back to double precision"%(max_diff,self.float32_lnL_tol,self.log10_h_max))
+            self.use_float32 = False
+            for i in range(self.Npsr):
+                self.TNvs32[i] = np.zeros((2,2),dtype=np.float32,order='F')
+                self.isqrNvecs32[i] = np.zeros(0,dtype=np.float32)
+        FLI.update_intrinsic_params(x0)
+        return max_diff
+
+    def get_new_RelBinInfo(self,n_bin,tol=1.e-7,check_every=100):
+        """get a RelBinInfo object for relative binning of the filter inner products, the reference still has to be set with FastLikeInfo.set_rel_bin_reference
+
+        :param n_bin:           Number of bins per pulsar
+        :param tol:             Largest allowed error of the linear interpolation of the filter ratios over a bin [1.e-7]
+        :param check_every:     Number of relative binning updates between comparisons to the exact likelihood, 0 to never compare [100]
+
+        :return rbi:            RelBinInfo object
+        """
+        if self.ecorr_kernel:
+            raise ValueError("Relative binning cannot be combined with the ECORR kernel")
+        if self.use_float32:
+            #the references are computed from the double precision TNvs
+            raise ValueError("Relative binning cannot be combined with use_float32")
+        tn_sums = List()
+        for i in range(self.Npsr):
+            tn_sums.append(np.zeros((2,2,n_bin,self.dotTNrs[i].size),dtype=np.complex128))
+        return RelBinInfo(self.toas,tn_sums,n_bin,self.ws.n_slice,tol,check_every)
     #@profile
+    def load_Sigma_cache(self,FLI,x0,mask):
+        """copy the cached Cholesky blocks, phiinvs and logdets into FLI for the pulsars not masked whose noise parameters in x0 are in the cache
+
+        :param FLI:             FastLikeInfo object
+        :param x0:              CWInfo object
+        :param mask:            Pulsars to skip
+
+        :return mask_miss:      Mask with the pulsars loaded from the cache also masked
+        """
+        if self.sigma_cache.n_slot==0:
+            return mask
+        return load_cached_chol_Sigmas(get_noise_keys(x0),mask,self.sigma_cache,self.n_fixeds,FLI.chol_Sigmas,FLI.phiinvs,FLI.logdet_array)
+
+    def factorize_Sigmas(self,FLI,x0,mask,phiinvs_new,logdetphis,chol_update=False):
+        """refactorize or update the Cholesky of Sigma for all pulsars not masked with recompute_chol_Sigmas and add the results to the cache
+
+        :param FLI:             FastLikeInfo object
+        :param x0:              CWInfo object
+        :param mask:            Pulsars to skip
+        :param phiinvs_new:     List of new diagonal phiinvs in the order returned by the pta
+        :param logdetphis:      Array of the new logdets of phi
+        :param chol_update:     Update the current factors instead of refactorizing where that is predicted to be cheaper [False]
+        """
+        infos,_ = recompute_chol_Sigmas(phiinvs_new,logdetphis,mask,self.Sigma_perms,self.n_fixeds,self.Sigma_schurs,self.logdet_Sigma_fixeds,
+                                        FLI.chol_Sigmas,FLI.phiinvs,FLI.logdet_array,self.lapack_ints,chol_update)
+        if np.any(infos!=0):
+            raise np.linalg.LinAlgError("Sigma is not positive definite for pulsars "+str(np.where(infos!=0)[0]))
+        if self.sigma_cache.n_slot>0:
+            store_cached_chol_Sigmas(get_noise_keys(x0),mask,self.sigma_cache,self.n_fixeds,FLI.chol_Sigmas,FLI.phiinvs,FLI.logdet_array)
+
     def recompute_FastLike(self,FLI,x0,params, chol_update=False,mask=None):
         if mask is None:
             #mask to skip updating values if set to True
             mask = np.zeros(self.Npsr,dtype=np.bool_)
+        if not FLI.prior_recovery and self.use_native_phiinv:
+            #everything needed is in x0, so no python loops over pulsars
+            infos = recompute_noise_native(FLI,x0,mask,self.native_noise_args,chol_update)
+            if np.any(infos!=0):
+                raise np.linalg.LinAlgError("Sigma is not positive definite for pulsars "+str(np.where(infos!=0)[0]))
+            return FLI
+
+        #the noise blocks of all the pulsars not masked may be overwritten below
+        FLI.log_psrs_noise(np.where(~mask)[0])
         if not FLI.prior_recovery:
+            #the correlated priors may depend on more than the noise parameters in the keys, so the factors are not shared here
+            FLI.own_chols(np.where(~mask)[0])
             pls_temp = self.pta.get_phiinv(params, logdet=True, method='partition')
 
-            if chol_update: #update Cholesky of Sigma instead of recompute
-                #chol_Sigmas, logdet_array, new_phiinvs = cholupdate_loop(FLI.chol_Sigmas, List(pls_temp), FLI.phiinvs, self.Npsr)
-                #
-                #FLI.chol_Sigmas = chol_Sigmas
-                #FLI.logdet_array = logdet_array
-                #FLI.phiinvs = new_phiinvs
-
-                for i in range(self.Npsr):
-                    if mask[i]:
-                        continue
+            #pulsars with diagonal priors are all refactorized or updated in one jitted call, the ones with correlated priors in the loop below
+            phiinvs_new = List()
+            logdetphis = np.zeros(self.Npsr)
+            mask_diag = mask.copy()
+            for i in range(self.Npsr):
+                phiinv_loc,logdetphis[i] = pls_temp[i]
+                if phiinv_loc.ndim == 1:
+                    phiinvs_new.append(phiinv_loc)
+                else:
+                    phiinvs_new.append(FLI.phiinvs[i])
+                    mask_diag[i] = True
 
-                    phiinv_loc,logdetphi_loc = pls_temp[i]
-                    chol_Sigma = cholupdate(FLI.chol_Sigmas[i], phiinv_loc-FLI.phiinvs[i])
+            self.factorize_Sigmas(FLI,x0,self.load_Sigma_cache(FLI,x0,mask_diag),phiinvs_new,logdetphis,chol_update)
 
-                    logdet_Sigma_loc = logdet_Sigma_helper(chol_Sigma)
+            for i in range(self.Npsr):
+                if mask[i] or not mask_diag[i]:
+                    continue
 
-                    FLI.chol_Sigmas[i][:] = chol_Sigma
+                phiinv_loc,logdetphi_loc = pls_temp[i]
+                FLI.phiinvs[i][:] = phiinv_loc
+                Sigma = self.TNTs[i]+phiinv_loc
 
-                    FLI.logdet_array[i] = logdetphi_loc+logdet_Sigma_loc
+                #mutate inplace to avoid memory allocation overheads
+                chol_Sigma,lower = scipy.linalg.cho_factor(Sigma.T,lower=True,overwrite_a=True,check_finite=False)
 
-                    FLI.phiinvs[i][:] = phiinv_loc
+                logdet_Sigma_loc = logdet_Sigma_helper(chol_Sigma)#2 * np.sum(np.log(np.diag(chol_Sigma)))
 
-            else:
-                for i in range(self.Npsr):
-                    if mask[i]:
-                        continue
-
-                    phiinv_loc,logdetphi_loc = pls_temp[i]
-
-                    FLI.phiinvs[i][:] = phiinv_loc
-                    if phiinv_loc.ndim == 1:
-                        #Sigma_alt = self.TNTs[i]+np.diag(phiinv_loc)
-                        #overwrite old chol_Sigma so can be done without allocating new array
-                        Sigma = create_Sigma(phiinv_loc,self.TNTs[i],FLI.chol_Sigmas[i].T)
-                        #assert np.allclose(Sigma,Sigma_alt)
-                    else:
-                        Sigma = self.TNTs[i]+phiinv_loc
-
-                    #mutate inplace to avoid memory allocation overheads
-                    chol_Sigma,lower = scipy.linalg.cho_factor(Sigma.T,lower=True,overwrite_a=True,check_finite=False)
-
-                    logdet_Sigma_loc = logdet_Sigma_helper(chol_Sigma)#2 * np.sum(np.log(np.diag(chol_Sigma)))
-
-                    #this should be mutated in place but assign it anyway to be safe
-                    FLI.chol_Sigmas[i][:] = chol_Sigma
-
-                    #add the necessary component to logdet
-                    FLI.logdet_array[i] = logdetphi_loc+logdet_Sigma_loc
+                #this should be mutated in place but assign it anyway to be safe
+                FLI.chol_Sigmas[i][:] = chol_Sigma
 
+                #add the necessary component to logdet
+                FLI.logdet_array[i] = logdetphi_loc+logdet_Sigma_loc
 
             #set logdet
             FLI.set_resres_logdet(FLI.resres_array,FLI.logdet_array,FLI.logdet_base)
@@ -160,72 +717,351 @@ class FastLikeMaster:
 
         return FLI#FastLikeInfo(resres,logdet,self.pos,self.pdist,self.toas,invchol_Sigma_TNs,self.Nvecs,self.Nrs,self.max_toa,x0,self.Npsr,self.isqrNvecs,self.residuals)
 
-@njit(fastmath=True,parallel=False)
-def cholupdate_loop(chol_Sigmas, pls_temp, old_phiinvs, Npsr):
-    """Jitted loop over Sigma matrices to update their Cholesky.
-    Currently not faster than recalculating from scratch, so not used.
+@njit()
+def recompute_noise_native(FLI,x0,mask,noise_args,chol_update=False):
+    """the native phiinv path of FastLikeMaster.recompute_FastLike, callable from compiled code
+
+    :param FLI:             FastLikeInfo object
+    :param x0:              CWInfo object
+    :param mask:            Pulsars to skip
+    :param noise_args:      FastLikeMaster.native_noise_args
+    :param chol_update:     Update the current factors instead of refactorizing where that is predicted to be cheaper [False]
 
+    :return infos:          Lapack info of the factorization of each pulsar, FLI is only left consistent with x0 if they are all 0
+    """
+    sigma_cache,n_fixeds,phi_fixeds,rn_cols,rn_freqs,rn_dfs,gw_cols,gw_freqs,gw_dfs,phiinvs_native,logdetphis_native,Sigma_perms,Sigma_schurs,logdet_Sigma_fixeds,lapack_ints = noise_args
+
+    #the noise blocks of all the pulsars not masked may be overwritten below
+    psr_idxs = np.where(~mask)[0]
+    FLI.log_psrs_noise(psr_idxs)
+
+    keys = get_noise_keys(x0)
+    #factors already computed at these noise parameters for any FastLikeInfo of the same master are shared instead of recomputed
+    mask_own = FLI.share_chols(keys,mask)
+    FLI.own_chols(np.where(~mask_own)[0])
+    if sigma_cache.n_slot>0:
+        mask_miss = load_cached_chol_Sigmas(keys,mask_own,sigma_cache,n_fixeds,FLI.chol_Sigmas,FLI.phiinvs,FLI.logdet_array)
+    else:
+        mask_miss = mask_own
+    get_phiinvs_powerlaw(x0.rn_gammas,x0.rn_log10_As,x0.gwb_gamma,x0.gwb_log10_A,mask_miss,phi_fixeds,
+                         rn_cols,rn_freqs,rn_dfs,gw_cols,gw_freqs,gw_dfs,phiinvs_native,logdetphis_native)
+    infos,_ = recompute_chol_Sigmas(phiinvs_native,logdetphis_native,mask_miss,Sigma_perms,n_fixeds,Sigma_schurs,logdet_Sigma_fixeds,
+                                    FLI.chol_Sigmas,FLI.phiinvs,FLI.logdet_array,lapack_ints,chol_update)
+    if np.any(infos!=0):
+        return infos
+    if sigma_cache.n_slot>0:
+        store_cached_chol_Sigmas(keys,mask_miss,sigma_cache,n_fixeds,FLI.chol_Sigmas,FLI.phiinvs,FLI.logdet_array)
+    FLI.set_chol_keys(keys,np.where(~mask_own)[0])
+
+    #set logdet
+    FLI.set_resres_logdet(FLI.resres_array,FLI.logdet_array,FLI.logdet_base)
+
+    FLI.update_red_noise(x0,psr_idxs)
+    return infos
+
+@njit()
+def get_noise_keys(x0):
+    """get the noise parameters Sigma depends on for each pulsar, used as keys of SigmaCache
+
+    :param x0:              CWInfo object
+
+    :return keys:           (number of pulsars, 4) array of red noise gamma, red noise log10_A, GWB gamma and GWB log10_A
+    """
+    keys = np.zeros((x0.Npsr,4))
+    keys[:,0] = x0.rn_gammas
+    keys[:,1] = x0.rn_log10_As
+    keys[:,2] = x0.gwb_gamma
+    keys[:,3] = x0.gwb_log10_A
+    return keys
+
+@njit()
+def find_cache_slot(cache,ii,key):
+    """find the slot of SigmaCache holding pulsar ii at exactly the noise parameters key
+
+    :param cache:           SigmaCache object
+    :param ii:              Pulsar index
+    :param key:             Array of noise parameters
+
+    :return slot:           Index of the slot, -1 if not in the cache
+    """
+    for slot in range(cache.n_used[ii]):
+        if np.all(cache.keys[ii,slot]==key):
+            return slot
+    return -1
+
+@njit(parallel=True)
+def load_cached_chol_Sigmas(keys,mask,cache,n_fixeds,chol_Sigmas,phiinvs,logdet_array):
+    """copy the cached trailing Cholesky blocks, phiinvs and logdets for every pulsar not masked whose noise parameters are in the cache
+
+    :param keys:            Noise parameters of each pulsar from get_noise_keys
+    :param mask:            Skip pulsars where this is True
+    :param cache:           SigmaCache object
+    :param n_fixeds:        Number of basis columns with a fixed prior for each pulsar
+    :param chol_Sigmas:     List of Cholesky decompositions of Sigma matrices, trailing blocks overwritten on hits
+    :param phiinvs:         List of permuted phiinvs, overwritten on hits
+    :param logdet_array:    Array containing logdet values, overwritten on hits
+
+    :return mask_miss:      mask with the pulsars found in the cache also masked
+    """
+    mask_miss = mask.copy()
+    idxs = np.where(~mask)[0]
+    for itrp in prange(idxs.size):
+        ii = idxs[itrp]
+        slot = find_cache_slot(cache,ii,keys[ii])
+        if slot<0:
+            cache.n_miss[ii] += 1
+            continue
+        cache.n_hit[ii] += 1
+        cache.clocks[ii] += 1
+        cache.last_used[ii,slot] = cache.clocks[ii]
+
+        n_fixed = n_fixeds[ii]
+        chol_Sigma22 = chol_Sigmas[ii][n_fixed:,n_fixed:]
+        chol_Sigma22_cache = cache.chol_Sigma22s[ii][slot]
+        for itrj1 in range(chol_Sigma22.shape[0]):
+            for itrj2 in range(itrj1,chol_Sigma22.shape[0]):
+                chol_Sigma22[itrj2,itrj1] = chol_Sigma22_cache[itrj1,itrj2]
+        phiinvs[ii][:] = cache.phiinvs[ii][slot]
+        logdet_array[ii] = cache.logdets[ii,slot]
+        mask_miss[ii] = True
+    return mask_miss
+
+@njit(parallel=True)
+def store_cached_chol_Sigmas(keys,mask,cache,n_fixeds,chol_Sigmas,phiinvs,logdet_array):
+    """add the trailing Cholesky blocks, phiinvs and logdets of every pulsar not masked to the cache, replacing the least recently used slot if it is full
+
+    :param keys:            Noise parameters of each pulsar from get_noise_keys
+    :param mask:            Skip pulsars where this is True
+    :param cache:           SigmaCache object
+    :param n_fixeds:        Number of basis columns with a fixed prior for each pulsar
     :param chol_Sigmas:     List of Cholesky decompositions of Sigma matrices
-    :param pls_temp:        New list of tuples returned by pta.get_phiinv
-    :param old_phiinvs:     Old list of phiinv matrices
-    :param Npsr:            Number of pulsars (also number of Sigma matrices)
+    :param phiinvs:         List of permuted phiinvs
+    :param logdet_array:    Array containing logdet values
+    """
+    idxs = np.where(~mask)[0]
+    for itrp in prange(idxs.size):
+        ii = idxs[itrp]
+        if cache.n_used[ii]<cache.n_slot:
+            slot = cache.n_used[ii]
+            cache.n_used[ii] += 1
+        else:
+            slot = np.argmin(cache.last_used[ii])
+        cache.clocks[ii] += 1
+        cache.last_used[ii,slot] = cache.clocks[ii]
+        cache.keys[ii,slot] = keys[ii]
+
+        n_fixed = n_fixeds[ii]
+        chol_Sigma22 = chol_Sigmas[ii][n_fixed:,n_fixed:]
+        chol_Sigma22_cache = cache.chol_Sigma22s[ii][slot]
+        for itrj1 in range(chol_Sigma22.shape[0]):
+            for itrj2 in range(itrj1,chol_Sigma22.shape[0]):
+                chol_Sigma22_cache[itrj1,itrj2] = chol_Sigma22[itrj2,itrj1]
+        cache.phiinvs[ii][slot] = phiinvs[ii]
+        cache.logdets[ii,slot] = logdet_array[ii]
 
-    :return chol_Sigmas:    List of updated Choleskies
-    :return logdet_array:   New array containing logdet values
-    :return new_phiinvs:    List of new phiinv matrices
+@njit(parallel=True,fastmath=True)
+def get_phiinvs_powerlaw(rn_gammas,rn_log10_As,gwb_gamma,gwb_log10_A,mask,phi_fixeds,rn_cols,rn_freqs,rn_dfs,gw_cols,gw_freqs,gw_dfs,phiinvs,logdetphis):
+    """get phiinv and logdet phi for every pulsar not masked from the powerlaw red noise and GWB parameters, replacing pta.get_phiinv
+
+    :param rn_gammas:       Array of red noise spectral indices
+    :param rn_log10_As:     Array of log10 red noise amplitudes
+    :param gwb_gamma:       GWB spectral index
+    :param gwb_log10_A:     Log10 GWB amplitude
+    :param mask:            Skip updating pulsars where this is True
+    :param phi_fixeds:      List of the parts of phi not depending on the red noise or GWB parameters
+    :param rn_cols:         List of the red noise basis columns of each pulsar
+    :param rn_freqs:        List of the red noise frequencies of each column
+    :param rn_dfs:          List of the red noise frequency spacings of each column
+    :param gw_cols:         List of the GWB basis columns of each pulsar
+    :param gw_freqs:        List of the GWB frequencies of each column
+    :param gw_dfs:          List of the GWB frequency spacings of each column
+    :param phiinvs:         List of phiinv arrays, overwritten
+    :param logdetphis:      Array of logdet phi values, overwritten
     """
-    logdet_array = np.zeros(Npsr)
-    new_phiinvs = List()
-    for i in range(Npsr):
-        phiinv_loc,logdetphi_loc = pls_temp[i]
-        chol_Sigmas[i] = cholupdate(chol_Sigmas[i], phiinv_loc-old_phiinvs[i])
-        new_phiinvs.append(phiinv_loc)
-        logdet_array[i] = logdet_Sigma_helper(chol_Sigmas[i]) + logdetphi_loc
+    idxs = np.where(~mask)[0]
+    for itrp in prange(idxs.size):
+        ii = idxs[itrp]
+        phi = phiinvs[ii]
+        phi[:] = phi_fixeds[ii]
+        add_powerlaw_phi(phi,rn_cols[ii],rn_freqs[ii],rn_dfs[ii],rn_gammas[ii],rn_log10_As[ii])
+        add_powerlaw_phi(phi,gw_cols[ii],gw_freqs[ii],gw_dfs[ii],gwb_gamma,gwb_log10_A)
+
+        logdetphi = 0.
+        for itrj in range(phi.size):
+            logdetphi += np.log(phi[itrj])
+            phi[itrj] = 1/phi[itrj]
+        logdetphis[ii] = logdetphi
 
-    return chol_Sigmas, logdet_array, new_phiinvs
+@njit()
+def add_powerlaw_phi(phi,cols,freqs,dfs,gamma,log10_A):
+    """add a powerlaw spectrum to the prior variances in phi, in the same form as enterprise.signals.utils.powerlaw
+
+    :param phi:             Array of prior variances, added to in place
+    :param cols:            Columns of the basis the spectrum is added to
+    :param freqs:           Frequency of each column
+    :param dfs:             Frequency spacing of each column
+    :param gamma:           Spectral index
+    :param log10_A:         Log10 amplitude
+    """
+    amp_fac = (10**log10_A)**2/12.0/np.pi**2*const.fyr**(gamma-3)
+    for itrj in range(cols.size):
+        phi[cols[itrj]] += amp_fac*freqs[itrj]**(-gamma)*dfs[itrj]
 
-@njit(fastmath=True,parallel=False)
-def cholupdate(L_in,diag_diff):
-    """Jitted routine to update the Cholesky of a matrix instead of recomputing it.
-    In principle could be faster, but right now it is not, so it's not used.
+@njit(parallel=True,fastmath=True)
+def recompute_chol_Sigmas(phiinvs_new,logdetphis,mask,Sigma_perms,n_fixeds,Sigma_schurs,logdet_Sigma_fixeds,chol_Sigmas,phiinvs,logdet_array,lapack_ints,
+                          chol_update=False,cost_fac=cm.chol_update_cost_fac,min_ratio=cm.chol_downdate_min_ratio):
+    """refactorize the trailing block of Sigma belonging to the varying priors in place for every pulsar not masked, in parallel over pulsars,
+    or if chol_update is set up/downdate it instead for the pulsars where that is predicted to be cheaper
+
+    :param phiinvs_new:         List of new diagonal phiinvs in the order returned by the pta
+    :param logdetphis:          Array of the new logdets of phi
+    :param mask:                Skip updating pulsars where this is True
+    :param Sigma_perms:         List of the permutations moving the fixed priors to the front of the basis
+    :param n_fixeds:            Number of basis columns with a fixed prior for each pulsar
+    :param Sigma_schurs:        List of Schur complements of the fixed blocks of Sigma without phiinv
+    :param logdet_Sigma_fixeds: Array of the contributions of the fixed blocks to logdet Sigma
+    :param chol_Sigmas:         List of Cholesky decompositions of Sigma matrices, the trailing blocks are overwritten
+    :param phiinvs:             List of permuted phiinvs, overwritten
+    :param logdet_array:        Array containing logdet values, overwritten
+    :param lapack_ints:         (number of pulsars, 4) int32 scratch array for lapack
+    :param chol_update:         Whether to try updating the current factors with update_chol_Sigma22 before refactorizing [False]
+    :param cost_fac:            Predicted cost ratio of updates to refactorizations below which to update [cm.chol_update_cost_fac]
+    :param min_ratio:           Smallest allowed shrinking of a squared diagonal element of the factor by a downdate [cm.chol_downdate_min_ratio]
+
+    :return infos:              Array of info values returned by dpotrf, nonzero if Sigma was not positive definite
+    :return updated:            Array of whether each pulsar's factor was updated instead of refactorized
+    """
+    idxs = np.where(~mask)[0]
+    infos = np.zeros(mask.size,dtype=np.int64)
+    updated = np.zeros(mask.size,dtype=np.bool_)
+    for itrp in prange(idxs.size):
+        ii = idxs[itrp]
+        perm = Sigma_perms[ii]
+        phiinv = phiinvs[ii]
+        phiinv_new = phiinvs_new[ii]
+        n_fixed = n_fixeds[ii]
+        Sigma_schur = Sigma_schurs[ii]
+        n_var = Sigma_schur.shape[0]
+        chol_Sigma22 = chol_Sigmas[ii][n_fixed:,n_fixed:]
+
+        if chol_update:
+            updated[ii] = update_chol_Sigma22(chol_Sigma22,phiinv,phiinv_new,perm,n_fixed,cost_fac,min_ratio)
+
+        for itrj in range(perm.size):
+            phiinv[itrj] = phiinv_new[perm[itrj]]
+
+        if not updated[ii]:
+            #lower triangle of the Schur complement with phiinv added to the diagonal, written over the old trailing block
+            for itrj1 in range(n_var):
+                chol_Sigma22[itrj1,itrj1] = Sigma_schur[itrj1,itrj1]+phiinv[n_fixed+itrj1]
+                for itrj2 in range(itrj1+1,n_var):
+                    chol_Sigma22[itrj2,itrj1] = Sigma_schur[itrj1,itrj2]
+
+            infos[ii] = cholesky_inplace(chol_Sigma22,n_var,chol_Sigmas[ii].shape[0],lapack_ints[ii])
+
+        logdet_Sigma22 = 0.
+        for itrj in range(n_var):
+            logdet_Sigma22 += np.log(chol_Sigma22[itrj,itrj])
+        logdet_array[ii] = logdetphis[ii]+logdet_Sigma_fixeds[ii]+2*logdet_Sigma22
+    return infos,updated
+
+@njit()
+def get_epoch_starts(toas,dt_max):
+    """greedily split sorted TOAs into epochs spanning at most dt_max
 
-    :param L_in:        Previous Cholesky that we want to update
-    :param diag_diff:   Differences in the diagonal of the original matrix
+    :param toas:            Sorted TOAs
+    :param dt_max:          Largest time span of an epoch
 
-    :return L:          Updated Cholesky    
+    :return starts:         Index of the first TOA of each epoch
+    """
+    starts = np.zeros(toas.size,dtype=np.int64)
+    n_epoch = 1
+    t_start = toas[0]
+    for itrk in range(1,toas.size):
+        if toas[itrk]-t_start>dt_max:
+            starts[n_epoch] = itrk
+            n_epoch += 1
+            t_start = toas[itrk]
+    return starts[:n_epoch]
+
+@njit(fastmath=True)
+def update_chol_Sigma22(chol_Sigma22,phiinv_old,phiinv_new,perm,n_fixed,cost_fac,min_ratio):
+    """update the trailing Cholesky block of Sigma in place for a change of the diagonal phiinv if that is predicted to be cheaper than refactorizing
+
+    :param chol_Sigma22:    Trailing block of the Cholesky decomposition of Sigma, lower triangle updated in place on success
+    :param phiinv_old:      Permuted phiinv the factor currently belongs to
+    :param phiinv_new:      New diagonal phiinv in the order returned by the pta
+    :param perm:            Permutation moving the fixed priors to the front of the basis
+    :param n_fixed:         Number of basis columns with a fixed prior
+    :param cost_fac:        Update if the summed squared trailing lengths of the changed columns are below cost_fac*n_var**3
+    :param min_ratio:       Smallest allowed ratio of a squared diagonal element of the factor after and before a downdate
+
+    :return success:        False if the factor was not (or only partially) updated and has to be refactorized
+    """
+    n_var = chol_Sigma22.shape[0]
+    #changed columns with the increases first, so downdates start from the best conditioned matrix
+    idxs = np.zeros(n_var,dtype=np.int64)
+    diffs = np.zeros(n_var)
+    n_change = 0
+    cost = 0.
+    for sign in (1.,-1.):
+        for itrj in range(n_var):
+            diff = phiinv_new[perm[n_fixed+itrj]]-phiinv_old[n_fixed+itrj]
+            if sign*diff>0.:
+                idxs[n_change] = itrj
+                diffs[n_change] = diff
+                n_change += 1
+                cost += (n_var-itrj)**2
+    if cost>cost_fac*n_var**3:
+        return False
+    return cholupdate_diag_inplace(chol_Sigma22,idxs[:n_change],diffs[:n_change],min_ratio)
+
+@njit(fastmath=True)
+def cholupdate_diag_inplace(L,idxs,diffs,min_ratio):
+    """update the lower Cholesky factor L in place after adding diffs to the diagonal elements idxs of the factorized matrix,
+    as a sequence of rank one up- (diff>0) or downdates (diff<0) applied together column by column,
+    so each column of L is loaded once for all updates and only columns from the first changed one on are touched
+
+    :param L:               Lower Cholesky factor, column major for contiguous access, only the lower triangle is used
+    :param idxs:            Indices of the changed diagonal elements
+    :param diffs:           Changes of the diagonal elements, best ordered with the positive ones first
+    :param min_ratio:       Smallest allowed ratio of a squared diagonal element of L after and before a downdate
+
+    :return success:        False if a downdate would have lost too much precision, L is then partially updated and must be refactorized
     """
-    n = L_in.shape[0]
-    #L = L_in
-    L = np.copy(L_in)
-    #for idx, diff in enumerate(diag_diff):
-    for idx in range(n):
-        diff = diag_diff[idx]
-        if diff!=0.0:
-            x = np.zeros(n)
-            if diff>0:
-                x[idx] = np.sqrt(diff)
-                sign = 1.0
-            elif diff<0:
-                x[idx] = np.sqrt(-diff)
-                sign = -1.0
-            #print(x)
-            for k in range(idx,n):
-                #print(L[k,k]**2)
-                #print(x[k]**2)
-                #print(L[k,k]**2 + sign * x[k]**2)
-                r = np.sqrt(L[k,k]**2 + sign * x[k]**2)
-                c = r / L[k,k]
-                s = x[k] / L[k,k]
-                L[k,k] = r
-                #L[k+1:n,k] = (L[k+1:n,k] + sign * s*x[k+1:n]) / c
-                #x[k+1:n] = c * x[k+1:n] - s * L[k+1:n,k]
-                #for j in prange(k+1,n): #1 ms (~30% of runtime) this loop
-                for j in range(k+1,n): #1 ms (~30% of runtime) this loop
-                    L[j,k] = (L[j,k] + sign* s*x[j]) / c
-                    x[j] = c * x[j] - s * L[j,k]
-
-    return L
+    n = L.shape[0]
+    n_change = idxs.size
+    if n_change==0:
+        return True
 
+    #update vector i is sqrt(|diffs[i]|) e_idxs[i], so it is zero and does nothing in the columns before idxs[i]
+    xs = np.zeros((n_change,n))
+    signs = np.zeros(n_change)
+    j_start = n
+    for itri in range(n_change):
+        xs[itri,idxs[itri]] = np.sqrt(np.abs(diffs[itri]))
+        signs[itri] = np.sign(diffs[itri])
+        j_start = min(j_start,idxs[itri])
+
+    for k in range(j_start,n):
+        for itri in range(n_change):
+            xk = xs[itri,k]
+            if xk==0.:
+                continue
+            x = xs[itri]
+            sign = signs[itri]
+            Lkk = L[k,k]
+            r2 = Lkk**2+sign*xk**2
+            if r2<=min_ratio*Lkk**2:
+                return False
+            r = np.sqrt(r2)
+            c = r/Lkk
+            s = xk/Lkk
+            L[k,k] = r
+            for j in range(k+1,n):
+                L[j,k] = (L[j,k]+sign*s*x[j])/c
+                x[j] = c*x[j]-s*L[j,k]
+    return True
 
 @njit(parallel=True,fastmath=True)
 def logdet_Sigma_helper(chol_Sigma):
@@ -348,14 +1184,70 @@ class CWInfo:
         return True
 
 @njit()
-def get_lnlikelihood_helper(x0,resres,logdet,pos,pdist,NN,MMs,includeCW=True,prior_recovery=False):
+def get_lnlikelihood_helper(x0,resres,logdet,F_ps,F_cs,amp_psr_facs,NN,MMs,includeCW=True,prior_recovery=False):
     """jittable helper for calculating the log likelihood in CWFastLikelihood
-    
+
     :param x0:              CWInfo object
     :param resres:          Array holding the (residual|residual) inner product
     :param logdet:          Log determinant piece of the likelihood
-    :param pos:             (number of pulsars, 3) array holding 3d unit vector pointing towards each pulsar given by psr.pos
-    :param pdist:           (number of pulsars, 2) array holding distance and error of distance for each pulsar in kpc given by psr.pdist
+    :param F_ps:            Cached plus antenna pattern of each pulsar
+    :param F_cs:            Cached cross antenna pattern of each pulsar
+    :param amp_psr_facs:    Cached ratio of pulsar term to earth term amplitude for each pulsar
+    :param NN:              N matrices holding (filter|residual) type inner products
+    :param MMs:             M matrices holding (filter|filter) type inner products
+    :param includeCW:       Switch if we want to include the contribution of the CW signal or not [True]
+    :param prior_recovery:  If True, we return constant likelihood to be used for prior recovery diagnostic test [False]
+
+    :return log_L:          Log likelihood value
+    """
+    return get_lnlikelihood_proj_helper(x0.log10_fgw,x0.cos_inc,x0.log10_h,x0.phase0,x0.psi,x0.cw_p_phases,resres,logdet,F_ps,F_cs,amp_psr_facs,NN,MMs,
+                                        includeCW=includeCW,prior_recovery=prior_recovery)
+
+@njit(parallel=True)
+def get_lnlikelihood_batch_helper(log10_fgw,cos_incs,log10_hs,phase0s,psis,cw_p_phases,resres,logdet,F_ps,F_cs,amp_psr_facs,NN,MMs,includeCW=True,prior_recovery=False):
+    """jittable helper for calculating the log likelihood at many sets of projection parameters at once,
+    all rows share the shape parameters the inner products NN and MMs were calculated at
+
+    :param log10_fgw:       Log10 GW frequency the inner products were calculated at
+    :param cos_incs:        Array of cosine inclinations, one per row
+    :param log10_hs:        Array of log10 strain amplitudes, one per row
+    :param phase0s:         Array of initial earth term phases, one per row
+    :param psis:            Array of polarization angles, one per row
+    :param cw_p_phases:     (number of rows, number of pulsars) array of pulsar phases
+    :param resres:          Array holding the (residual|residual) inner product
+    :param logdet:          Log determinant piece of the likelihood
+    :param F_ps:            Cached plus antenna pattern of each pulsar
+    :param F_cs:            Cached cross antenna pattern of each pulsar
+    :param amp_psr_facs:    Cached ratio of pulsar term to earth term amplitude for each pulsar
+    :param NN:              N matrices holding (filter|residual) type inner products
+    :param MMs:             M matrices holding (filter|filter) type inner products
+    :param includeCW:       Switch if we want to include the contribution of the CW signal or not [True]
+    :param prior_recovery:  If True, we return constant likelihood to be used for prior recovery diagnostic test [False]
+
+    :return log_Ls:         Array of log likelihood values
+    """
+    n_row = cos_incs.size
+    log_Ls = np.zeros(n_row)
+    for itr in prange(n_row):
+        log_Ls[itr] = get_lnlikelihood_proj_helper(log10_fgw,cos_incs[itr],log10_hs[itr],phase0s[itr],psis[itr],cw_p_phases[itr],resres,logdet,F_ps,F_cs,amp_psr_facs,NN,MMs,
+                                                   includeCW=includeCW,prior_recovery=prior_recovery)
+    return log_Ls
+
+@njit()
+def get_lnlikelihood_proj_helper(log10_fgw,cos_inc,log10_h,phase0,psi,cw_p_phases,resres,logdet,F_ps,F_cs,amp_psr_facs,NN,MMs,includeCW=True,prior_recovery=False):
+    """jittable helper for calculating the log likelihood from the projection parameters passed as scalars
+
+    :param log10_fgw:       Log10 GW frequency
+    :param cos_inc:         Cosine of the inclination
+    :param log10_h:         Log10 strain amplitude
+    :param phase0:          Initial earth term phase
+    :param psi:             Polarization angle
+    :param cw_p_phases:     Array of pulsar phases
+    :param resres:          Array holding the (residual|residual) inner product
+    :param logdet:          Log determinant piece of the likelihood
+    :param F_ps:            Cached plus antenna pattern of each pulsar
+    :param F_cs:            Cached cross antenna pattern of each pulsar
+    :param amp_psr_facs:    Cached ratio of pulsar term to earth term amplitude for each pulsar
     :param NN:              N matrices holding (filter|residual) type inner products
     :param MMs:             M matrices holding (filter|filter) type inner products
     :param includeCW:       Switch if we want to include the contribution of the CW signal or not [True]
@@ -366,62 +1258,37 @@ def get_lnlikelihood_helper(x0,resres,logdet,pos,pdist,NN,MMs,includeCW=True,pri
     if prior_recovery:
         return 0.0
     else:
-        fgw = 10.**x0.log10_fgw
-        amp = 10.**x0.log10_h / (2*np.pi*fgw)
-        mc = 10.**x0.log10_mc * const.Tsun
+        fgw = 10.**log10_fgw
+        amp = 10.**log10_h / (2*np.pi*fgw)
 
-
-        sin_gwtheta = np.sqrt(1-x0.cos_gwtheta**2)
-        sin_gwphi = np.sin(x0.gwphi)
-        cos_gwphi = np.cos(x0.gwphi)
-
-        m = np.array([sin_gwphi, -cos_gwphi, 0.0])
-        n = np.array([-x0.cos_gwtheta * cos_gwphi, -x0.cos_gwtheta * sin_gwphi, sin_gwtheta])
-        omhat = np.array([-sin_gwtheta * cos_gwphi, -sin_gwtheta * sin_gwphi, -x0.cos_gwtheta])
         sigma = np.zeros(4)
 
-        cos_phase0 = np.cos(x0.phase0)
-        sin_phase0 = np.sin(x0.phase0)
-        sin_2psi = np.sin(2*x0.psi)
-        cos_2psi = np.cos(2*x0.psi)
+        cos_phase0 = np.cos(phase0)
+        sin_phase0 = np.sin(phase0)
+        sin_2psi = np.sin(2*psi)
+        cos_2psi = np.cos(2*psi)
 
         log_L = -0.5*resres -0.5*logdet
 
         if includeCW:
-            for i in prange(0,x0.Npsr):
-                m_pos = 0.
-                n_pos = 0.
-                cosMu = 0.
-                for j in range(0,3):
-                    m_pos += m[j]*pos[i,j]
-                    n_pos += n[j]*pos[i,j]
-                    cosMu -= omhat[j]*pos[i,j]
-                #m_pos = np.dot(m, pos[i])
-                #n_pos = np.dot(n, pos[i])
-                #cosMu = -np.dot(omhat, pos[i])
-
-                F_p = 0.5 * (m_pos ** 2 - n_pos ** 2) / (1 - cosMu)
-                F_c = (m_pos * n_pos) / (1 - cosMu)
-
-                p_dist = (pdist[i,0] + pdist[i,1]*x0.cw_p_dists[i])*(const.kpc/const.c)
-
-                w0 = np.pi * fgw
-                omega_p0 = w0 *(1 + 256/5 * mc**(5/3) * w0**(8/3) * p_dist*(1-cosMu))**(-3/8)
-
-                amp_psr = amp * (w0/omega_p0)**(1.0/3.0)
-                phase0_psr = x0.cw_p_phases[i]
-
-                cos_phase0_psr = np.cos(x0.phase0+phase0_psr*2.0)
-                sin_phase0_psr = np.sin(x0.phase0+phase0_psr*2.0)
-
-                sigma[0] =  amp*(   cos_phase0 * (1+x0.cos_inc**2) * (-cos_2psi * F_p + sin_2psi * F_c) +    #Earth term sine
-                                  2*sin_phase0 *     x0.cos_inc    * (+sin_2psi * F_p + cos_2psi * F_c)   )
-                sigma[1] =  amp*(   sin_phase0 * (1+x0.cos_inc**2) * (-cos_2psi * F_p + sin_2psi * F_c) +    #Earth term cosine
-                                  2*cos_phase0 *     x0.cos_inc    * (-sin_2psi * F_p - cos_2psi * F_c)   )
-                sigma[2] =  -amp_psr*(   cos_phase0_psr * (1+x0.cos_inc**2) * (-cos_2psi * F_p + sin_2psi * F_c) +    #Pulsar term sine
-                                  2*sin_phase0_psr *     x0.cos_inc    * (+sin_2psi * F_p + cos_2psi * F_c)   )
-                sigma[3] =  -amp_psr*(   sin_phase0_psr * (1+x0.cos_inc**2) * (-cos_2psi * F_p + sin_2psi * F_c) +    #Pulsar term cosine
-                                  2*cos_phase0_psr *     x0.cos_inc    * (-sin_2psi * F_p - cos_2psi * F_c)   )
+            for i in range(0,F_ps.size):
+                F_p = F_ps[i]
+                F_c = F_cs[i]
+
+                amp_psr = amp * amp_psr_facs[i]
+                phase0_psr = cw_p_phases[i]
+
+                cos_phase0_psr = np.cos(phase0+phase0_psr*2.0)
+                sin_phase0_psr = np.sin(phase0+phase0_psr*2.0)
+
+                sigma[0] =  amp*(   cos_phase0 * (1+cos_inc**2) * (-cos_2psi * F_p + sin_2psi * F_c) +    #Earth term sine
+                                  2*sin_phase0 *     cos_inc    * (+sin_2psi * F_p + cos_2psi * F_c)   )
+                sigma[1] =  amp*(   sin_phase0 * (1+cos_inc**2) * (-cos_2psi * F_p + sin_2psi * F_c) +    #Earth term cosine
+                                  2*cos_phase0 *     cos_inc    * (-sin_2psi * F_p - cos_2psi * F_c)   )
+                sigma[2] =  -amp_psr*(   cos_phase0_psr * (1+cos_inc**2) * (-cos_2psi * F_p + sin_2psi * F_c) +    #Pulsar term sine
+                                  2*sin_phase0_psr *     cos_inc    * (+sin_2psi * F_p + cos_2psi * F_c)   )
+                sigma[3] =  -amp_psr*(   sin_phase0_psr * (1+cos_inc**2) * (-cos_2psi * F_p + sin_2psi * F_c) +    #Pulsar term cosine
+                                  2*cos_phase0_psr *     cos_inc    * (-sin_2psi * F_p - cos_2psi * F_c)   )
 
                 for j in range(0,4):
                     log_L += sigma[j]*NN[i,j]
@@ -435,8 +1302,182 @@ def get_lnlikelihood_helper(x0,resres,logdet,pos,pdist,NN,MMs,includeCW=True,pri
 
         return log_L
 
-@njit(fastmath=True,parallel=True)
-def update_intrinsic_params2(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,idxs,resres_array,dotTNrs):
+@njit()
+def get_antenna_cache_helper(x0,pos,pdist,F_ps,F_cs,amp_psr_facs,idxs):
+    """jittable helper to fill the per pulsar quantities of the likelihood which only depend on the shape parameters,
+    so they do not have to be recomputed every time the projection parameters change
+
+    :param x0:              CWInfo object
+    :param pos:             (number of pulsars, 3) array holding 3d unit vector pointing towards each pulsar given by psr.pos
+    :param pdist:           (number of pulsars, 2) array holding distance and error of distance for each pulsar in kpc given by psr.pdist
+    :param F_ps:            Array to store the plus antenna pattern of each pulsar in
+    :param F_cs:            Array to store the cross antenna pattern of each pulsar in
+    :param amp_psr_facs:    Array to store the ratio of pulsar term to earth term amplitude of each pulsar in
+    :param idxs:            Indices of pulsars for which we want to update things
+    """
+    fgw = 10.**x0.log10_fgw
+    mc = 10.**x0.log10_mc * const.Tsun
+
+    sin_gwtheta = np.sqrt(1-x0.cos_gwtheta**2)
+    sin_gwphi = np.sin(x0.gwphi)
+    cos_gwphi = np.cos(x0.gwphi)
+
+    m = np.array([sin_gwphi, -cos_gwphi, 0.0])
+    n = np.array([-x0.cos_gwtheta * cos_gwphi, -x0.cos_gwtheta * sin_gwphi, sin_gwtheta])
+    omhat = np.array([-sin_gwtheta * cos_gwphi, -sin_gwtheta * sin_gwphi, -x0.cos_gwtheta])
+
+    w0 = np.pi * fgw
+
+    for i in idxs:
+        m_pos = 0.
+        n_pos = 0.
+        cosMu = 0.
+        for j in range(0,3):
+            m_pos += m[j]*pos[i,j]
+            n_pos += n[j]*pos[i,j]
+            cosMu -= omhat[j]*pos[i,j]
+
+        F_ps[i] = 0.5 * (m_pos ** 2 - n_pos ** 2) / (1 - cosMu)
+        F_cs[i] = (m_pos * n_pos) / (1 - cosMu)
+
+        p_dist = (pdist[i,0] + pdist[i,1]*x0.cw_p_dists[i])*(const.kpc/const.c)
+
+        omega_p0 = w0 *(1 + 256/5 * mc**(5/3) * w0**(8/3) * p_dist*(1-cosMu))**(-3/8)
+
+        amp_psr_facs[i] = (w0/omega_p0)**(1.0/3.0)
+
+def get_binomial_series_coeffs(a,n_term):
+    """coefficients c_n of the series (1-x)**a = sum_n c_n x**n
+
+    :param a:           Exponent
+    :param n_term:      Number of coefficients to return
+
+    :return coeffs:     Array of the first n_term coefficients
+    """
+    coeffs = np.zeros(n_term)
+    coeffs[0] = 1.
+    for n in range(1,n_term):
+        coeffs[n] = coeffs[n-1]*(n-1-a)/n
+    return coeffs
+
+#with x = 256/5*mc**(5/3)*w0**(8/3)*t the filter kernels need omega**(-1/3) ~ (1-x)**(1/8)
+#and the phase 1/32*mc**(-5/3)*w0**(-5/3)*(1-(1-x)**(5/8)) = w0*t*sum_n phase_series_coeffs[n]*x**n
+omega_series_coeffs = get_binomial_series_coeffs(1/8,cm.phase_series_max_terms+1)
+phase_series_coeffs = -get_binomial_series_coeffs(5/8,cm.phase_series_max_terms+2)[1:]/(5/8)
+
+@njit()
+def get_phase_series_order(x_max):
+    """get the number of terms needed for the series expansions of omega**(-1/3) and the phase to reach a relative truncation error
+    below cm.phase_series_tol for all |x|<=x_max. The coefficients decrease in magnitude, so the remainder after n terms is bounded by
+    |c_n|*x_max**n/(1-x_max)
+
+    :param x_max:       Largest absolute value of the evolution parameter 256/5*mc**(5/3)*w0**(8/3)*t over the TOAs
+
+    :return n_term:     Number of terms to use, or -1 if the exact expression has to be used
+    """
+    if x_max>=0.5:
+        return -1
+    for n_term in range(1,cm.phase_series_max_terms+1):
+        coeff_max = max(np.abs(omega_series_coeffs[n_term]),np.abs(phase_series_coeffs[n_term]))
+        if coeff_max*x_max**n_term/(1.-x_max)<=cm.phase_series_tol:
+            return n_term
+    return -1
+
+@njit()
+def eval_series(coeffs,x,n_term):
+    """evaluate sum_n coeffs[n]*x**n for n<n_term with Horner's scheme"""
+    res = coeffs[n_term-1]
+    for n in range(n_term-2,-1,-1):
+        res = res*x+coeffs[n]
+    return res
+
+@njit()
+def set_omhat(x0,ws):
+    """store the unit vector of the GW propagation direction for the sky location in x0 in ws.omhat"""
+    gwtheta = np.arccos(x0.cos_gwtheta)
+
+    sin_gwtheta = np.sin(gwtheta)
+    cos_gwtheta = np.cos(gwtheta)
+    sin_gwphi = np.sin(x0.gwphi)
+    cos_gwphi = np.cos(x0.gwphi)
+
+    ws.omhat[0] = -sin_gwtheta * cos_gwphi
+    ws.omhat[1] = -sin_gwtheta * sin_gwphi
+    ws.omhat[2] = -cos_gwtheta
+
+@njit()
+def get_psr_series_order(ws,ii,x_scale,omega_p013):
+    """get the number of series terms to use for the earth and pulsar term phases of one pulsar, see get_phase_series_order
+
+    :param ws:              FilterWorkspace object
+    :param ii:              Index of the pulsar
+    :param x_scale:         256/5*mc**(5/3)*w0**(8/3)
+    :param omega_p013:      (omega_p0/w0)**(-1/3) for the pulsar
+
+    :return n_term:         Number of terms to use, or -1 if the exact expressions have to be used
+    """
+    #use the series expansion of the phase evolution if it is accurate to machine precision over all TOAs of this pulsar
+    if not ws.use_phase_series:
+        return -1
+    return get_term_series_order(x_scale*ws.toa_dt_maxs[ii],omega_p013)
+
+@njit()
+def get_term_series_order(x_max,omega_p013):
+    """get the number of series terms needed for both the earth and the pulsar term, see get_phase_series_order
+
+    :param x_max:           Largest absolute value of the evolution parameter of the earth term over the TOAs
+    :param omega_p013:      (omega_p0/w0)**(-1/3) for the pulsar
+
+    :return n_term:         Number of terms to use, or -1 if the exact expressions have to be used
+    """
+    n_term = get_phase_series_order(x_max)
+    n_term_p = get_phase_series_order(x_max/omega_p013**8)
+    if n_term_p==-1:
+        return -1
+    return max(n_term,n_term_p)
+
+@njit(fastmath=True)
+def get_filter_phases(toas_loc,w0,mc,x_scale,omega_p013,p_dist,cosMu,n_term):
+    """get omega**(-1/3) and the phase of the earth and pulsar terms at a single time
+
+    :param toas_loc:        Time relative to cm.tref
+    :param w0:              Angular frequency of the GW
+    :param mc:              Chirp mass in seconds
+    :param x_scale:         256/5*mc**(5/3)*w0**(8/3)
+    :param omega_p013:      (omega_p0/w0)**(-1/3) for the pulsar
+    :param p_dist:          Pulsar distance in seconds
+    :param cosMu:           Cosine of the angle between the pulsar and the GW source
+    :param n_term:          Number of series terms from get_psr_series_order, or -1 to use the exact expressions
+
+    :return omega13:        Earth term omega**(-1/3) relative to w0
+    :return phase:          Earth term phase
+    :return omega_p13:      Pulsar term omega**(-1/3) relative to w0
+    :return phase_p:        Pulsar term phase
+    """
+    if n_term>0:
+        #pulsar term is the same series in x/omega_p013**8 (obtained by factoring omega_p013**8 out of 1-x_scale*tp)
+        x = x_scale*toas_loc
+        x_p = x/omega_p013**8
+        omega13 = eval_series(omega_series_coeffs,x,n_term)
+        phase = w0*toas_loc*eval_series(phase_series_coeffs,x,n_term)
+
+        omega_p13 = eval_series(omega_series_coeffs,x_p,n_term)
+        phase_p = w0*toas_loc/omega_p013**3*eval_series(phase_series_coeffs,x_p,n_term)
+    else:
+        #NOTE factored out the common w0 into factor of w0**(-5/3) in phase, cancels in ratios
+        #also replace omega with 1/omega**(1/3), which is the quantity we actually need
+        #if sqrt is a native cpu function 3 sqrts will probably be faster than taking the eigth root
+        omega13 = np.sqrt(np.sqrt(np.sqrt((1. - 256./5. * mc**(5./3.) * w0**(8./3.) * toas_loc))))
+        phase = 1/32/mc**(5/3) * w0**(-5/3) * (1. - omega13**5)
+
+        tp = toas_loc - p_dist*(1-cosMu)
+        omega_p13 = np.sqrt(np.sqrt(np.sqrt((1./omega_p013**8 - 256./5. * mc**(5/3) * w0**(8/3) / omega_p013**8 * tp))))
+
+        phase_p = 1/32*mc**(-5/3) * w0**(-5/3) * omega_p013**5 * (1. - omega_p13**5)
+    return omega13,phase,omega_p13,phase_p
+
+@njit(fastmath=True)
+def update_intrinsic_params2(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,idxs,resres_array,dotTNrs,TNvs32,isqrNvecs32,use_float32,ws,roq):
     '''Calculate inner products N=(res|S), M=(S|S)
 
     :param x0:              CWInfo object
@@ -452,44 +1493,167 @@ def update_intrinsic_params2(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Si
     :param idxs:            Indices of pulsar for which we want to update things
     :param resres_array:    Array containing contributions to (res|res)
     :param dotTNrs:         Precalculated dot product of Nrs and TNvs
+    :param TNvs32:          Single precision copy of TNvs (only used if use_float32)
+    :param isqrNvecs32:     Single precision copy of isqrNvecs (only used if use_float32)
+    :param use_float32:     If True, evaluate the filters in single precision and project them with TNvs32 in single precision, TNvs and isqrNvecs are not used then
+    :param ws:              FilterWorkspace object holding the scratch space of the kernels
+    :param roq:             ROQInfo object, pulsars which have a reduced order quadrature covering the parameters use it if roq.use_roq
     '''
 
     w0 = np.pi * 10.0**x0.log10_fgw
     mc = 10.0**x0.log10_mc * const.Tsun
-    gwtheta = np.arccos(x0.cos_gwtheta)
+    set_omhat(x0,ws)
 
-    sin_gwtheta = np.sin(gwtheta)
-    cos_gwtheta = np.cos(gwtheta)
-    sin_gwphi = np.sin(x0.gwphi)
-    cos_gwphi = np.cos(x0.gwphi)
+    n_thread = min(nb.get_num_threads(),ws.n_slice)
 
-    omhat = np.array([-sin_gwtheta * cos_gwphi, -sin_gwtheta * sin_gwphi, -cos_gwtheta])
+    #pulsars which are cheap compared to the total are run serially inside one worker each, with the workers running in parallel,
+    #the rest use the parallel loops over TOAs inside the kernel. This only depends on the shapes, so a pulsar always goes through the same kernel
+    ws.in_idxs[:] = False
+    for ii in idxs:
+        ws.in_idxs[ii] = True
+
+    #pulsars with a reduced order quadrature only need the filters at the interpolation nodes, so they are cheap enough to all run first
+    if roq.use_roq:
+        update_psr_filters_roq_threaded(w0,mc,x0,pos,pdist,NN,MMs,chol_Sigmas,idxs,resres_array,dotTNrs,ws,roq,n_thread)
+        for ii in idxs:
+            if roq.psr_done[ii]:
+                ws.in_idxs[ii] = False
+
+    n_small = 0
+    for itrp in range(ws.psr_order.size):
+        ii = ws.psr_order[itrp]
+        if ws.in_idxs[ii]:
+            if ws.psr_costs[ii]*n_thread<=ws.total_cost:
+                ws.bin_psrs[n_small] = ii
+                n_small += 1
+            else:
+                #the big pulsars are run one after another, so they can all use the first slice of the workspace
+                update_psr_filters_parallel(w0,mc,x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,ii,resres_array,dotTNrs,TNvs32,isqrNvecs32,use_float32,ws,0)
 
+    if n_small>0:
+        n_bin = fill_psr_bins(ws,n_small,min(n_thread,n_small))
+        update_psr_filters_binned(w0,mc,x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,resres_array,dotTNrs,TNvs32,isqrNvecs32,use_float32,ws,n_bin)
 
+@njit(fastmath=True,parallel=True)
+def update_psr_filters_binned(w0,mc,x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,resres_array,dotTNrs,TNvs32,isqrNvecs32,use_float32,ws,n_bin):
+    """run the serial filter kernel for bins of pulsars in parallel, with each bin handled by one worker using its own slice of the workspace
+
+    :param w0:              Angular frequency of the GW
+    :param mc:              Chirp mass in seconds
+    :param ws:              FilterWorkspace object with the bins set by fill_psr_bins
+    :param n_bin:           Number of bins
+    (remaining parameters as in update_intrinsic_params2)
+    """
+    for itrb in prange(n_bin):
+        for itrp in range(ws.bin_starts[itrb],ws.bin_starts[itrb+1]):
+            update_psr_filters_serial(w0,mc,x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,ws.bin_psrs_sorted[itrp],resres_array,dotTNrs,TNvs32,isqrNvecs32,use_float32,ws,itrb)
 
-    for ii in idxs:
-        MM = np.zeros((4, 4))
+@njit()
+def get_psr_filter_costs(TNvs):
+    """estimate the relative cost of the filter kernel for each pulsar from the shape of its basis
 
-        cosMu = -np.dot(omhat, pos[ii])
+    :param TNvs:            T vectros times inverse squareroot N vectors
 
-        p_dist = (pdist[ii,0] + pdist[ii,1]*x0.cw_p_dists[ii])*(const.kpc/const.c)
+    :return psr_costs:      Array of the estimated costs
+    """
+    psr_costs = np.zeros(len(TNvs))
+    for ii in range(len(TNvs)):
+        n1,n2 = TNvs[ii].shape
+        #filter evaluation and projection onto the basis, plus the triangular solve
+        psr_costs[ii] = n1*(n2+16.)+n2**2
+    return psr_costs
 
-        omega_p013 = np.sqrt(np.sqrt(np.sqrt((1. + 256./5. * mc**(5/3) * w0**(8/3) * p_dist*(1-cosMu)))))
+@njit()
+def fill_psr_bins(ws,n_psr,n_bin):
+    """assign the first n_psr pulsars of ws.bin_psrs (sorted by decreasing cost) to bins of similar total cost,
+    always filling the currently cheapest bin
 
-        #get the solution to Lx=a for N, note this uses my own numba compatible lapack wrapper but is basically the same as scipy
-        #invCholSigmaTN = invchol_Sigma_TNs[ii]
-        #SigmaTNrProd = SigmaTNrProds[ii]
+    :param ws:              FilterWorkspace object
+    :param n_psr:           Number of pulsars to distribute
+    :param n_bin:           Number of bins
 
-        #divide the signals by N
-        Nr = Nrs[ii]#residuals[ii]/Nvecs[ii]
-        isqrNvec = isqrNvecs[ii]
-        toas_in = toas[ii]
-        TNv = TNvs[ii]
-        chol_Sigma = chol_Sigmas[ii]
-        dotTNr = dotTNrs[ii]
-        #resres_array[ii] = 0.
+    :return n_bin:          Number of bins
+    """
+    ws.bin_loads[:n_bin] = 0.
+    ws.bin_starts[:n_bin+1] = 0
+    for itrp in range(n_psr):
+        itrb = np.argmin(ws.bin_loads[:n_bin])
+        ws.psr_bins[itrp] = itrb
+        ws.bin_loads[itrb] += ws.psr_costs[ws.bin_psrs[itrp]]
+        ws.bin_starts[itrb+1] += 1
+
+    for itrb in range(n_bin):
+        ws.bin_starts[itrb+1] += ws.bin_starts[itrb]
+        ws.bin_fill[itrb] = ws.bin_starts[itrb]
+
+    for itrp in range(n_psr):
+        itrb = ws.psr_bins[itrp]
+        ws.bin_psrs_sorted[ws.bin_fill[itrb]] = ws.bin_psrs[itrp]
+        ws.bin_fill[itrb] += 1
+    return n_bin
+
+def update_psr_filters(w0,mc,x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,ii,resres_array,dotTNrs,TNvs32,isqrNvecs32,use_float32,ws,slc):
+    """Calculate inner products N=(res|S), M=(S|S) for a single pulsar,
+    this is compiled both with parallel loops over TOAs and serially, see update_intrinsic_params2.
+    All scratch space comes from the workspace, so this does not allocate
+
+    :param w0:              Angular frequency of the GW
+    :param mc:              Chirp mass in seconds
+    :param ii:              Index of the pulsar to update
+    :param ws:              FilterWorkspace object
+    :param slc:             Slice of the workspace to use
+    (remaining parameters as in update_intrinsic_params2)
+    """
+    cosMu = -(ws.omhat[0]*pos[ii,0]+ws.omhat[1]*pos[ii,1]+ws.omhat[2]*pos[ii,2])
+
+    p_dist = (pdist[ii,0] + pdist[ii,1]*x0.cw_p_dists[ii])*(const.kpc/const.c)
+
+    omega_p013 = np.sqrt(np.sqrt(np.sqrt((1. + 256./5. * mc**(5/3) * w0**(8/3) * p_dist*(1-cosMu)))))
+
+    x_scale = 256./5. * mc**(5/3) * w0**(8/3)
+    n_term = get_psr_series_order(ws,ii,x_scale,omega_p013)
+
+    #get the solution to Lx=a for N, note this uses my own numba compatible lapack wrapper but is basically the same as scipy
+    #invCholSigmaTN = invchol_Sigma_TNs[ii]
+    #SigmaTNrProd = SigmaTNrProds[ii]
+
+    #divide the signals by N
+    Nr = Nrs[ii]#residuals[ii]/Nvecs[ii]
+    isqrNvec = isqrNvecs[ii]
+    toas_in = toas[ii]
+    TNv = TNvs[ii]
+    chol_Sigma = chol_Sigmas[ii]
+    dotTNr = dotTNrs[ii]
+    #resres_array[ii] = 0.
+    #single precision versions for use_float32, the double precision TNvs and isqrNvecs are freed after the startup check and vice versa
+    TNv32 = TNvs32[ii]
+    isqrNvec32 = isqrNvecs32[ii]
+    if use_float32:
+        n1,n2 = TNv32.shape
+    else:
         n1,n2 = TNv.shape
+    assert n1<=ws.max_n1 and n2<=ws.max_n2
+
+    #get the sin and cosine parts
+    ET_sin  = ws.filters[slc,0]
+    ET_cos  = ws.filters[slc,1]
+
+    PT_sin  = ws.filters[slc,2]
+    PT_cos  = ws.filters[slc,3]
+
+    ET_sin32 = ws.filters32[slc,0]
+    ET_cos32 = ws.filters32[slc,1]
+    PT_sin32 = ws.filters32[slc,2]
+    PT_cos32 = ws.filters32[slc,3]
+
+    #split the TOAs into contiguous chunks which run in parallel, each chunk keeps its own partial inner products in the workspace,
+    #so the parallel loop has no reduction variables (a reduction in a prange allocates temporary arrays),
+    #and the summation order only depends on the number of chunks and not on the thread scheduling
+    n_chunk = min(ws.n_toa_chunk,(n1+cm.toa_chunk_min-1)//cm.toa_chunk_min)
+    toa_sums = ws.toa_sums[slc]
 
+    #break out this loop instead of using numpy syntax so we don't have to store omegas and phases ever
+    for itrc in prange(n_chunk):
         esNr = 0.
         ecNr = 0.
         psNr = 0.
@@ -507,41 +1671,45 @@ def update_intrinsic_params2(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Si
         pcNec = 0.
         pcNps = 0.
 
-        #get the sin and cosine parts
-        ET_sin  = np.zeros(n1)
-        ET_cos  = np.zeros(n1)
-
-        PT_sin  = np.zeros(n1)
-        PT_cos  = np.zeros(n1)
-
-        #break out this loop instead of using numpy syntax so we don't have to store omegas and phases ever
-        for itrk in prange(n1):
+        itrk_start = itrc*n1//n_chunk
+        itrk_end = (itrc+1)*n1//n_chunk
+        for itrk in range(itrk_start,itrk_end):
             #set up filters
             toas_loc = toas_in[itrk] - cm.tref
-            #NOTE factored out the common w0 into factor of w0**(-5/3) in phase, cancels in ratios
-            #also replace omega with 1/omega**(1/3), which is the quantity we actually need
-            #if sqrt is a native cpu function 3 sqrts will probably be faster than taking the eigth root
-            omega13 = np.sqrt(np.sqrt(np.sqrt((1. - 256./5. * mc**(5./3.) * w0**(8./3.) * toas_loc))))
-            phase = 1/32/mc**(5/3) * w0**(-5/3) * (1. - omega13**5)
+            omega13,phase,omega_p13,phase_p = get_filter_phases(toas_loc,w0,mc,x_scale,omega_p013,p_dist,cosMu,n_term)
 
-            tp = toas_loc - p_dist*(1-cosMu)
-            omega_p13 = np.sqrt(np.sqrt(np.sqrt((1./omega_p013**8 - 256./5. * mc**(5/3) * w0**(8/3) / omega_p013**8 * tp))))
+            if use_float32:
+                #reduce the phases in double precision, so the single precision trig only sees arguments in [0,2pi)
+                arg_p = np.float32((2*phase_p)%(2*np.pi))
+                arg = np.float32((2*phase)%(2*np.pi))
 
-            phase_p = 1/32*mc**(-5/3) * w0**(-5/3) * omega_p013**5 * (1. - omega_p13**5)
+                PT_amp32 = isqrNvec32[itrk] * np.float32(omega_p13)
+                ET_amp32 = isqrNvec32[itrk] * np.float32(omega13)
 
-            PT_amp = isqrNvec[itrk] * omega_p13
-            ET_amp = isqrNvec[itrk] * omega13
+                PT_sin32[itrk] = PT_amp32 * np.sin(arg_p)
+                PT_cos32[itrk] = PT_amp32 * np.cos(arg_p)
 
-            PT_sin[itrk] = PT_amp * np.sin(2*phase_p)
-            PT_cos[itrk] = PT_amp * np.cos(2*phase_p)
+                ET_sin32[itrk] = ET_amp32 * np.sin(arg)
+                ET_cos32[itrk] = ET_amp32 * np.cos(arg)
 
+                #double precision copies for the inner products below
+                PT_sin[itrk] = PT_sin32[itrk]
+                PT_cos[itrk] = PT_cos32[itrk]
+                ET_sin[itrk] = ET_sin32[itrk]
+                ET_cos[itrk] = ET_cos32[itrk]
+            else:
+                PT_amp = isqrNvec[itrk] * omega_p13
+                ET_amp = isqrNvec[itrk] * omega13
 
-            ET_sin[itrk] = ET_amp * np.sin(2*phase)
-            ET_cos[itrk] = ET_amp * np.cos(2*phase)
+                PT_sin[itrk] = PT_amp * np.sin(2*phase_p)
+                PT_cos[itrk] = PT_amp * np.cos(2*phase_p)
 
-            #get the results
 
+                ET_sin[itrk] = ET_amp * np.sin(2*phase)
+                ET_cos[itrk] = ET_amp * np.cos(2*phase)
 
+        #get the results
+        for itrk in range(itrk_start,itrk_end):
             psNps += PT_sin[itrk]*PT_sin[itrk]
             pcNpc += PT_cos[itrk]*PT_cos[itrk]
 
@@ -564,117 +1732,581 @@ def update_intrinsic_params2(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Si
             esNr += Nr[itrk]*ET_sin[itrk]
             ecNr += Nr[itrk]*ET_cos[itrk]
 
-        dotSigmaTNrr  = 0.
-        dotSigmaTNesr = 0.
-        dotSigmaTNecr = 0.
-        dotSigmaTNpsr = 0.
-        dotSigmaTNpcr = 0.
+        chunk_sums = toa_sums[itrc]
+        chunk_sums[0] = esNr
+        chunk_sums[1] = ecNr
+        chunk_sums[2] = psNr
+        chunk_sums[3] = pcNr
+        chunk_sums[4] = esNes
+        chunk_sums[5] = ecNec
+        chunk_sums[6] = psNps
+        chunk_sums[7] = pcNpc
+        chunk_sums[8] = ecNes
+        chunk_sums[9] = psNes
+        chunk_sums[10] = pcNes
+        chunk_sums[11] = psNec
+        chunk_sums[12] = pcNec
+        chunk_sums[13] = pcNps
+
+    sums = ws.filter_sums[slc]
+    sums[:] = 0.
+    for itrc in range(n_chunk):
+        for itrs in range(14):
+            sums[itrs] += toa_sums[itrc,itrs]
+
+    #combine into a matrix to allow solve_triangular to work better, stored as a fortran ordered n2x5 matrix with leading dimension max_n2
+    dotTN5 = ws.dotTN5[slc]
+
+    if use_float32:
+        #same projection as below with sgemm, which accumulates in single precision, the error is bounded by the startup check
+        dotTN4_32 = ws.dotTN4_32[slc]
+        matmul_inplace32(TNv32,ws.filters32[slc],dotTN4_32,n2,4,n1,n1,ws.max_n1,ws.max_n2,ws.lapack_ints[slc],ws.blas_flts[slc],trans_a=True)
+        for itrf in range(4):
+            for itrj in range(n2):
+                dotTN5[itrf,itrj] = dotTN4_32[itrf,itrj]
+    else:
+        #the filters are a fortran ordered n1x4 matrix with leading dimension max_n1, so the projections
+        #dotTNes, dotTNec, dotTNps, dotTNpc are the first 4 columns of TNv.T @ filters, which is a single dgemm
+        matmul_inplace(TNv,ws.filters[slc],dotTN5,n2,4,n1,n1,ws.max_n1,ws.max_n2,ws.lapack_ints[slc],ws.blas_dbls[slc],trans_a=True)
+
+    if ws.use_ecorr:
+        if use_float32:
+            apply_ecorr_kernel(ii,isqrNvec32,n1,n2,sums,dotTN5,ws,slc)
+        else:
+            apply_ecorr_kernel(ii,isqrNvec,n1,n2,sums,dotTN5,ws,slc)
+
+    set_psr_inner_products(ii,sums,dotTN5,dotTNr,n2,chol_Sigma,NN,MMs,resres_array,ws,slc)
+
+@njit(fastmath=True)
+def apply_ecorr_kernel(ii,isqrNvec,n1,n2,sums,dotTN5,ws,slc):
+    """turn the white noise inner products and basis projections of the filters of a single pulsar into ones with ECORR in the white noise,
+    with the Sherman-Morrison update of each epoch: x^T N^-1 y -> x^T N^-1 y - sum_e w_e (u_e^T N^-1 x) (u_e^T N^-1 y)
+
+    :param ii:              Index of the pulsar to update
+    :param isqrNvec:        Inverse squareroot of the diagonal N vector
+    :param n1:              Number of TOAs
+    :param n2:              Number of basis vectors
+    :param sums:            The 14 white noise inner products as in set_psr_inner_products, updated in place
+    :param dotTN5:          Workspace slice with the projections of the filters onto the basis in its first 4 rows, updated in place
+    :param ws:              FilterWorkspace object with the ECORR epochs and weights from set_ecorr
+    :param slc:             Slice of the workspace to use
+    """
+    epochs = ws.ecorr_epochs[ii]
+    ecorr_w = ws.ecorr_ws[ii]
+    Q = ws.ecorr_Qs[ii]
+    epoch_Nrs = ws.ecorr_Nrs[ii]
+    n_epoch = ecorr_w.size
+    filters = ws.filters[slc]
+
+    #epoch sums of the filters weighted by 1/N, the filters already carry one factor of isqrNvec
+    epoch_sums = ws.ecorr_sums[slc]
+    epoch_sums[:,:n_epoch] = 0.
+    for itrk in range(n1):
+        itre = epochs[itrk]
+        if itre>=0:
+            for itrf in range(4):
+                epoch_sums[itrf,itre] += isqrNvec[itrk]*filters[itrf,itrk]
+
+    for itre in range(n_epoch):
+        w = ecorr_w[itre]
+        es = epoch_sums[0,itre]
+        ec = epoch_sums[1,itre]
+        ps = epoch_sums[2,itre]
+        pc = epoch_sums[3,itre]
+        wr = w*epoch_Nrs[itre]
+
+        #same order as in set_psr_inner_products
+        sums[0] -= wr*es
+        sums[1] -= wr*ec
+        sums[2] -= wr*ps
+        sums[3] -= wr*pc
+        sums[4] -= w*es*es
+        sums[5] -= w*ec*ec
+        sums[6] -= w*ps*ps
+        sums[7] -= w*pc*pc
+        sums[8] -= w*ec*es
+        sums[9] -= w*ps*es
+        sums[10] -= w*pc*es
+        sums[11] -= w*ps*ec
+        sums[12] -= w*pc*ec
+        sums[13] -= w*pc*ps
+
+        for itrf in range(4):
+            wf = w*epoch_sums[itrf,itre]
+            for itrj in range(n2):
+                dotTN5[itrf,itrj] -= wf*Q[itre,itrj]
+
+@njit(fastmath=True)
+def set_psr_inner_products(ii,sums,dotTN5,dotTNr,n2,chol_Sigma,NN,MMs,resres_array,ws,slc):
+    """project the filters of a single pulsar through the Cholesky decomposition of Sigma and combine everything into NN, MMs and resres_array,
+    shared by the exact and the relative binning kernels
+
+    :param ii:              Index of the pulsar to update
+    :param sums:            The 14 white noise inner products esNr, ecNr, psNr, pcNr, esNes, ecNec, psNps, pcNpc, ecNes, psNes, pcNes, psNec, pcNec, pcNps
+    :param dotTN5:          Workspace slice with the projections of ET_sin, ET_cos, PT_sin, PT_cos onto the basis in its first 4 rows
+    :param dotTNr:          Precalculated dot product of Nr and TNv
+    :param n2:              Number of basis vectors
+    :param chol_Sigma:      Cholesky decomposition of Sigma
+    :param ws:              FilterWorkspace object
+    :param slc:             Slice of the workspace to use
+    (remaining parameters as in update_intrinsic_params2)
+    """
+    #every element of MM gets set below, so write directly into the output
+    MM = MMs[ii]
+
+    esNr = sums[0]
+    ecNr = sums[1]
+    psNr = sums[2]
+    pcNr = sums[3]
+    esNes = sums[4]
+    ecNec = sums[5]
+    psNps = sums[6]
+    pcNpc = sums[7]
+    ecNes = sums[8]
+    psNes = sums[9]
+    pcNes = sums[10]
+    psNec = sums[11]
+    pcNec = sums[12]
+    pcNps = sums[13]
+
+    dotSigmaTNrr  = 0.
+    dotSigmaTNesr = 0.
+    dotSigmaTNecr = 0.
+    dotSigmaTNpsr = 0.
+    dotSigmaTNpcr = 0.
+
+    dotSigmaTNes = 0.
+    dotSigmaTNec = 0.
+    dotSigmaTNps = 0.
+    dotSigmaTNpc = 0.
+
+    dotSigmaTNeces = 0.
+    dotSigmaTNpses = 0.
+    dotSigmaTNpces = 0.
+    dotSigmaTNpsec = 0.
+    dotSigmaTNpcec = 0.
+    dotSigmaTNpcps = 0.
+
+    dotTN5[4,:n2] = dotTNr
+
+    solve_triangular_inplace(chol_Sigma,dotTN5,n2,5,ws.max_n2,ws.lapack_ints[slc],lower_a=True,trans_a=False)
+    SigmaTN5Prod = dotTN5
+
+    #SigmaTNesProd = solve_triangular(chol_Sigma,dotTNes,lower_a=True,trans_a=False,overwrite_b=True)
+    #SigmaTNecProd = solve_triangular(chol_Sigma,dotTNec,lower_a=True,trans_a=False,overwrite_b=True)
+    #SigmaTNpsProd = solve_triangular(chol_Sigma,dotTNps,lower_a=True,trans_a=False,overwrite_b=True)
+    #SigmaTNpcProd = solve_triangular(chol_Sigma,dotTNpc,lower_a=True,trans_a=False,overwrite_b=True)
+    #SigmaTNrProd  = solve_triangular(chol_Sigma,dotTNr ,lower_a=True,trans_a=False,overwrite_b=True)
+
+    #serial for the same reason as the reductions over TOAs above, this loop is cheap compared to the projection
+    for itrj1 in range(n2):
+        SigmaTNesProd = SigmaTN5Prod[0,itrj1]
+        SigmaTNecProd = SigmaTN5Prod[1,itrj1]
+        SigmaTNpsProd = SigmaTN5Prod[2,itrj1]
+        SigmaTNpcProd = SigmaTN5Prod[3,itrj1]
+        SigmaTNrProd  = SigmaTN5Prod[4,itrj1]
+
+        dotSigmaTNesr += SigmaTNesProd*SigmaTNrProd
+        dotSigmaTNecr += SigmaTNecProd*SigmaTNrProd
+        dotSigmaTNpsr += SigmaTNpsProd*SigmaTNrProd
+        dotSigmaTNpcr += SigmaTNpcProd*SigmaTNrProd
+        dotSigmaTNrr  += SigmaTNrProd*SigmaTNrProd
+
+        dotSigmaTNes += SigmaTNesProd*SigmaTNesProd
+        dotSigmaTNec += SigmaTNecProd*SigmaTNecProd
+        dotSigmaTNps += SigmaTNpsProd*SigmaTNpsProd
+        dotSigmaTNpc += SigmaTNpcProd*SigmaTNpcProd
+
+        dotSigmaTNeces += SigmaTNecProd*SigmaTNesProd
+        dotSigmaTNpses += SigmaTNpsProd*SigmaTNesProd
+        dotSigmaTNpces += SigmaTNpcProd*SigmaTNesProd
+        dotSigmaTNpsec += SigmaTNpsProd*SigmaTNecProd
+        dotSigmaTNpcec += SigmaTNpcProd*SigmaTNecProd
+        dotSigmaTNpcps += SigmaTNpcProd*SigmaTNpsProd
+
+    #get resres
+    resres_array[ii] = -dotSigmaTNrr
+
+    #get NN
+    NN[ii,2] = psNr - dotSigmaTNpsr
+    NN[ii,3] = pcNr - dotSigmaTNpcr
+
+    #get MM
+    #diagonal
+    MM[2,2] = psNps - dotSigmaTNps
+    MM[3,3] = pcNpc - dotSigmaTNpc
+    #lower triangle
+    MM[2,0] = psNes - dotSigmaTNpses
+    MM[3,0] = pcNes - dotSigmaTNpces
+    MM[2,1] = psNec - dotSigmaTNpsec
+    MM[3,1] = pcNec - dotSigmaTNpcec
+    MM[3,2] = pcNps - dotSigmaTNpcps
+    #upper triangle
+    MM[0,2] = MM[2,0]
+    MM[0,3] = MM[3,0]
+    MM[1,2] = MM[2,1]
+    MM[1,3] = MM[3,1]
+    MM[2,3] = MM[3,2]
+
+    #if dist_only:
+    #    MM[0:2,0:2] = MMs[ii,0:2,0:2]
+    #else:
+    NN[ii,0] = esNr - dotSigmaTNesr
+    NN[ii,1] = ecNr - dotSigmaTNecr
+
+    MM[0,0] = esNes - dotSigmaTNes
+    MM[1,1] = ecNec - dotSigmaTNec
+    MM[1,0] = ecNes - dotSigmaTNeces
+    MM[0,1] = MM[1,0]
+
+update_psr_filters_parallel = njit(fastmath=True,parallel=True)(update_psr_filters)
+update_psr_filters_serial = njit(fastmath=True,parallel=False)(update_psr_filters)
 
-        dotSigmaTNes = 0.
-        dotSigmaTNec = 0.
-        dotSigmaTNps = 0.
-        dotSigmaTNpc = 0.
+@njit(fastmath=True,parallel=True)
+def update_psr_filters_roq_threaded(w0,mc,x0,pos,pdist,NN,MMs,chol_Sigmas,idxs,resres_array,dotTNrs,ws,roq,n_thread):
+    """run update_psr_filters_roq for the pulsars in idxs with n_thread workers, each using its own slice of the workspace,
+    and record in roq.psr_done which pulsars were done"""
+    for itrt in prange(n_thread):
+        for itrp in range(itrt,idxs.size,n_thread):
+            ii = idxs[itrp]
+            roq.psr_done[ii] = update_psr_filters_roq(w0,mc,x0,pos,pdist,NN,MMs,chol_Sigmas,ii,resres_array,dotTNrs,ws,roq,itrt)
+
+@njit(fastmath=True)
+def update_psr_filters_roq(w0,mc,x0,pos,pdist,NN,MMs,chol_Sigmas,ii,resres_array,dotTNrs,ws,roq,slc):
+    """Calculate inner products N=(res|S), M=(S|S) for a single pulsar with the reduced order quadrature in roq,
+    which only needs the complex filters e = ET_cos+i*ET_sin and p = PT_cos+i*PT_sin at the empirical interpolation nodes
+
+    :param w0:              Angular frequency of the GW
+    :param mc:              Chirp mass in seconds
+    :param ii:              Index of the pulsar to update
+    :param ws:              FilterWorkspace object
+    :param roq:             ROQInfo object
+    :param slc:             Slice of the workspace to use
+    (remaining parameters as in update_intrinsic_params2)
+
+    :return success:        False if the pulsar has no quadrature or the parameters are outside the range it was built for, in which case nothing has been written
+    """
+    if not roq.has_roq[ii]:
+        return False
+    if x0.log10_fgw<roq.log10_fgw_bounds[0] or x0.log10_fgw>roq.log10_fgw_bounds[1] or x0.log10_mc<roq.log10_mc_bounds[0] or x0.log10_mc>roq.log10_mc_bounds[1]:
+        return False
+
+    cosMu = -(ws.omhat[0]*pos[ii,0]+ws.omhat[1]*pos[ii,1]+ws.omhat[2]*pos[ii,2])
+    p_dist = (pdist[ii,0] + pdist[ii,1]*x0.cw_p_dists[ii])*(const.kpc/const.c)
+    if p_dist*(1-cosMu)>roq.L_maxs[ii]:
+        return False
+    x_scale = 256./5. * mc**(5/3) * w0**(8/3)
+    omega_p013 = np.sqrt(np.sqrt(np.sqrt((1. + x_scale * p_dist*(1-cosMu)))))
+    n_term = get_psr_series_order(ws,ii,x_scale,omega_p013)
+
+    #terms linear in the filters
+    node_toas = roq.node_toas[ii]
+    w_nr = roq.w_nrs[ii]
+    w_tn = roq.w_tns[ii]
+    n2 = w_tn.shape[1]
+    dotTN5 = ws.dotTN5[slc]
+    dotTN5[:4,:n2] = 0.
+    Nre = 0.+0.j
+    Nrp = 0.+0.j
+    for itrm in range(node_toas.size):
+        omega13,phase,omega_p13,phase_p = get_filter_phases(node_toas[itrm],w0,mc,x_scale,omega_p013,p_dist,cosMu,n_term)
+        e = omega13*(np.cos(2*phase)+1j*np.sin(2*phase))
+        p = omega_p13*(np.cos(2*phase_p)+1j*np.sin(2*phase_p))
+        Nre += w_nr[itrm]*e
+        Nrp += w_nr[itrm]*p
+        for itrj in range(n2):
+            dotTNe = w_tn[itrm,itrj]*e
+            dotTNp = w_tn[itrm,itrj]*p
+            dotTN5[0,itrj] += dotTNe.imag
+            dotTN5[1,itrj] += dotTNe.real
+            dotTN5[2,itrj] += dotTNp.imag
+            dotTN5[3,itrj] += dotTNp.real
+
+    #products of two filters have their own interpolation nodes
+    node_toas2 = roq.node_toas2[ii]
+    w_prod = roq.w_prods[ii]
+    ee = 0.+0.j
+    eec = 0.+0.j
+    pp = 0.+0.j
+    ppc = 0.+0.j
+    ep = 0.+0.j
+    epc = 0.+0.j
+    for itrm in range(node_toas2.size):
+        omega13,phase,omega_p13,phase_p = get_filter_phases(node_toas2[itrm],w0,mc,x_scale,omega_p013,p_dist,cosMu,n_term)
+        e = omega13*(np.cos(2*phase)+1j*np.sin(2*phase))
+        p = omega_p13*(np.cos(2*phase_p)+1j*np.sin(2*phase_p))
+        ee += w_prod[itrm]*e*e
+        eec += w_prod[itrm]*e*np.conj(e)
+        pp += w_prod[itrm]*p*p
+        ppc += w_prod[itrm]*p*np.conj(p)
+        ep += w_prod[itrm]*e*p
+        epc += w_prod[itrm]*e*np.conj(p)
+
+    sums = ws.filter_sums[slc]
+    set_complex_filter_sums(sums,Nre,Nrp,ee,eec,pp,ppc,ep,epc)
+    set_psr_inner_products(ii,sums,dotTN5,dotTNrs[ii],n2,chol_Sigmas[ii],NN,MMs,resres_array,ws,slc)
+    return True
+
+@njit(fastmath=True)
+def update_intrinsic_params_rel_bin(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,idxs,resres_array,dotTNrs,TNvs32,isqrNvecs32,use_float32,ws,roq,rbi):
+    """Calculate inner products N=(res|S), M=(S|S) like update_intrinsic_params2, but get the white noise inner products and the projections onto the basis
+    by relative binning against the reference filters in rbi. Pulsars for which the linear interpolation of the ratio to the reference filters
+    is not accurate enough over some bin go through the exact kernel, and the reference is marked as stale if that happens
+
+    :param rbi:             RelBinInfo object with a reference set by set_rel_bin_reference_helper
+    (remaining parameters as in update_intrinsic_params2)
+    """
+    assert rbi.has_ref
+    w0 = np.pi * 10.0**x0.log10_fgw
+    mc = 10.0**x0.log10_mc * const.Tsun
+    set_omhat(x0,ws)
 
-        dotSigmaTNeces = 0.
-        dotSigmaTNpses = 0.
-        dotSigmaTNpces = 0.
-        dotSigmaTNpsec = 0.
-        dotSigmaTNpcec = 0.
-        dotSigmaTNpcps = 0.
+    n_thread = min(nb.get_num_threads(),ws.n_slice)
+    update_psr_filters_rel_bin_threaded(w0,mc,x0,pos,pdist,NN,MMs,chol_Sigmas,idxs,resres_array,dotTNrs,ws,rbi,n_thread)
 
-        dotTNes = np.zeros(n2)
-        dotTNec = np.zeros(n2)
-        dotTNps = np.zeros(n2)
-        dotTNpc = np.zeros(n2)
-        #dotTNr  = np.zeros(n2)
-
-        for itrj in prange(n2):
-            for itrk in prange(n1):
-                dotTNes[itrj] += TNv[itrk,itrj]*ET_sin[itrk]
-                dotTNec[itrj] += TNv[itrk,itrj]*ET_cos[itrk]
-                dotTNps[itrj] += TNv[itrk,itrj]*PT_sin[itrk]
-                dotTNpc[itrj] += TNv[itrk,itrj]*PT_cos[itrk]
-        #        dotTNr[itrj]  += TNv[itrk,itrj]*Nr[itrk]
-
-        #combine into a matrix to allow solve_triangular to work better
-        dotTN5 = np.zeros((5,n2)).T
-        dotTN5[:,0] = dotTNes
-        dotTN5[:,1] = dotTNec
-        dotTN5[:,2] = dotTNps
-        dotTN5[:,3] = dotTNpc
-        #dotTN5[:,4] = dotTNr
-        dotTN5[:,4] = dotTNr
-
-        SigmaTN5Prod = solve_triangular(chol_Sigma,dotTN5,lower_a=True,trans_a=False,overwrite_b=True)
-
-        #SigmaTNesProd = solve_triangular(chol_Sigma,dotTNes,lower_a=True,trans_a=False,overwrite_b=True)
-        #SigmaTNecProd = solve_triangular(chol_Sigma,dotTNec,lower_a=True,trans_a=False,overwrite_b=True)
-        #SigmaTNpsProd = solve_triangular(chol_Sigma,dotTNps,lower_a=True,trans_a=False,overwrite_b=True)
-        #SigmaTNpcProd = solve_triangular(chol_Sigma,dotTNpc,lower_a=True,trans_a=False,overwrite_b=True)
-        #SigmaTNrProd  = solve_triangular(chol_Sigma,dotTNr ,lower_a=True,trans_a=False,overwrite_b=True)
-
-        for itrj1 in prange(n2):
-            SigmaTNesProd = SigmaTN5Prod[itrj1,0]
-            SigmaTNecProd = SigmaTN5Prod[itrj1,1]
-            SigmaTNpsProd = SigmaTN5Prod[itrj1,2]
-            SigmaTNpcProd = SigmaTN5Prod[itrj1,3]
-            SigmaTNrProd  = SigmaTN5Prod[itrj1,4]
-
-            dotSigmaTNesr += SigmaTNesProd*SigmaTNrProd
-            dotSigmaTNecr += SigmaTNecProd*SigmaTNrProd
-            dotSigmaTNpsr += SigmaTNpsProd*SigmaTNrProd
-            dotSigmaTNpcr += SigmaTNpcProd*SigmaTNrProd
-            dotSigmaTNrr  += SigmaTNrProd*SigmaTNrProd
+    n_fallback = 0
+    for ii in idxs:
+        if not rbi.psr_binned[ii]:
+            ws.bin_psrs[n_fallback] = ii
+            n_fallback += 1
 
-            dotSigmaTNes += SigmaTNesProd*SigmaTNesProd
-            dotSigmaTNec += SigmaTNecProd*SigmaTNecProd
-            dotSigmaTNps += SigmaTNpsProd*SigmaTNpsProd
-            dotSigmaTNpc += SigmaTNpcProd*SigmaTNpcProd
+    rbi.n_binned += idxs.size-n_fallback
+    rbi.n_exact += n_fallback
+    if n_fallback>0:
+        #the shape parameters moved too far from the reference, so it should be reset at the next chance
+        rbi.has_ref = False
+        update_intrinsic_params2(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,ws.bin_psrs[:n_fallback].copy(),resres_array,dotTNrs,TNvs32,isqrNvecs32,use_float32,ws,roq)
 
-            dotSigmaTNeces += SigmaTNecProd*SigmaTNesProd
-            dotSigmaTNpses += SigmaTNpsProd*SigmaTNesProd
-            dotSigmaTNpces += SigmaTNpcProd*SigmaTNesProd
-            dotSigmaTNpsec += SigmaTNpsProd*SigmaTNecProd
-            dotSigmaTNpcec += SigmaTNpcProd*SigmaTNecProd
-            dotSigmaTNpcps += SigmaTNpcProd*SigmaTNpsProd
+@njit(fastmath=True,parallel=True)
+def update_psr_filters_rel_bin_threaded(w0,mc,x0,pos,pdist,NN,MMs,chol_Sigmas,idxs,resres_array,dotTNrs,ws,rbi,n_thread):
+    """run update_psr_filters_rel_bin for the pulsars in idxs with n_thread workers, each using its own slice of the workspace,
+    and record in rbi.psr_binned which pulsars were done"""
+    for itrt in prange(n_thread):
+        for itrp in range(itrt,idxs.size,n_thread):
+            ii = idxs[itrp]
+            rbi.psr_binned[ii] = update_psr_filters_rel_bin(w0,mc,x0,pos,pdist,NN,MMs,chol_Sigmas,ii,resres_array,dotTNrs,ws,rbi,itrt)
 
-        #get resres
-        resres_array[ii] = -dotSigmaTNrr
+@njit()
+def set_complex_filter_sums(sums,Nre,Nrp,ee,eec,pp,ppc,ep,epc):
+    """get the 14 white noise inner products used by set_psr_inner_products from sums involving the complex filters e = ET_cos+i*ET_sin and p = PT_cos+i*PT_sin,
+    using that the products of the real and imaginary parts follow from the products with and without complex conjugation
+
+    :param sums:            Array to store the results in
+    :param Nre:             Sum of Nr*e
+    :param Nrp:             Sum of Nr*p
+    :param ee:              Sum of e*e
+    :param eec:             Sum of e*conj(e)
+    :param pp:              Sum of p*p
+    :param ppc:             Sum of p*conj(p)
+    :param ep:              Sum of e*p
+    :param epc:             Sum of e*conj(p)
+    """
+    sums[0] = Nre.imag
+    sums[1] = Nre.real
+    sums[2] = Nrp.imag
+    sums[3] = Nrp.real
+    sums[4] = 0.5*(eec.real-ee.real)
+    sums[5] = 0.5*(eec.real+ee.real)
+    sums[6] = 0.5*(ppc.real-pp.real)
+    sums[7] = 0.5*(ppc.real+pp.real)
+    sums[8] = 0.5*ee.imag
+    sums[9] = 0.5*(epc.real-ep.real)
+    sums[10] = 0.5*(ep.imag+epc.imag)
+    sums[11] = 0.5*(ep.imag-epc.imag)
+    sums[12] = 0.5*(ep.real+epc.real)
+    sums[13] = 0.5*pp.imag
 
-        #get NN
-        NN[ii,2] = psNr - dotSigmaTNpsr
-        NN[ii,3] = pcNr - dotSigmaTNpcr
+@njit()
+def interp_bin_sum(ratio,sum0,sum1,n_bin):
+    """sum over bins of the summary data sum0 and sum1 of a reference filter product times a ratio which is linearly interpolated between the bin edges
 
-        #get MM
-        #diagonal
-        MM[2,2] = psNps - dotSigmaTNps
-        MM[3,3] = pcNpc - dotSigmaTNpc
-        #lower triangle
-        MM[2,0] = psNes - dotSigmaTNpses
-        MM[3,0] = pcNes - dotSigmaTNpces
-        MM[2,1] = psNec - dotSigmaTNpsec
-        MM[3,1] = pcNec - dotSigmaTNpcec
-        MM[3,2] = pcNps - dotSigmaTNpcps
-        #upper triangle
-        MM[0,2] = MM[2,0]
-        MM[0,3] = MM[3,0]
-        MM[1,2] = MM[2,1]
-        MM[1,3] = MM[3,1]
-        MM[2,3] = MM[3,2]
+    :param ratio:           Ratio to the reference at the n_bin+1 bin edges
+    :param sum0:            Sums of the reference product over each bin
+    :param sum1:            Sums of the reference product times the fractional position within each bin
 
-        #if dist_only:
-        #    MM[0:2,0:2] = MMs[ii,0:2,0:2]
-        #else:
-        NN[ii,0] = esNr - dotSigmaTNesr
-        NN[ii,1] = ecNr - dotSigmaTNecr
+    :return res:            Approximation of the sum of the product at the new parameters
+    """
+    res = 0.+0.j
+    for itrb in range(n_bin):
+        res += ratio[itrb]*sum0[itrb]+(ratio[itrb+1]-ratio[itrb])*sum1[itrb]
+    return res
+
+@njit(fastmath=True)
+def update_psr_filters_rel_bin(w0,mc,x0,pos,pdist,NN,MMs,chol_Sigmas,ii,resres_array,dotTNrs,ws,rbi,slc):
+    """Calculate inner products N=(res|S), M=(S|S) for a single pulsar by relative binning. With the complex filters e = ET_cos+i*ET_sin and p = PT_cos+i*PT_sin,
+    the ratios of the filters to the reference filters only vary slowly in time for nearby shape parameters, so every sum over TOAs
+    of a product involving the filters is approximated by linearly interpolating the ratio between the bin edges
+
+    :param w0:              Angular frequency of the GW
+    :param mc:              Chirp mass in seconds
+    :param ii:              Index of the pulsar to update
+    :param ws:              FilterWorkspace object
+    :param rbi:             RelBinInfo object
+    :param slc:             Slice of the workspace to use
+    (remaining parameters as in update_intrinsic_params2)
+
+    :return success:        False if the interpolation would not be accurate to rbi.tol, in which case nothing has been written
+    """
+    n_bin = rbi.n_bin
+    cosMu = -(ws.omhat[0]*pos[ii,0]+ws.omhat[1]*pos[ii,1]+ws.omhat[2]*pos[ii,2])
+    p_dist = (pdist[ii,0] + pdist[ii,1]*x0.cw_p_dists[ii])*(const.kpc/const.c)
+    x_scale = 256./5. * mc**(5/3) * w0**(8/3)
+    omega_p013 = np.sqrt(np.sqrt(np.sqrt((1. + x_scale * p_dist*(1-cosMu)))))
+    n_term = get_psr_series_order(ws,ii,x_scale,omega_p013)
+
+    w0_ref = rbi.ref_w0
+    mc_ref = rbi.ref_mc
+    cosMu_ref = rbi.ref_cosMus[ii]
+    p_dist_ref = rbi.ref_p_dists[ii]
+    x_scale_ref = 256./5. * mc_ref**(5/3) * w0_ref**(8/3)
+    omega_p013_ref = np.sqrt(np.sqrt(np.sqrt((1. + x_scale_ref * p_dist_ref*(1-cosMu_ref)))))
+    n_term_ref = get_psr_series_order(ws,ii,x_scale_ref,omega_p013_ref)
+
+    #ratios at the bin edges: r_e, r_p, r_e**2, |r_e|**2, r_p**2, |r_p|**2, r_e*r_p, r_e*conj(r_p)
+    ratios = rbi.ratios[slc]
+    dphase_e_old = 0.
+    dphase_p_old = 0.
+    for itrb in range(n_bin+1):
+        toas_loc = rbi.bin_t0s[ii]+itrb*rbi.bin_widths[ii]
+        omega13,phase,omega_p13,phase_p = get_filter_phases(toas_loc,w0,mc,x_scale,omega_p013,p_dist,cosMu,n_term)
+        omega13_ref,phase_ref,omega_p13_ref,phase_p_ref = get_filter_phases(toas_loc,w0_ref,mc_ref,x_scale_ref,omega_p013_ref,p_dist_ref,cosMu_ref,n_term_ref)
+        dphase_e = 2*(phase-phase_ref)
+        dphase_p = 2*(phase_p-phase_p_ref)
+        if itrb>0:
+            #the error of linearly interpolating exp(i*phi) over a bin is at most dphi**2/8, and products of two ratios can change twice as fast
+            dphi = max(np.abs(dphase_e-dphase_e_old),np.abs(dphase_p-dphase_p_old))
+            if dphi**2/2>rbi.tol:
+                return False
+        dphase_e_old = dphase_e
+        dphase_p_old = dphase_p
+
+        r_e = omega13/omega13_ref*(np.cos(dphase_e)+1j*np.sin(dphase_e))
+        r_p = omega_p13/omega_p13_ref*(np.cos(dphase_p)+1j*np.sin(dphase_p))
+        ratios[0,itrb] = r_e
+        ratios[1,itrb] = r_p
+        ratios[2,itrb] = r_e*r_e
+        ratios[3,itrb] = r_e*np.conj(r_e)
+        ratios[4,itrb] = r_p*r_p
+        ratios[5,itrb] = r_p*np.conj(r_p)
+        ratios[6,itrb] = r_e*r_p
+        ratios[7,itrb] = r_e*np.conj(r_p)
+
+    nr_sums = rbi.nr_sums[ii]
+    prod_sums = rbi.prod_sums[ii]
+    Nre = interp_bin_sum(ratios[0],nr_sums[0,0],nr_sums[0,1],n_bin)
+    Nrp = interp_bin_sum(ratios[1],nr_sums[1,0],nr_sums[1,1],n_bin)
+    ee = interp_bin_sum(ratios[2],prod_sums[0,0],prod_sums[0,1],n_bin)
+    eec = interp_bin_sum(ratios[3],prod_sums[1,0],prod_sums[1,1],n_bin)
+    pp = interp_bin_sum(ratios[4],prod_sums[2,0],prod_sums[2,1],n_bin)
+    ppc = interp_bin_sum(ratios[5],prod_sums[3,0],prod_sums[3,1],n_bin)
+    ep = interp_bin_sum(ratios[6],prod_sums[4,0],prod_sums[4,1],n_bin)
+    epc = interp_bin_sum(ratios[7],prod_sums[5,0],prod_sums[5,1],n_bin)
+
+    sums = ws.filter_sums[slc]
+    set_complex_filter_sums(sums,Nre,Nrp,ee,eec,pp,ppc,ep,epc)
+
+    #projections onto the basis
+    tn_sums = rbi.tn_sums[ii]
+    n2 = tn_sums.shape[3]
+    dotTN5 = ws.dotTN5[slc]
+    dotTN5[:4,:n2] = 0.
+    for itrb in range(n_bin):
+        for itrf in range(2):
+            ratio0 = ratios[itrf,itrb]
+            ratio1 = ratios[itrf,itrb+1]-ratio0
+            for itrj in range(n2):
+                dotTN = ratio0*tn_sums[itrf,0,itrb,itrj]+ratio1*tn_sums[itrf,1,itrb,itrj]
+                dotTN5[2*itrf,itrj] += dotTN.imag
+                dotTN5[2*itrf+1,itrj] += dotTN.real
+
+    set_psr_inner_products(ii,sums,dotTN5,dotTNrs[ii],n2,chol_Sigmas[ii],NN,MMs,resres_array,ws,slc)
+    return True
 
-        MM[0,0] = esNes - dotSigmaTNes
-        MM[1,1] = ecNec - dotSigmaTNec
-        MM[1,0] = ecNes - dotSigmaTNeces
-        MM[0,1] = MM[1,0]
+@njit(fastmath=True,parallel=True)
+def set_rel_bin_reference_helper(x0,isqrNvecs,Nrs,pos,pdist,toas,TNvs,ws,rbi):
+    """set the reference filters for relative binning to the filters at the shape parameters in x0,
+    and accumulate the summary data over the TOAs in each bin
 
-        MMs[ii,:,:] = MM
+    :param x0:              CWInfo object
+    :param ws:              FilterWorkspace object
+    :param rbi:             RelBinInfo object
+    (remaining parameters as in update_intrinsic_params2)
+    """
+    w0 = np.pi * 10.0**x0.log10_fgw
+    mc = 10.0**x0.log10_mc * const.Tsun
+    set_omhat(x0,ws)
+    x_scale = 256./5. * mc**(5/3) * w0**(8/3)
+    rbi.ref_w0 = w0
+    rbi.ref_mc = mc
+
+    #most expensive pulsars first
+    for itrp in prange(x0.Npsr):
+        ii = ws.psr_order[itrp]
+        cosMu = -(ws.omhat[0]*pos[ii,0]+ws.omhat[1]*pos[ii,1]+ws.omhat[2]*pos[ii,2])
+        p_dist = (pdist[ii,0] + pdist[ii,1]*x0.cw_p_dists[ii])*(const.kpc/const.c)
+        rbi.ref_cosMus[ii] = cosMu
+        rbi.ref_p_dists[ii] = p_dist
+        omega_p013 = np.sqrt(np.sqrt(np.sqrt((1. + x_scale * p_dist*(1-cosMu)))))
+        n_term = get_psr_series_order(ws,ii,x_scale,omega_p013)
 
+        Nr = Nrs[ii]
+        isqrNvec = isqrNvecs[ii]
+        TNv = TNvs[ii]
+        n1,n2 = TNv.shape
+        nr_sums = rbi.nr_sums[ii]
+        prod_sums = rbi.prod_sums[ii]
+        tn_sums = rbi.tn_sums[ii]
+        nr_sums[:] = 0.
+        prod_sums[:] = 0.
+        tn_sums[:] = 0.
+
+        #complex earth and pulsar term filters and the bin and fractional position within the bin of each TOA
+        filters = np.zeros((2,n1),dtype=np.complex128)
+        bin_idxs = np.zeros(n1,dtype=np.int64)
+        bin_fracs = np.zeros(n1)
+        for itrk in range(n1):
+            toas_loc = toas[ii][itrk] - cm.tref
+            omega13,phase,omega_p13,phase_p = get_filter_phases(toas_loc,w0,mc,x_scale,omega_p013,p_dist,cosMu,n_term)
+            e = isqrNvec[itrk]*omega13*(np.cos(2*phase)+1j*np.sin(2*phase))
+            p = isqrNvec[itrk]*omega_p13*(np.cos(2*phase_p)+1j*np.sin(2*phase_p))
+            filters[0,itrk] = e
+            filters[1,itrk] = p
+
+            bin_pos = (toas_loc-rbi.bin_t0s[ii])/rbi.bin_widths[ii]
+            itrb = min(max(np.int64(bin_pos),0),rbi.n_bin-1)
+            bin_frac = bin_pos-itrb
+            bin_idxs[itrk] = itrb
+            bin_fracs[itrk] = bin_frac
+
+            nr_sums[0,0,itrb] += Nr[itrk]*e
+            nr_sums[0,1,itrb] += Nr[itrk]*e*bin_frac
+            nr_sums[1,0,itrb] += Nr[itrk]*p
+            nr_sums[1,1,itrb] += Nr[itrk]*p*bin_frac
+
+            prod_sums[0,0,itrb] += e*e
+            prod_sums[1,0,itrb] += e*np.conj(e)
+            prod_sums[2,0,itrb] += p*p
+            prod_sums[3,0,itrb] += p*np.conj(p)
+            prod_sums[4,0,itrb] += e*p
+            prod_sums[5,0,itrb] += e*np.conj(p)
+
+            prod_sums[0,1,itrb] += e*e*bin_frac
+            prod_sums[1,1,itrb] += e*np.conj(e)*bin_frac
+            prod_sums[2,1,itrb] += p*p*bin_frac
+            prod_sums[3,1,itrb] += p*np.conj(p)*bin_frac
+            prod_sums[4,1,itrb] += e*p*bin_frac
+            prod_sums[5,1,itrb] += e*np.conj(p)*bin_frac
+
+        #TNv is fortran ordered, so loop over TOAs on the inside
+        for itrj in range(n2):
+            for itrk in range(n1):
+                itrb = bin_idxs[itrk]
+                for itrf in range(2):
+                    TNf = TNv[itrk,itrj]*filters[itrf,itrk]
+                    tn_sums[itrf,0,itrb,itrj] += TNf
+                    tn_sums[itrf,1,itrb,itrj] += TNf*bin_fracs[itrk]
+
+    rbi.has_ref = True
 
 @njit(fastmath=True,parallel=True)
 def update_intrinsic_params(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,SigmaTNrProds,invchol_Sigma_TNs,idxs,dist_only=True):
@@ -880,6 +2512,359 @@ def update_intrinsic_params(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,SigmaTNrProds
 
         MMs[ii,:,:] = MM
 
+@jitclass([('n_slice',nb.int64),('max_n1',nb.int64),('max_n2',nb.int64),\
+           ('filters',nb.float64[:,:,::1]),('filters32',nb.float32[:,:,::1]),('filter_sums',nb.float64[:,::1]),('n_toa_chunk',nb.int64),('toa_sums',nb.float64[:,:,::1]),('dotTN5',nb.float64[:,:,::1]),('dotTN4_32',nb.float32[:,:,::1]),('lapack_ints',nb.int32[:,::1]),('blas_dbls',nb.float64[:,::1]),('blas_flts',nb.float32[:,::1]),('omhat',nb.float64[::1]),('toa_dt_maxs',nb.float64[::1]),('use_phase_series',nb.boolean),\
+           ('psr_costs',nb.float64[::1]),('total_cost',nb.float64),('psr_order',nb.int64[::1]),('in_idxs',nb.boolean[::1]),\
+           ('bin_psrs',nb.int64[::1]),('bin_psrs_sorted',nb.int64[::1]),('psr_bins',nb.int64[::1]),\
+           ('bin_loads',nb.float64[::1]),('bin_starts',nb.int64[::1]),('bin_fill',nb.int64[::1]),\
+           ('use_ecorr',nb.boolean),('ecorr_epochs',nb.types.ListType(nb.int64[::1])),('ecorr_ws',nb.types.ListType(nb.float64[::1])),\
+           ('ecorr_Qs',nb.types.ListType(nb.float64[:,::1])),('ecorr_Nrs',nb.types.ListType(nb.float64[::1])),('ecorr_sums',nb.float64[:,:,::1])])
+class FilterWorkspace:
+    """preallocated scratch space for the filter kernels in update_intrinsic_params2, sized once from the largest pulsar
+    with one slice per worker thread so the kernels never have to allocate
+
+    :param TNvs:            T vectros times inverse squareroot N vectors
+    :param toas:            List of arrays of TOAs for each pulsar
+    :param n_slice:         Number of slices (the most worker threads that can run the kernels at once)
+    """
+    def __init__(self,TNvs,toas,n_slice):
+        Npsr = len(TNvs)
+        self.n_slice = n_slice
+        self.max_n1 = 0
+        self.max_n2 = 0
+        for ii in range(Npsr):
+            n1,n2 = TNvs[ii].shape
+            self.max_n1 = max(self.max_n1,n1)
+            self.max_n2 = max(self.max_n2,n2)
+
+        #ET_sin, ET_cos, PT_sin, PT_cos
+        self.filters = np.zeros((n_slice,4,self.max_n1))
+        self.filters32 = np.zeros((n_slice,4,self.max_n1),dtype=np.float32)
+        #white noise inner products of the filters, see set_psr_inner_products
+        self.filter_sums = np.zeros((n_slice,14))
+        #partial inner products of each chunk of TOAs, see update_psr_filters
+        self.n_toa_chunk = cm.toa_chunks_per_thread*n_slice
+        self.toa_sums = np.zeros((n_slice,self.n_toa_chunk,14))
+        #fortran ordered (n2,5) right hand side of the triangular solve
+        self.dotTN5 = np.zeros((n_slice,5,self.max_n2))
+        #fortran ordered (n2,4) single precision projections of the filters for use_float32, copied into dotTN5
+        self.dotTN4_32 = np.zeros((n_slice,4,self.max_n2),dtype=np.float32)
+        #scalar arguments to lapack and blas have to be passed by pointer
+        self.lapack_ints = np.zeros((n_slice,8),dtype=np.int32)
+        self.blas_dbls = np.zeros((n_slice,2))
+        self.blas_flts = np.zeros((n_slice,2),dtype=np.float32)
+        self.omhat = np.zeros(3)
+
+        #largest time from the reference time for each pulsar, to decide if the series expansion of the phase can be used
+        self.toa_dt_maxs = np.zeros(Npsr)
+        for ii in range(Npsr):
+            self.toa_dt_maxs[ii] = np.max(np.abs(toas[ii]-cm.tref))
+        #always use the exact expressions unless switched on, see FastLikeMaster
+        self.use_phase_series = False
+
+        #scheduling, the most expensive pulsars go first
+        self.psr_costs = get_psr_filter_costs(TNvs)
+        self.total_cost = np.sum(self.psr_costs)
+        self.psr_order = np.argsort(-self.psr_costs,kind='mergesort')
+        self.in_idxs = np.zeros(Npsr,dtype=np.bool_)
+        self.bin_psrs = np.zeros(Npsr,dtype=np.int64)
+        self.bin_psrs_sorted = np.zeros(Npsr,dtype=np.int64)
+        self.psr_bins = np.zeros(Npsr,dtype=np.int64)
+        self.bin_loads = np.zeros(n_slice)
+        self.bin_starts = np.zeros(n_slice+1,dtype=np.int64)
+        self.bin_fill = np.zeros(n_slice,dtype=np.int64)
+
+        #no ECORR kernel until set_ecorr is called
+        self.use_ecorr = False
+        ecorr_epochs = List()
+        ecorr_ws = List()
+        ecorr_Qs = List()
+        ecorr_Nrs = List()
+        for ii in range(Npsr):
+            ecorr_epochs.append(np.zeros(0,dtype=np.int64))
+            ecorr_ws.append(np.zeros(0))
+            ecorr_Qs.append(np.zeros((0,0)))
+            ecorr_Nrs.append(np.zeros(0))
+        self.ecorr_epochs = ecorr_epochs
+        self.ecorr_ws = ecorr_ws
+        self.ecorr_Qs = ecorr_Qs
+        self.ecorr_Nrs = ecorr_Nrs
+        self.ecorr_sums = np.zeros((n_slice,4,0))
+
+    def set_ecorr(self,ecorr_epochs,ecorr_ws,ecorr_Qs,ecorr_Nrs):
+        """fold ECORR into the filter inner products with apply_ecorr_kernel, see FastLikeMaster.set_ecorr_kernel_info
+
+        :param ecorr_epochs:    List of the ECORR epoch of each TOA, -1 for TOAs in no epoch
+        :param ecorr_ws:        List of the Sherman-Morrison weights of each epoch
+        :param ecorr_Qs:        List of (number of epochs, n2) arrays of the epoch sums of the basis weighted by 1/N
+        :param ecorr_Nrs:       List of the epoch sums of the residuals weighted by 1/N
+        """
+        self.use_ecorr = True
+        self.ecorr_epochs = ecorr_epochs
+        self.ecorr_ws = ecorr_ws
+        self.ecorr_Qs = ecorr_Qs
+        self.ecorr_Nrs = ecorr_Nrs
+        max_n_epoch = 0
+        for ii in range(len(ecorr_ws)):
+            max_n_epoch = max(max_n_epoch,ecorr_ws[ii].size)
+        self.ecorr_sums = np.zeros((self.n_slice,4,max_n_epoch))
+
+@jitclass([('use_roq',nb.boolean),('has_roq',nb.boolean[::1]),('psr_done',nb.boolean[::1]),\
+           ('log10_fgw_bounds',nb.float64[::1]),('log10_mc_bounds',nb.float64[::1]),('L_maxs',nb.float64[::1]),\
+           ('node_toas',nb.types.ListType(nb.float64[::1])),('node_toas2',nb.types.ListType(nb.float64[::1])),\
+           ('w_nrs',nb.types.ListType(nb.complex128[::1])),('w_tns',nb.types.ListType(nb.complex128[:,::1])),('w_prods',nb.types.ListType(nb.complex128[::1]))])
+class ROQInfo:
+    """reduced order quadrature for the filter inner products of each pulsar, built by QuickROQHelpers.build_roq.
+    The complex filters (divided by the inverse squareroot N vectors) are interpolated from their values at the empirical interpolation nodes,
+    so the sums over TOAs become weighted sums over the nodes, with separate nodes for the products of two filters
+
+    :param has_roq:             Array indicating which pulsars have a quadrature
+    :param log10_fgw_bounds:    Range of log10 GW frequencies the quadrature is valid for
+    :param log10_mc_bounds:     Range of log10 chirp masses the quadrature is valid for
+    :param L_maxs:              Largest p_dist*(1-cosMu) in seconds the quadrature of each pulsar is valid for
+    :param node_toas:           List of arrays of the node times (relative to cm.tref) for the terms linear in the filters
+    :param node_toas2:          List of arrays of the node times (relative to cm.tref) for the products of two filters
+    :param w_nrs:               List of arrays of weights giving the sums of Nr times the filters
+    :param w_tns:               List of (number of nodes, n2) arrays of weights giving the projections of the filters onto the basis
+    :param w_prods:             List of arrays of weights giving the sums of products of two filters
+    """
+    def __init__(self,has_roq,log10_fgw_bounds,log10_mc_bounds,L_maxs,node_toas,node_toas2,w_nrs,w_tns,w_prods):
+        self.has_roq = has_roq
+        self.use_roq = np.any(has_roq)
+        self.psr_done = np.zeros(has_roq.size,dtype=np.bool_)
+        self.log10_fgw_bounds = log10_fgw_bounds
+        self.log10_mc_bounds = log10_mc_bounds
+        self.L_maxs = L_maxs
+        self.node_toas = node_toas
+        self.node_toas2 = node_toas2
+        self.w_nrs = w_nrs
+        self.w_tns = w_tns
+        self.w_prods = w_prods
+
+@jitclass([('n_slot',nb.int64),('n_used',nb.int64[::1]),('clocks',nb.int64[::1]),('keys',nb.float64[:,:,::1]),('last_used',nb.int64[:,::1]),\
+           ('chol_Sigma22s',nb.types.ListType(nb.float64[:,:,::1])),('phiinvs',nb.types.ListType(nb.float64[:,::1])),('logdets',nb.float64[:,::1]),\
+           ('n_hit',nb.int64[::1]),('n_miss',nb.int64[::1])])
+class SigmaCache:
+    """least recently used cache of the noise dependent trailing blocks of the Cholesky of Sigma, the phiinvs and the logdets of each pulsar,
+    keyed by exactly matching red noise and GWB parameters
+
+    :param n_slot:          Number of cached noise parameter sets per pulsar
+    :param chol_Sigma22s:   List of (n_slot, number of varying columns, number of varying columns) arrays to hold the Cholesky blocks
+    :param phiinvs:         List of (n_slot, number of columns) arrays to hold the phiinvs
+    """
+    def __init__(self,n_slot,chol_Sigma22s,phiinvs):
+        Npsr = len(phiinvs)
+        self.n_slot = n_slot
+        self.n_used = np.zeros(Npsr,dtype=np.int64)
+        self.clocks = np.zeros(Npsr,dtype=np.int64)
+        self.keys = np.zeros((Npsr,n_slot,4))
+        self.last_used = np.zeros((Npsr,n_slot),dtype=np.int64)
+        self.chol_Sigma22s = chol_Sigma22s
+        self.phiinvs = phiinvs
+        self.logdets = np.zeros((Npsr,n_slot))
+        self.n_hit = np.zeros(Npsr,dtype=np.int64)
+        self.n_miss = np.zeros(Npsr,dtype=np.int64)
+
+def get_SigmaCache(n_fixeds,TNTs,cache_mb):
+    """get a SigmaCache object with as many slots per pulsar as fit in a memory budget
+
+    :param n_fixeds:        Number of basis columns with a fixed prior for each pulsar
+    :param TNTs:            List of TNT matrices
+    :param cache_mb:        Memory budget in MB
+
+    :return cache:          SigmaCache object
+    """
+    n_cols = np.array([TNT.shape[0] for TNT in TNTs])
+    n_vars = n_cols-n_fixeds
+    slot_bytes = 8*np.sum(n_vars**2+n_cols+7)
+    n_slot = int(cache_mb*2**20//slot_bytes)
+    chol_Sigma22s = List()
+    phiinvs = List()
+    for i in range(n_cols.size):
+        chol_Sigma22s.append(np.zeros((n_slot,n_vars[i],n_vars[i])))
+        phiinvs.append(np.zeros((n_slot,n_cols[i])))
+    return SigmaCache(n_slot,chol_Sigma22s,phiinvs)
+
+def get_empty_ROQInfo(Npsr):
+    """get a ROQInfo object without any quadratures, so every pulsar uses the exact filters
+
+    :param Npsr:            Number of pulsars
+
+    :return roq:            ROQInfo object
+    """
+    node_toas = List()
+    node_toas2 = List()
+    w_nrs = List()
+    w_tns = List()
+    w_prods = List()
+    for i in range(Npsr):
+        node_toas.append(np.zeros(0))
+        node_toas2.append(np.zeros(0))
+        w_nrs.append(np.zeros(0,dtype=np.complex128))
+        w_tns.append(np.zeros((0,0),dtype=np.complex128))
+        w_prods.append(np.zeros(0,dtype=np.complex128))
+    return ROQInfo(np.zeros(Npsr,dtype=np.bool_),np.zeros(2),np.zeros(2),np.zeros(Npsr),node_toas,node_toas2,w_nrs,w_tns,w_prods)
+
+@jitclass([('n_bin',nb.int64),('tol',nb.float64),('check_every',nb.int64),('has_ref',nb.boolean),\
+           ('ref_w0',nb.float64),('ref_mc',nb.float64),('ref_cosMus',nb.float64[::1]),('ref_p_dists',nb.float64[::1]),\
+           ('bin_t0s',nb.float64[::1]),('bin_widths',nb.float64[::1]),\
+           ('nr_sums',nb.complex128[:,:,:,::1]),('prod_sums',nb.complex128[:,:,:,::1]),('tn_sums',nb.types.ListType(nb.complex128[:,:,:,::1])),\
+           ('ratios',nb.complex128[:,:,::1]),('psr_binned',nb.boolean[::1]),\
+           ('n_binned',nb.int64),('n_exact',nb.int64),('n_update',nb.int64),('n_check',nb.int64),('bias_sum',nb.float64),('bias_max',nb.float64)])
+class RelBinInfo:
+    """reference filters and per bin summary data for the relative binning approximation of the filter inner products,
+    the TOAs of each pulsar are split into n_bin bins of equal width in time
+
+    :param toas:            List of arrays of TOAs for each pulsar
+    :param tn_sums:         List of zeroed complex (2,2,n_bin,n2) arrays for each pulsar to hold the projections of the reference filters onto the basis
+    :param n_bin:           Number of bins per pulsar
+    :param n_slice:         Number of slices of the scratch space (the most worker threads that can run the kernels at once)
+    :param tol:             Largest allowed error of the linear interpolation of the filter ratios over a bin
+    :param check_every:     Number of relative binning updates between comparisons to the exact likelihood, 0 to never compare
+    """
+    def __init__(self,toas,tn_sums,n_bin,n_slice,tol,check_every):
+        Npsr = len(toas)
+        self.n_bin = n_bin
+        self.tol = tol
+        self.check_every = check_every
+        self.has_ref = False
+
+        self.ref_w0 = 0.
+        self.ref_mc = 0.
+        self.ref_cosMus = np.zeros(Npsr)
+        self.ref_p_dists = np.zeros(Npsr)
+
+        self.bin_t0s = np.zeros(Npsr)
+        self.bin_widths = np.ones(Npsr)
+        for ii in range(Npsr):
+            self.bin_t0s[ii] = np.min(toas[ii])-cm.tref
+            toa_span = np.max(toas[ii])-np.min(toas[ii])
+            if toa_span>0.:
+                self.bin_widths[ii] = toa_span/n_bin
+
+        #[psr,earth/pulsar term,sum/sum times fractional position,bin]
+        self.nr_sums = np.zeros((Npsr,2,2,n_bin),dtype=np.complex128)
+        #[psr,ee/e*conj(e)/pp/p*conj(p)/ep/e*conj(p),sum/sum times fractional position,bin]
+        self.prod_sums = np.zeros((Npsr,6,2,n_bin),dtype=np.complex128)
+        self.tn_sums = tn_sums
+        self.ratios = np.zeros((n_slice,8,n_bin+1),dtype=np.complex128)
+        self.psr_binned = np.zeros(Npsr,dtype=np.bool_)
+
+        self.n_binned = 0
+        self.n_exact = 0
+        self.n_update = 0
+        self.n_check = 0
+        self.bias_sum = 0.
+        self.bias_max = 0.
+
+    def add_bias_check(self,bias):
+        """record the absolute log likelihood difference between a relative binning update and the exact one"""
+        self.n_check += 1
+        self.bias_sum += bias
+        self.bias_max = max(self.bias_max,bias)
+
+@njit()
+def copy_chol_Sigma(chol_src,chol_dst):
+    """copy the values of one Cholesky factor of Sigma into another of the same shape
+
+    :param chol_src:    Fortran ordered array to copy from
+    :param chol_dst:    Fortran ordered array to copy to
+    """
+    #explicit loop over the flattened factor is several times faster than the 2d slice assignment in numba
+    flat_src = chol_src.T.reshape(-1)
+    flat_dst = chol_dst.T.reshape(-1)
+    for itrk in range(flat_src.size):
+        flat_dst[itrk] = flat_src[itrk]
+
+@jitclass([('chols',nb.types.ListType(nb.types.ListType(nb.float64[::1,:]))),('phiinvs',nb.types.ListType(nb.types.ListType(nb.float64[::1]))),\
+           ('keys',nb.types.ListType(nb.types.ListType(nb.float64[::1]))),('logdets',nb.types.ListType(nb.types.ListType(nb.float64))),\
+           ('refcounts',nb.types.ListType(nb.types.ListType(nb.int64))),('n_shared',nb.int64[::1])])
+class CholStore:
+    """reference counted store of the Cholesky factors of Sigma shared by all the FastLikeInfo objects of a FastLikeMaster,
+    which hold a handle (slot index) per pulsar instead of their own factors.
+    A slot can be shared while its key, the exact red noise and GWB parameters it was factorized at, is valid (not nan),
+    and slots that are no longer referenced are reused for new factors
+
+    :param chols:           List for each pulsar of the Cholesky factors in each slot
+    :param phiinvs:         List for each pulsar of the permuted phiinvs in each slot
+    :param keys:            List for each pulsar of the noise parameters of each slot from get_noise_keys
+    :param logdets:         List for each pulsar of the logdet contribution in each slot
+    :param refcounts:       List for each pulsar of the number of references to each slot
+    """
+    def __init__(self,chols,phiinvs,keys,logdets,refcounts):
+        self.chols = chols
+        self.phiinvs = phiinvs
+        self.keys = keys
+        self.logdets = logdets
+        self.refcounts = refcounts
+        self.n_shared = np.zeros(len(chols),dtype=np.int64)
+
+    def new_slot(self,ii,chol_src,phiinv_src):
+        """get an unreferenced slot of pulsar ii holding a copy of chol_src and phiinv_src with an invalid key and a reference count of 1,
+        adding a slot if all of them are referenced
+
+        :param ii:              Pulsar index
+        :param chol_src:        Cholesky factor to copy, including the leading columns of the fixed priors
+        :param phiinv_src:      phiinv to copy
+
+        :return slot:           Index of the slot
+        """
+        slot = -1
+        for itrs in range(len(self.refcounts[ii])):
+            if self.refcounts[ii][itrs]==0:
+                slot = itrs
+                break
+        if slot<0:
+            slot = len(self.refcounts[ii])
+            self.chols[ii].append(np.zeros((chol_src.shape[1],chol_src.shape[0])).T)
+            self.phiinvs[ii].append(np.zeros(phiinv_src.size))
+            self.keys[ii].append(np.full(4,np.nan))
+            self.logdets[ii].append(0.)
+            self.refcounts[ii].append(0)
+        copy_chol_Sigma(chol_src,self.chols[ii][slot])
+        self.phiinvs[ii][slot][:] = phiinv_src
+        self.keys[ii][slot][:] = np.nan
+        self.refcounts[ii][slot] = 1
+        return slot
+
+    def find_slot(self,ii,key):
+        """find a slot of pulsar ii factorized at exactly the noise parameters key, -1 if there is none"""
+        for slot in range(len(self.keys[ii])):
+            if np.all(self.keys[ii][slot]==key):
+                return slot
+        return -1
+
+    def count_slots(self):
+        """get the total number of slots and the number of them that are referenced over all pulsars"""
+        n_slot = 0
+        n_live = 0
+        for ii in range(len(self.refcounts)):
+            for slot in range(len(self.refcounts[ii])):
+                n_slot += 1
+                if self.refcounts[ii][slot]>0:
+                    n_live += 1
+        return n_slot,n_live
+
+def get_CholStore(Npsr):
+    """get an empty CholStore object, the slots are added by FastLikeMaster.get_new_FastLike and as needed afterwards
+
+    :param Npsr:            Number of pulsars
+
+    :return chol_store:     CholStore object
+    """
+    chols = List()
+    phiinvs = List()
+    keys = List()
+    logdets = List()
+    refcounts = List()
+    for i in range(Npsr):
+        chols.append(List.empty_list(nb.float64[::1,:]))
+        phiinvs.append(List.empty_list(nb.float64[::1]))
+        keys.append(List.empty_list(nb.float64[::1]))
+        logdets.append(List.empty_list(nb.float64))
+        refcounts.append(List.empty_list(nb.int64))
+    return CholStore(chols,phiinvs,keys,logdets,refcounts)
+
 @jitclass([('resres',nb.float64),('logdet',nb.float64),('resres_array',nb.float64[:]),('logdet_array',nb.float64[:]),('logdet_base',nb.float64),('logdet_base_orig',nb.float64),\
            ('pos',nb.float64[:,::1]),('pdist',nb.float64[:,::1]),('toas',nb.types.ListType(nb.types.float64[::1])),('Npsr',nb.int64),('max_toa',nb.float64),\
            ('phiinvs',nb.types.ListType(nb.types.float64[::1])),('dotTNrs',nb.types.ListType(nb.types.float64[::1])),('Nvecs',nb.types.ListType(nb.types.float64[::1])),\
@@ -888,7 +2873,15 @@ def update_intrinsic_params(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,SigmaTNrProds
            ('MMs',nb.float64[:,:,::1]),('NN',nb.float64[:,::1]),\
            ('cos_gwtheta',nb.float64),('gwphi',nb.float64),('log10_fgw',nb.float64),('log10_mc',nb.float64),('cw_p_dists',nb.float64[:]),\
            ('gwb_gamma',nb.float64),('gwb_log10_A',nb.float64),('rn_gammas',nb.float64[:]),('rn_log10_As',nb.float64[:]),
-           ('includeCW',nb.boolean),('prior_recovery',nb.boolean)])
+           ('F_ps',nb.float64[:]),('F_cs',nb.float64[:]),('amp_psr_facs',nb.float64[:]),('ws',FilterWorkspace.class_type.instance_type),\
+           ('TNvs32',nb.types.ListType(nb.types.float32[::1,:])),('isqrNvecs32',nb.types.ListType(nb.types.float32[::1])),('use_float32',nb.boolean),('roq',ROQInfo.class_type.instance_type),
+           ('includeCW',nb.boolean),('prior_recovery',nb.boolean),\
+           ('in_transaction',nb.boolean),('undo_n',nb.int64),('undo_idxs',nb.int64[::1]),('undo_logged',nb.boolean[::1]),('undo_noise_logged',nb.boolean[::1]),\
+           ('undo_MMs',nb.float64[:,:,::1]),('undo_NN',nb.float64[:,::1]),('undo_resres_array',nb.float64[::1]),('undo_logdet_array',nb.float64[::1]),\
+           ('chol_store',CholStore.class_type.instance_type),('chol_handles',nb.int64[::1]),\
+           ('undo_chol_handles',nb.int64[::1]),('undo_phiinvs',nb.types.ListType(nb.types.float64[::1])),\
+           ('undo_scalars',nb.float64[::1]),('undo_rn_gammas',nb.float64[::1]),('undo_rn_log10_As',nb.float64[::1]),('undo_cw_p_dists',nb.float64[::1]),\
+           ('undo_F_ps',nb.float64[::1]),('undo_F_cs',nb.float64[::1]),('undo_amp_psr_facs',nb.float64[::1])])
 class FastLikeInfo:
     """simple jitclass to store the various elements of fast likelihood calculation in a way that can be accessed quickly from a numba environment
 
@@ -901,15 +2894,28 @@ class FastLikeInfo:
     :param max_toa:         Maximum TOA over all pulsars
     :param x0:              CWInfo object
     :param Npsr:            Number of pulsars
-    :param isqrNvecs:       Inverse squareroot of N vectors
-    :param TNvs:            T vectros times inverse squareroot N vectors
+    :param isqrNvecs:       Inverse squareroot of N vectors (hold placeholders once use_float32 passed the startup check of FastLikeMaster)
+    :param TNvs:            T vectros times inverse squareroot N vectors (hold placeholders once use_float32 passed the startup check of FastLikeMaster)
     :param dotTNrs:         Precalculated dot product of Nrs and TNvs
-    :param chol_Sigmas:     List of Cholesky decompositions of Sigma matrices
+    :param chol_store:      CholStore object holding the Cholesky decompositions of Sigma matrices
+    :param chol_handles:    Slot of chol_store with the Cholesky decomposition of each pulsar, each one already counted as a reference
     :param phiinvs:         List of phiinv matrices
+    :param ws:              FilterWorkspace object with the scratch space for the filter kernels
+    :param TNvs32:          Single precision copy of TNvs (hold placeholders if use_float32 is False)
+    :param isqrNvecs32:     Single precision copy of isqrNvecs (hold placeholders if use_float32 is False)
+    :param roq:             ROQInfo object with the reduced order quadratures of the filter inner products (may not have any)
+    :param use_float32:     If True, use the single precision filter path [False]
     :param includeCW:       Switch if we want to include the contribution of the CW signal or not [True]
     :param prior_recovery:  If True, we return constant likelihood to be used for prior recovery diagnostic test [False]
+
+    Mutations can be grouped in a transaction with begin(), then undone with rollback() or kept with commit().
+    Inside a transaction the per pulsar state is recorded in an undo log the first time a pulsar is touched,
+    so rolling back costs only as much as the number of pulsars modified.
+
+    The Cholesky decompositions are views of slots in a CholStore shared with the other FastLikeInfo objects of the same FastLikeMaster,
+    so they must only be overwritten in place after own_chols.
     """
-    def __init__(self,logdet_base,pos,pdist,toas,Nvecs,Nrs,max_toa,x0,Npsr,isqrNvecs,TNvs,dotTNrs,chol_Sigmas,phiinvs,includeCW=True,prior_recovery=False):
+    def __init__(self,logdet_base,pos,pdist,toas,Nvecs,Nrs,max_toa,x0,Npsr,isqrNvecs,TNvs,dotTNrs,chol_store,chol_handles,phiinvs,ws,TNvs32,isqrNvecs32,roq,use_float32=False,includeCW=True,prior_recovery=False):
         self.resres = 0. #compute internally
         self.logdet = 0.
         self.resres_array = np.zeros(Npsr)
@@ -932,11 +2938,49 @@ class FastLikeInfo:
         self.isqrNvecs = isqrNvecs
         self.Nrs = Nrs
         self.TNvs = TNvs
+        self.chol_store = chol_store
+        self.chol_handles = chol_handles
+        chol_Sigmas = List()
+        for ii in range(Npsr):
+            chol_Sigmas.append(chol_store.chols[ii][chol_handles[ii]])
         self.chol_Sigmas = chol_Sigmas
+        self.ws = ws
+        self.TNvs32 = TNvs32
+        self.isqrNvecs32 = isqrNvecs32
+        self.use_float32 = use_float32
+        self.roq = roq
 
         self.MMs = np.zeros((Npsr,4,4))
         self.NN = np.zeros((Npsr,4))
-        
+
+        #antenna patterns and pulsar term amplitudes only change with the shape parameters, so cache them
+        self.F_ps = np.zeros(Npsr)
+        self.F_cs = np.zeros(Npsr)
+        self.amp_psr_facs = np.zeros(Npsr)
+
+        #undo log of the transaction api, the Cholesky decompositions are kept alive by holding a reference to their slots
+        self.in_transaction = False
+        self.undo_n = 0
+        self.undo_idxs = np.zeros(Npsr,dtype=np.int64)
+        self.undo_logged = np.zeros(Npsr,dtype=np.bool_)
+        self.undo_noise_logged = np.zeros(Npsr,dtype=np.bool_)
+        self.undo_MMs = np.zeros((Npsr,4,4))
+        self.undo_NN = np.zeros((Npsr,4))
+        self.undo_resres_array = np.zeros(Npsr)
+        self.undo_logdet_array = np.zeros(Npsr)
+        self.undo_chol_handles = np.zeros(Npsr,dtype=np.int64)
+        undo_phiinvs = List()
+        for ii in range(Npsr):
+            undo_phiinvs.append(np.zeros(phiinvs[ii].size))
+        self.undo_phiinvs = undo_phiinvs
+        self.undo_scalars = np.zeros(9)
+        self.undo_rn_gammas = np.zeros(Npsr)
+        self.undo_rn_log10_As = np.zeros(Npsr)
+        self.undo_cw_p_dists = np.zeros(Npsr)
+        self.undo_F_ps = np.zeros(Npsr)
+        self.undo_F_cs = np.zeros(Npsr)
+        self.undo_amp_psr_facs = np.zeros(Npsr)
+
         self.update_intrinsic_params(x0)
         
         self.includeCW=includeCW
@@ -954,7 +2998,31 @@ class FastLikeInfo:
         assert self.log10_fgw==x0.log10_fgw
         assert self.log10_mc==x0.log10_mc
 
-        return get_lnlikelihood_helper(x0,self.resres,self.logdet,self.pos,self.pdist,self.NN,self.MMs,includeCW=self.includeCW,prior_recovery=self.prior_recovery)
+        return get_lnlikelihood_helper(x0,self.resres,self.logdet,self.F_ps,self.F_cs,self.amp_psr_facs,self.NN,self.MMs,includeCW=self.includeCW,prior_recovery=self.prior_recovery)
+
+    def get_lnlikelihood_batch(self,cos_incs,log10_hs,phase0s,psis,cw_p_phases):
+        """get the log likelihood at many sets of projection parameters at the current shape parameters without touching a CWInfo object
+
+        :param cos_incs:        Array of cosine inclinations
+        :param log10_hs:        Array of log10 strain amplitudes
+        :param phase0s:         Array of initial earth term phases
+        :param psis:            Array of polarization angles
+        :param cw_p_phases:     (number of rows, number of pulsars) array of pulsar phases
+
+        :return log_Ls:         Array of log likelihood values
+        """
+        assert log10_hs.size==cos_incs.size
+        assert phase0s.size==cos_incs.size
+        assert psis.size==cos_incs.size
+        assert cw_p_phases.shape[0]==cos_incs.size
+        assert cw_p_phases.shape[1]==self.Npsr
+
+        return get_lnlikelihood_batch_helper(self.log10_fgw,cos_incs,log10_hs,phase0s,psis,cw_p_phases,self.resres,self.logdet,self.F_ps,self.F_cs,self.amp_psr_facs,self.NN,self.MMs,
+                                             includeCW=self.includeCW,prior_recovery=self.prior_recovery)
+
+    def update_antenna_cache(self,x0,psr_idxs):
+        """recalculate the cached antenna patterns and pulsar term amplitudes for the specified pulsars"""
+        get_antenna_cache_helper(x0,self.pos,self.pdist,self.F_ps,self.F_cs,self.amp_psr_facs,psr_idxs)
 
     def update_pulsar_distance(self,x0,psr_idx):
         """recalculate MM and NN only for the affected pulsar if we only change a single pulsar distance"""
@@ -977,10 +3045,12 @@ class FastLikeInfo:
         assert np.all(self.rn_log10_As==x0.rn_log10_As)
         assert np.all(self.cw_p_dists[:psr_idx]==x0.cw_p_dists[:psr_idx])
         assert np.all(self.cw_p_dists[psr_idx:]==x0.cw_p_dists[psr_idx:])
+        self.log_psrs(np.array([psr_idx]))
         resres_old = self.resres_array.copy()
-        update_intrinsic_params2(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas, self.NN, self.MMs,self.TNvs,self.chol_Sigmas,np.array([psr_idx]),self.resres_array,self.dotTNrs)
+        update_intrinsic_params2(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas, self.NN, self.MMs,self.TNvs,self.chol_Sigmas,np.array([psr_idx]),self.resres_array,self.dotTNrs,self.TNvs32,self.isqrNvecs32,self.use_float32,self.ws,self.roq)
         #protect from incorrectly overwriting
         self.cw_p_dists[psr_idx] = x0.cw_p_dists[psr_idx]
+        self.update_antenna_cache(x0,np.array([psr_idx]))
         self.resres_array[:] = resres_old
         self.set_resres_logdet(resres_old,self.logdet_array,self.logdet_base)
         #assert np.all(resres_old==self.resres_array)
@@ -1006,11 +3076,13 @@ class FastLikeInfo:
             assert np.all(self.rn_log10_As==x0.rn_log10_As)
         #leave dist_only in even though it is not currently respected in case it turns out to be faster later
         #resres_temp = self.resres_array.copy()
+        self.log_psrs(psr_idxs)
         resres_old = self.resres_array.copy()
         if not self.prior_recovery:
-            update_intrinsic_params2(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas, self.NN, self.MMs,self.TNvs,self.chol_Sigmas,psr_idxs,self.resres_array,self.dotTNrs)
+            update_intrinsic_params2(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas, self.NN, self.MMs,self.TNvs,self.chol_Sigmas,psr_idxs,self.resres_array,self.dotTNrs,self.TNvs32,self.isqrNvecs32,self.use_float32,self.ws,self.roq)
         #protect from incorrectly overwriting
         self.cw_p_dists[:] = x0.cw_p_dists.copy()
+        self.update_antenna_cache(x0,psr_idxs)
         if not self.prior_recovery:
             self.set_resres_logdet(resres_old,self.logdet_array,self.logdet_base)
 
@@ -1041,10 +3113,11 @@ class FastLikeInfo:
     def update_intrinsic_params(self,x0):
         """Recalculate filters with updated intrinsic parameters - not quite the same as the setup, since a few things are already stored"""
         #TODO ensure complete consistency with handling of resres
+        self.log_psrs(np.arange(self.Npsr))
         resres_temp = self.resres_array.copy()
         
         if not self.prior_recovery:
-            update_intrinsic_params2(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas, self.NN, self.MMs,self.TNvs,self.chol_Sigmas,np.arange(x0.Npsr),resres_temp,self.dotTNrs)
+            update_intrinsic_params2(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas, self.NN, self.MMs,self.TNvs,self.chol_Sigmas,np.arange(x0.Npsr),resres_temp,self.dotTNrs,self.TNvs32,self.isqrNvecs32,self.use_float32,self.ws,self.roq)
 
             self.set_resres_logdet(resres_temp,self.logdet_array,self.logdet_base)
         #track the intrinsic parameters this was set at so we can throw in error if they are inconsistent with an input x0
@@ -1057,13 +3130,48 @@ class FastLikeInfo:
         self.log10_fgw = x0.log10_fgw
         self.log10_mc = x0.log10_mc
         self.cw_p_dists = x0.cw_p_dists.copy()
+        self.update_antenna_cache(x0,np.arange(x0.Npsr))
+
+    def set_rel_bin_reference(self,x0,rbi):
+        """use the filters at the shape parameters in x0 as the reference of the relative binning info rbi"""
+        set_rel_bin_reference_helper(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas,self.TNvs,self.ws,rbi)
+
+    def update_intrinsic_params_rel_bin(self,x0,rbi):
+        """Recalculate filters with updated intrinsic parameters like update_intrinsic_params, but using relative binning against the reference in rbi
+        if it is accurate enough. Every rbi.check_every calls the exact filters are computed as well to track the bias, and those are kept"""
+        if self.prior_recovery or not rbi.has_ref:
+            self.update_intrinsic_params(x0)
+            return
+
+        self.log_psrs(np.arange(self.Npsr))
+        resres_temp = self.resres_array.copy()
+        update_intrinsic_params_rel_bin(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas, self.NN, self.MMs,self.TNvs,self.chol_Sigmas,np.arange(x0.Npsr),resres_temp,self.dotTNrs,self.TNvs32,self.isqrNvecs32,self.use_float32,self.ws,self.roq,rbi)
+        self.set_resres_logdet(resres_temp,self.logdet_array,self.logdet_base)
+        #track the intrinsic parameters this was set at so we can throw in error if they are inconsistent with an input x0
+        self.gwb_gamma = x0.gwb_gamma
+        self.gwb_log10_A = x0.gwb_log10_A
+        self.rn_gammas = x0.rn_gammas.copy()
+        self.rn_log10_As = x0.rn_log10_As.copy()
+        self.cos_gwtheta = x0.cos_gwtheta
+        self.gwphi = x0.gwphi
+        self.log10_fgw = x0.log10_fgw
+        self.log10_mc = x0.log10_mc
+        self.cw_p_dists = x0.cw_p_dists.copy()
+        self.update_antenna_cache(x0,np.arange(x0.Npsr))
+
+        rbi.n_update += 1
+        if rbi.check_every>0 and rbi.n_update%rbi.check_every==0:
+            log_L_rel_bin = self.get_lnlikelihood(x0)
+            self.update_intrinsic_params(x0)
+            rbi.add_bias_check(np.abs(self.get_lnlikelihood(x0)-log_L_rel_bin))
 
     def update_red_noise(self,x0,psr_idxs):
         """recalculate MM and NN only for the affected pulsars of red noise update - almost same as update_pulsar_distances but with different asserts and param updates"""
+        self.log_psrs(psr_idxs)
         resres_temp = self.resres_array.copy()
 
         if not self.prior_recovery:
-            update_intrinsic_params2(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas, self.NN, self.MMs,self.TNvs,self.chol_Sigmas,psr_idxs,resres_temp,self.dotTNrs)
+            update_intrinsic_params2(x0,self.isqrNvecs,self.Nrs,self.pos,self.pdist,self.toas, self.NN, self.MMs,self.TNvs,self.chol_Sigmas,psr_idxs,resres_temp,self.dotTNrs,self.TNvs32,self.isqrNvecs32,self.use_float32,self.ws,self.roq)
 
             self.set_resres_logdet(resres_temp,self.logdet_array,self.logdet_base)
         #track the intrinsic parameters this was set at so we can throw in error if they are inconsistent with an input x0
@@ -1076,6 +3184,7 @@ class FastLikeInfo:
         self.log10_fgw = x0.log10_fgw
         self.log10_mc = x0.log10_mc
         self.cw_p_dists = x0.cw_p_dists.copy()
+        self.update_antenna_cache(x0,np.arange(x0.Npsr))
 
         #assert self.cos_gwtheta==x0.cos_gwtheta
         #assert self.gwphi==x0.gwphi
@@ -1113,6 +3222,216 @@ class FastLikeInfo:
         self.resres = np.sum(resres_array)
         self.logdet = self.logdet_base+np.sum(self.logdet_array)
 
+    def begin(self):
+        """start a transaction, until commit or rollback the state of every pulsar touched by the methods of this class
+        (or by FastLikeMaster.recompute_FastLike) is recorded in the undo log before it is first modified
+        the parameters and antenna cache are only a few numbers per pulsar so they are saved whole"""
+        assert not self.in_transaction
+        self.in_transaction = True
+        self.undo_n = 0
+        self.undo_scalars[0] = self.resres
+        self.undo_scalars[1] = self.logdet
+        self.undo_scalars[2] = self.logdet_base
+        self.undo_scalars[3] = self.cos_gwtheta
+        self.undo_scalars[4] = self.gwphi
+        self.undo_scalars[5] = self.log10_fgw
+        self.undo_scalars[6] = self.log10_mc
+        self.undo_scalars[7] = self.gwb_gamma
+        self.undo_scalars[8] = self.gwb_log10_A
+        self.undo_rn_gammas[:] = self.rn_gammas
+        self.undo_rn_log10_As[:] = self.rn_log10_As
+        self.undo_cw_p_dists[:] = self.cw_p_dists
+        self.undo_F_ps[:] = self.F_ps
+        self.undo_F_cs[:] = self.F_cs
+        self.undo_amp_psr_facs[:] = self.amp_psr_facs
+
+    def log_psrs(self,psr_idxs):
+        """record MM, NN, resres and logdet of the specified pulsars in the undo log if they are not already, does nothing outside a transaction"""
+        if not self.in_transaction:
+            return
+        for ii in psr_idxs:
+            if self.undo_logged[ii]:
+                continue
+            self.undo_logged[ii] = True
+            self.undo_idxs[self.undo_n] = ii
+            self.undo_n += 1
+            self.undo_MMs[ii] = self.MMs[ii]
+            self.undo_NN[ii] = self.NN[ii]
+            self.undo_resres_array[ii] = self.resres_array[ii]
+            self.undo_logdet_array[ii] = self.logdet_array[ii]
+
+    def log_psrs_noise(self,psr_idxs):
+        """like log_psrs, but also record the Cholesky factors of Sigma and phiinvs of the specified pulsars"""
+        if not self.in_transaction:
+            return
+        self.log_psrs(psr_idxs)
+        for ii in psr_idxs:
+            if self.undo_noise_logged[ii]:
+                continue
+            self.undo_noise_logged[ii] = True
+            #the extra reference makes own_chols copy the factor before anything overwrites it
+            self.undo_chol_handles[ii] = self.chol_handles[ii]
+            self.chol_store.refcounts[ii][self.chol_handles[ii]] += 1
+            self.undo_phiinvs[ii][:] = self.phiinvs[ii]
+
+    def set_psr_rows(self,psr_idx,MM,NN,resres,logdet):
+        """set MM, NN, resres and logdet of a single pulsar, recording the old ones if in a transaction"""
+        self.log_psrs(np.array([psr_idx]))
+        self.MMs[psr_idx] = MM
+        self.NN[psr_idx] = NN
+        self.resres_array[psr_idx] = resres
+        self.logdet_array[psr_idx] = logdet
+        self.set_resres_logdet(self.resres_array,self.logdet_array,self.logdet_base)
+
+    def drop_resres_logdet(self,psr_idxs):
+        """zero resres and logdet of the specified pulsars and logdet_base, so only the terms that depend on the CW signal are left in the likelihood"""
+        self.log_psrs(psr_idxs)
+        for ii in psr_idxs:
+            self.resres_array[ii] = 0.
+            self.logdet_array[ii] = 0.
+        self.set_resres_logdet(self.resres_array,self.logdet_array,0.)
+
+    def clear_psrs(self,psr_idxs):
+        """zero all contributions of the specified pulsars and logdet_base to the likelihood"""
+        self.log_psrs(psr_idxs)
+        for ii in psr_idxs:
+            self.MMs[ii] = 0.
+            self.NN[ii] = 0.
+        self.drop_resres_logdet(psr_idxs)
+
+    def commit(self):
+        """end the transaction keeping all the changes made since begin"""
+        assert self.in_transaction
+        for itr in range(self.undo_n):
+            ii = self.undo_idxs[itr]
+            if self.undo_noise_logged[ii]:
+                self.chol_store.refcounts[ii][self.undo_chol_handles[ii]] -= 1
+            self.undo_logged[ii] = False
+            self.undo_noise_logged[ii] = False
+        self.undo_n = 0
+        self.in_transaction = False
+
+    def rollback(self):
+        """end the transaction reverting all the changes made since begin, only the pulsars in the undo log are touched"""
+        assert self.in_transaction
+        for itr in range(self.undo_n):
+            ii = self.undo_idxs[itr]
+            self.MMs[ii] = self.undo_MMs[ii]
+            self.NN[ii] = self.undo_NN[ii]
+            self.resres_array[ii] = self.undo_resres_array[ii]
+            self.logdet_array[ii] = self.undo_logdet_array[ii]
+            if self.undo_noise_logged[ii]:
+                self.set_chol_handle(ii,self.undo_chol_handles[ii])
+                self.phiinvs[ii][:] = self.undo_phiinvs[ii]
+
+        #the sums were consistent with the arrays at begin, so restore them directly instead of summing again
+        self.resres = self.undo_scalars[0]
+        self.logdet = self.undo_scalars[1]
+        self.logdet_base = self.undo_scalars[2]
+        self.cos_gwtheta = self.undo_scalars[3]
+        self.gwphi = self.undo_scalars[4]
+        self.log10_fgw = self.undo_scalars[5]
+        self.log10_mc = self.undo_scalars[6]
+        self.gwb_gamma = self.undo_scalars[7]
+        self.gwb_log10_A = self.undo_scalars[8]
+        self.rn_gammas = self.undo_rn_gammas.copy()
+        self.rn_log10_As = self.undo_rn_log10_As.copy()
+        self.cw_p_dists = self.undo_cw_p_dists.copy()
+        self.F_ps[:] = self.undo_F_ps
+        self.F_cs[:] = self.undo_F_cs
+        self.amp_psr_facs[:] = self.undo_amp_psr_facs
+
+        self.commit()
+
+    def set_chol_handle(self,ii,slot):
+        """point the Cholesky decomposition of pulsar ii to a slot of the store, moving the reference from the old slot"""
+        self.chol_store.refcounts[ii][slot] += 1
+        self.chol_store.refcounts[ii][self.chol_handles[ii]] -= 1
+        self.chol_handles[ii] = slot
+        self.chol_Sigmas[ii] = self.chol_store.chols[ii][slot]
+
+    def share_chols(self,keys,mask):
+        """for every pulsar not masked that was already factorized at its noise parameters in keys by any user of the store,
+        point to that factor and copy its phiinv and logdet, so it does not have to be factorized again
+
+        :param keys:            Noise parameters of each pulsar from get_noise_keys
+        :param mask:            Skip pulsars where this is True
+
+        :return mask_new:       mask with the pulsars that could share a factor also masked
+        """
+        mask_new = mask.copy()
+        for ii in range(self.Npsr):
+            if mask[ii]:
+                continue
+            slot = self.chol_store.find_slot(ii,keys[ii])
+            if slot<0:
+                continue
+            if slot!=self.chol_handles[ii]:
+                self.chol_store.n_shared[ii] += 1
+            self.set_chol_handle(ii,slot)
+            self.phiinvs[ii][:] = self.chol_store.phiinvs[ii][slot]
+            self.logdet_array[ii] = self.chol_store.logdets[ii][slot]
+            mask_new[ii] = True
+        return mask_new
+
+    def own_chols(self,psr_idxs):
+        """make sure nothing else references the Cholesky decompositions of the specified pulsars, copying them to new slots if needed,
+        so they can be overwritten in place, and invalidate their keys until set_chol_keys"""
+        for ii in psr_idxs:
+            slot = self.chol_handles[ii]
+            if self.chol_store.refcounts[ii][slot]>1:
+                slot_new = self.chol_store.new_slot(ii,self.chol_Sigmas[ii],self.phiinvs[ii])
+                self.chol_store.refcounts[ii][slot] -= 1
+                self.chol_handles[ii] = slot_new
+                self.chol_Sigmas[ii] = self.chol_store.chols[ii][slot_new]
+            else:
+                self.chol_store.keys[ii][slot][:] = np.nan
+
+    def set_chol_keys(self,keys,psr_idxs):
+        """record in the store that the Cholesky decompositions, phiinvs and logdets of the specified pulsars are at the noise parameters in keys,
+        so other FastLikeInfo objects can share them"""
+        for ii in psr_idxs:
+            slot = self.chol_handles[ii]
+            self.chol_store.keys[ii][slot][:] = keys[ii]
+            self.chol_store.phiinvs[ii][slot][:] = self.phiinvs[ii]
+            self.chol_store.logdets[ii][slot] = self.logdet_array[ii]
+
+@njit()
+def sync_FLI_buffer(FLI_src,FLI_dst,psr_idxs):
+    """make FLI_dst a copy of the state of FLI_src, assuming the noise blocks already match except for the pulsars in psr_idxs
+    the per pulsar filter inner products and parameters are always copied, the phiinvs only for psr_idxs,
+    and FLI_dst shares the Cholesky factors of FLI_src for psr_idxs
+
+    :param FLI_src:     FastLikeInfo object to copy from
+    :param FLI_dst:     FastLikeInfo object created from the same FastLikeMaster to copy to
+    :param psr_idxs:    Indices of the pulsars whose chol_Sigmas and phiinvs differ between FLI_src and FLI_dst
+    """
+    for ii in psr_idxs:
+        FLI_dst.set_chol_handle(ii,FLI_src.chol_handles[ii])
+        FLI_dst.phiinvs[ii][:] = FLI_src.phiinvs[ii]
+
+    FLI_dst.MMs[:] = FLI_src.MMs
+    FLI_dst.NN[:] = FLI_src.NN
+    FLI_dst.resres_array[:] = FLI_src.resres_array
+    FLI_dst.logdet_array[:] = FLI_src.logdet_array
+    FLI_dst.logdet_base = FLI_src.logdet_base
+    FLI_dst.resres = FLI_src.resres
+    FLI_dst.logdet = FLI_src.logdet
+
+    FLI_dst.F_ps[:] = FLI_src.F_ps
+    FLI_dst.F_cs[:] = FLI_src.F_cs
+    FLI_dst.amp_psr_facs[:] = FLI_src.amp_psr_facs
+
+    FLI_dst.gwb_gamma = FLI_src.gwb_gamma
+    FLI_dst.gwb_log10_A = FLI_src.gwb_log10_A
+    FLI_dst.rn_gammas = FLI_src.rn_gammas.copy()
+    FLI_dst.rn_log10_As = FLI_src.rn_log10_As.copy()
+    FLI_dst.cos_gwtheta = FLI_src.cos_gwtheta
+    FLI_dst.gwphi = FLI_src.gwphi
+    FLI_dst.log10_fgw = FLI_src.log10_fgw
+    FLI_dst.log10_mc = FLI_src.log10_mc
+    FLI_dst.cw_p_dists = FLI_src.cw_p_dists.copy()
+
 @njit()
 def isclose(a,b,rtol=1.e-5,atol=1.e-8):
     """check if close in same way as np.isclose
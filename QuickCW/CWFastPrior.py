@@ -387,6 +387,7 @@ def get_lnprior_helper(x0, uniform_par_ids, uniform_lows, uniform_highs,\
 
     return log_prior
 
+@njit()
 def get_lnprior(x0,FPI):
     """wrapper to get lnprior from jitted helper
 
@@ -403,6 +404,7 @@ def get_lnprior(x0,FPI):
                                          FPI.global_common)
 
 
+@njit()
 def get_lnprior_array(samples,FPI):
     """wrapper to get lnprior from jitted helper
 
@@ -502,6 +504,7 @@ def get_lnprior_helper_array(x0s, uniform_par_ids, uniform_lows, uniform_highs,\
 
     return log_priors
 
+@njit()
 def get_sample_idxs(old_point,idx_choose,FPI):
     """get just some indexes drawn from a prior
 
@@ -518,6 +521,7 @@ def get_sample_idxs(old_point,idx_choose,FPI):
 
     return new_point
 
+@njit()
 def get_sample_full(n_par,FPI):
     """helper to get a full prior draw sample
 
@@ -95,6 +95,43 @@ def print_acceptance_progress(itrn,N,n_int_block,a_yes,a_no,t_itr,ti_loop,tf1_lo
             print(str_build)
 
 
+def print_mt_try_progress(n_tries,mt_ess,frozen,like_counts):
+    """print the number of multiple tries of each chain, the effective sample size of their weights
+    and the fraction of their likelihoods skipped because the try has zero prior density
+
+    :param n_tries:     Number of multiple tries of each chain
+    :param mt_ess:      Mean effective sample size of the multiple try weights of each chain over the last tuning window, nan if not measured yet
+    :param frozen:      True if the number of tries is no longer tuned
+    :param like_counts: (n_chain, 2) array of the number of multiple try likelihoods evaluated and skipped for zero prior density
+    """
+    if frozen:
+        print("Multiple tries per chain (fixed) and effective sample size of their weights")
+    else:
+        print("Multiple tries per chain (tuning) and effective sample size of their weights")
+    str_build = "%-13s "%"Tries"
+    for itrc in range(n_tries.size):
+        str_build += " %9d "%n_tries[itrc]
+    print(str_build)
+
+    str_build = "%-13s "%"Weight ESS"
+    for itrc in range(n_tries.size):
+        if np.isnan(mt_ess[itrc]):
+            str_build += " No Trials "
+        else:
+            str_build += " %9.2f "%mt_ess[itrc]
+    print(str_build)
+
+    str_build = "%-13s "%"Prior Skips"
+    for itrc in range(n_tries.size):
+        n_like = like_counts[itrc,0]+like_counts[itrc,1]
+        if n_like==0:
+            str_build += " No Trials "
+        else:
+            str_build += " %8.4f%% "%(100*like_counts[itrc,1]/n_like)
+    print(str_build)
+    print("Skipped %d of %d multiple try likelihoods for zero prior density"%(np.sum(like_counts[:,1]),np.sum(like_counts)))
+
+
 def output_hdf5_loop(itrn,chain_params,samples,log_likelihood,acc_fraction,fisher_diag,par_names,N,verbosity):
     """output to hdf5 at loop iteration
 
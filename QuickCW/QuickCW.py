@@ -66,6 +66,9 @@ def QuickCW(chain_params, psrs, noise_json=None, use_legacy_equad=False, include
     tmax = [p.toas.max() for p in psrs]
     Tspan = np.max(tmax) - np.min(tmin)
 
+    with open(noise_json, 'r') as fp:
+        noisedict = json.load(fp)
+
     efac = parameter.Constant()
     equad = parameter.Constant()
     ecorr = parameter.Constant()
@@ -94,7 +97,22 @@ def QuickCW(chain_params, psrs, noise_json=None, use_legacy_equad=False, include
 
     # define powerlaw PSD and red noise signal
     pl = utils.powerlaw(log10_A=log10_A, gamma=gamma)
-    rn = gp_signals.FourierBasisGP(pl, components=30)
+    if chain_params.common_rn_basis:
+        Tspan_rn = Tspan
+    else:
+        Tspan_rn = None
+
+    # number of red noise components for each pulsar
+    if chain_params.adaptive_rn_comps:
+        rn_comps = get_rn_comps(psrs, noisedict, Tspan=Tspan_rn, max_comps=30, tol=chain_params.rn_comps_tol)
+        print("Number of red noise components per pulsar:")
+        print(rn_comps)
+    else:
+        rn_comps = {psr.name: 30 for psr in psrs}
+
+    # with the same Tspan as the GWB (Tspan_rn=Tspan) the basis columns of the GWB frequencies are identical,
+    # so enterprise combines them and sums the two power spectra in phi
+    rns = {n_comp: gp_signals.FourierBasisGP(pl, components=n_comp, Tspan=Tspan_rn) for n_comp in set(rn_comps.values())}
 
     log10_Agw = parameter.Uniform(-20,-11)('gwb_log10_A')
 
@@ -107,16 +125,19 @@ def QuickCW(chain_params, psrs, noise_json=None, use_legacy_equad=False, include
 
     tm = gp_signals.TimingModel()
 
-    if include_ecorr:
-        if use_legacy_equad:
-            s_base = ef + eq + ec + rn + crn + tm
+    # base model for each number of red noise components
+    s_bases = {}
+    for n_comp, rn in rns.items():
+        if include_ecorr:
+            if use_legacy_equad:
+                s_bases[n_comp] = ef + eq + ec + rn + crn + tm
+            else:
+                s_bases[n_comp] = efq     + ec + rn + crn + tm
         else:
-            s_base = efq     + ec + rn + crn + tm
-    else:
-        if use_legacy_equad:
-            s_base = ef + eq      + rn + crn + tm
-        else:
-            s_base = efq          + rn + crn + tm
+            if use_legacy_equad:
+                s_bases[n_comp] = ef + eq      + rn + crn + tm
+            else:
+                s_bases[n_comp] = efq          + rn + crn + tm
 
 
     #cos_gwtheta = parameter.Uniform(-1,1)('0_cos_gwtheta')
@@ -161,9 +182,7 @@ def QuickCW(chain_params, psrs, noise_json=None, use_legacy_equad=False, include
                                        psi=psi, cos_inc=cos_inc, tref=cm.tref)
         cw = deterministic.CWSignal(cw_wf, psrTerm=True, name='cw0')
 
-        s = s_base + cw
-
-        models = [s(psr) for psr in psrs]
+        models = [(s_bases[rn_comps[psr.name]] + cw)(psr) for psr in psrs]
     else: #provided pulsar distance file --> use information in that file for setting up pulsar distance priors
         if (np.any(np.array([psr.pdist[0] for psr in psrs])>0)) | np.any(np.array([psr.pdist[1] for psr in psrs])!=1): #raise error if this is used while any of the pulsars have non-zero distance
             raise ValueError("You are running in a mode using parallax and DM based pulsar distance priors, but some of the pulsar object have non-zero distances or non-unit variances. This method requires the pulsar objects to have zero mean and unit variance. Use psr objects that satisfy that or switch to using Gaussian priors based on distances in psr objects by setting psr_distance_file=None.")
@@ -183,7 +202,7 @@ def QuickCW(chain_params, psrs, noise_json=None, use_legacy_equad=False, include
             CWSignal_args = dict(psrTerm=True, name='cw0')
             # create CW signal applying pulsar distance prior
             cw = per_pulsar_prior(psr, pulsar_distances, cw_delay_args, CWSignal_args)
-            s = s_base + cw
+            s = s_bases[rn_comps[psr.name]] + cw
 
             models.append(s(psr))
 
@@ -193,8 +212,8 @@ def QuickCW(chain_params, psrs, noise_json=None, use_legacy_equad=False, include
     t1 = perf_counter()
     print("Finished Loading Pulsar Timing Array from Enterprise at %8.3fs" % (t1 - ti))
 
-    with open(noise_json, 'r') as fp:
-        noisedict = json.load(fp)
+    if chain_params.common_rn_basis:
+        print_common_basis_reduction(pta)
 
     # print(noisedict)
     pta.set_default_params(noisedict)
@@ -258,3 +277,59 @@ def per_pulsar_prior(enterprise_pulsar: Pulsar, pulsar_distances: dict,
 
     return cw
 
+
+
+def print_common_basis_reduction(pta):
+    """Prints how many Fourier basis columns and Sigma rows each pulsar saves by having the red noise and GWB on a common basis
+
+    :param pta:                 enterprise PTA object
+    """
+    print("Basis size per pulsar with the common red noise basis (with separate bases):")
+    for psr_name, sc in zip(pta.pulsars, pta._signalcollections):
+        n_separate = 0
+        fourier_cols = []
+        for signal in sc._signals:
+            # FourierBasisGP stores the name it was given in signal_id
+            if signal.signal_id in ['red_noise', 'gw'] and signal in sc._idx:
+                n_separate += len(sc._idx[signal])
+                fourier_cols.append(sc._idx[signal])
+        n_common = np.unique(np.concatenate(fourier_cols)).size
+        n_total = sc._Fmat.shape[1]
+        print("{0}: Fourier part {1} ({2}), Sigma {3}x{3} ({4}x{4})".format(psr_name, n_common, n_separate, n_total, n_total + n_separate - n_common))
+
+
+def get_rn_comps(psrs, noisedict, Tspan=None, max_comps=30, tol=1.e-2):
+    """Gets the number of red noise Fourier components for each pulsar from the red noise parameters in the noise dictionary,
+    as the smallest number for which the powerlaw variance of the left out coefficients is below tol times the white noise variance of one coefficient
+
+    :param psrs:                enterprise pulsar objects
+    :param noisedict:           Noise dictionary, pulsars without red noise parameters in it get max_comps components
+    :param Tspan:               Timespan of the red noise basis; if None, each pulsar's own timespan is used [None]
+    :param max_comps:           Maximum number of components [30]
+    :param tol:                 Tolerance on the summed prior variance of the left out coefficients relative to the white noise variance of a coefficient [1.e-2]
+
+    :return rn_comps:           dictionary of the number of components for each pulsar name
+    """
+    rn_comps = {}
+    for psr in psrs:
+        log10_A = noisedict.get(psr.name + '_red_noise_log10_A')
+        gamma = noisedict.get(psr.name + '_red_noise_gamma')
+        if log10_A is None or gamma is None:
+            rn_comps[psr.name] = max_comps
+            continue
+
+        if Tspan is None:
+            Tspan_psr = psr.toas.max() - psr.toas.min()
+        else:
+            Tspan_psr = Tspan
+        # frequencies of the sine and cosine coefficients as in the red noise basis, and their prior variance
+        freqs = np.repeat(np.arange(1, max_comps + 1) / Tspan_psr, 2)
+        phi = utils.powerlaw(freqs, log10_A=log10_A, gamma=gamma)
+
+        # variance of a coefficient fitted to white noise, from the TOA errors without efac and equad, so this errs towards more components
+        white_var = 2 / np.sum(psr.toaerrs**-2)
+
+        # left out variance of the sine and cosine coefficients when keeping n_comp=0,...,max_comps components
+        left_out = np.append(np.cumsum(phi[::-1])[::-1][::2], 0.)
+        rn_comps[psr.name] = max(1, int(np.argmax(left_out <= tol * white_var)))
+    return rn_comps
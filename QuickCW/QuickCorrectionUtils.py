@@ -81,6 +81,7 @@ def reflect_into_range(x, x_low, x_high):
             res = x_low+(-(res-x_low))%(2*x_range)  # 2*x_low - x
     return res
 
+@njit()
 def check_merged(log10_fgw,log10_mc,max_toa):
     """check the maximum toa is not such that the source has already merged, and if so draw new parameters to avoid starting from nan likelihood
 
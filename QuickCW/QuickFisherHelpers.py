@@ -43,7 +43,8 @@ def params_perturb_helper(params,x0_swap,FLI_swap,flm,par_names,idxs_targ,epsilo
     paramsPP = np.copy(params)
     paramsPP[idxs_targ] += epsilons
 
-    FLI_mem0 = get_FLI_mem(FLI_swap)
+    #only the pulsars actually perturbed are recorded, so they are all that has to be reverted afterwards
+    FLI_swap.begin()
 
     x0_swap.update_params(paramsPP)
     if dist_mode:
@@ -59,12 +60,13 @@ def params_perturb_helper(params,x0_swap,FLI_swap,flm,par_names,idxs_targ,epsilo
             print("failed to perturb parameters for fisher")
             print("params: ",paramsPP)
             #this will probably cause this particular fisher value to be invalid/not useful, but shouldn't be a huge issue in the long run
-            safe_reset_swap(FLI_swap,x0_swap,params,FLI_mem0)
+            rollback_swap(FLI_swap,x0_swap,params)
+            FLI_swap.begin()
 
 
     FLI_memp = get_FLI_mem(FLI_swap)
 
-    safe_reset_swap(FLI_swap,x0_swap,params,FLI_mem0)
+    rollback_swap(FLI_swap,x0_swap,params)
 
     return paramsPP,FLI_memp#,paramsMM,MMsm,NNm,resres_arraym,logdet_arraym
 
@@ -86,50 +88,31 @@ def fisher_synthetic_FLI_helper(helper_tuple_RR,x0_swap,FLI_swap,params_old,dist
     (MMsr,NNr,resres_arrayr,logdet_arrayr,_) = FLI_memr
     rrs = np.zeros(x0_swap.Npsr)
     #isolate elements that change for maximum numerical accuracy
-    FLI_mem0 = get_FLI_mem(FLI_swap)
-
-    FLI_swap.MMs[:] = 0.
-    FLI_swap.NN[:] = 0.
-    FLI_swap.resres_array[:] = 0.
-    FLI_swap.logdet_array[:] = 0.
-    FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+    FLI_swap.begin()
+    FLI_swap.clear_psrs(np.arange(x0_swap.Npsr))
 
     x0_swap.update_params(paramsRR)
+    #pulsar term amplitudes depend on the perturbed distances
+    FLI_swap.update_antenna_cache(x0_swap,np.arange(x0_swap.Npsr))
 
     for ii in range(x0_swap.Npsr):
-        FLI_swap.MMs[ii] = MMsr[ii]
-        FLI_swap.NN[ii] = NNr[ii]
-
-        FLI_swap.resres_array[ii] = resres_arrayr[ii]
-        FLI_swap.logdet_array[ii] = logdet_arrayr[ii]
-        FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
-
-        if dist_mode:
-            #turn off all elements which do not vary with distance
-            FLI_swap.MMs[:,:2,:2] = 0.
-            FLI_swap.NN[:,:2] = 0.
-            FLI_swap.resres_array[ii] = 0.
-            FLI_swap.logdet_array[ii] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
-        elif phase_mode:
-            #turn off all elements which do not vary with phase
-            FLI_swap.MMs[:,:2,:2] = 0.
-            FLI_swap.NN[:,:2] = 0.
-            FLI_swap.resres_array[ii] = 0.
-            FLI_swap.logdet_array[ii] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+        if dist_mode or phase_mode:
+            #turn off all elements which do not vary with distance or phase
+            MM_loc = MMsr[ii].copy()
+            NN_loc = NNr[ii].copy()
+            MM_loc[:2,:2] = 0.
+            NN_loc[:2] = 0.
+            FLI_swap.set_psr_rows(ii,MM_loc,NN_loc,0.,0.)
+        else:
+            FLI_swap.set_psr_rows(ii,MMsr[ii],NNr[ii],resres_arrayr[ii],logdet_arrayr[ii])
 
         #all other contributions are 0 by construction
         rrs[ii] = FLI_swap.get_lnlikelihood(x0_swap)
 
         #reset elements to 0
-        FLI_swap.MMs[ii] = 0.
-        FLI_swap.NN[ii] = 0.
-        FLI_swap.resres_array[ii] = 0.
-        FLI_swap.logdet_array[ii] = 0.
-        FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+        FLI_swap.clear_psrs(np.array([ii]))
 
-    safe_reset_swap(FLI_swap,x0_swap,params_old,FLI_mem0)
+    rollback_swap(FLI_swap,x0_swap,params_old)
 
     return rrs#,fisher_diag
 
@@ -277,12 +260,7 @@ def get_fisher_rn_block_eigenvectors(params, par_names, x0_swap, flm, FLI_swap,d
     pm2s = np.zeros(Npsr)
     mp2s = np.zeros(Npsr)
 
-    pp1s,mm1s,nn1s,epsilons,helper_tuple0,_,_,_ = diagonal_data_loc
-    (_,FLI_mem0) = helper_tuple0
-
-    chol_Sigmas_save = []
-    for ii in range(Npsr):
-        chol_Sigmas_save.append(FLI_swap.chol_Sigmas[ii].copy())
+    pp1s,mm1s,nn1s,epsilons,_,_,_,_ = diagonal_data_loc
 
     epsilon_diags = np.zeros((Npsr,2))
     epsilon_diags[:,0] = epsilons[x0_swap.idx_rn_gammas]
@@ -348,20 +326,15 @@ def get_fisher_rn_block_eigenvectors(params, par_names, x0_swap, flm, FLI_swap,d
     helper_tuple_crns_MP = params_perturb_helper(params,x0_swap,FLI_swap,flm,par_names,idx_rns,-epsilon_crns,mask=~defaulted)
 
     #the nns from the diagonal method should be derived safely as well as the PP, MM, PM, and MP here
-    safe_reset_swap(FLI_swap,x0_swap,params,FLI_mem0)
-
     pp2s[:] = fisher_synthetic_FLI_helper(helper_tuple_drns_PP,x0_swap,FLI_swap,params)
     mm2s[:] = fisher_synthetic_FLI_helper(helper_tuple_drns_MM,x0_swap,FLI_swap,params)
 
     pm2s[:] = fisher_synthetic_FLI_helper(helper_tuple_crns_PM,x0_swap,FLI_swap,params)
     mp2s[:] = fisher_synthetic_FLI_helper(helper_tuple_crns_MP,x0_swap,FLI_swap,params)
 
-    #update FLI_swap and x0_swap to at least a self consistent state
-    #copy back in chol_Sigmas for safety
-    for ii in range(Npsr):
-        FLI_swap.chol_Sigmas[ii][:] = chol_Sigmas_save[ii]
-
-    safe_reset_swap(FLI_swap,x0_swap,params,FLI_mem0)
+    #every perturbation was rolled back, so FLI_swap and x0_swap should be in a self consistent state
+    FLI_swap.validate_consistent(x0_swap)
+    x0_swap.validate_consistent(params)
 
 
 
@@ -452,11 +425,6 @@ def fisher_rn_mm_pp_diagonal_helper(params,x0_swap,FLI_swap,flm,par_names,epsilo
     nn1s = fisher_synthetic_FLI_helper(helper_tuple0,x0_swap,FLI_swap,params)
 
     if get_intrinsic_diag:
-        #save chol_Sigmas so everything can be reset to full self consistency
-        chol_Sigmas_save = []
-        for ii in range(Npsr):
-            chol_Sigmas_save.append(FLI_swap.chol_Sigmas[ii].copy())
-
         #the noise parameters are very expensive to calculate individually so calculate them all en masse
         helper_tuple_gammas_PP = params_perturb_helper(params,x0_swap,FLI_swap,flm,par_names,x0_swap.idx_rn_gammas,epsilon_gammas)
         helper_tuple_gammas_MM = params_perturb_helper(params,x0_swap,FLI_swap,flm,par_names,x0_swap.idx_rn_gammas,-epsilon_gammas)
@@ -473,13 +441,6 @@ def fisher_rn_mm_pp_diagonal_helper(params,x0_swap,FLI_swap,flm,par_names,epsilo
         mm1s[:,1] = fisher_synthetic_FLI_helper(helper_tuple_log10_As_MM,x0_swap,FLI_swap,params)
 
         if get_gwb:
-            #double check everything is reset although it shouldn't actually be necessary here
-            safe_reset_swap(FLI_swap,x0_swap,params,FLI_mem0)
-
-            #copy back in chol_Sigmas for safety
-            for ii in range(Npsr):
-                FLI_swap.chol_Sigmas[ii][:] = chol_Sigmas_save[ii]
-
             nns_gwb[:] = FLI_swap.get_lnlikelihood(x0_swap)
 
             #do the gwb parameters
@@ -493,6 +454,7 @@ def fisher_rn_mm_pp_diagonal_helper(params,x0_swap,FLI_swap,flm,par_names,epsilo
                 paramsPP[i] += 2*epsilon
                 paramsMM[i] -= 2*epsilon
 
+                FLI_swap.begin()
 
                 #must be one of the intrinsic parameters
                 x0_swap.update_params(paramsPP)
@@ -505,47 +467,24 @@ def fisher_rn_mm_pp_diagonal_helper(params,x0_swap,FLI_swap,flm,par_names,epsilo
                 flm.recompute_FastLike(FLI_swap,x0_swap,dict(zip(par_names, paramsMM)),mask=None)
                 mms_gwb[itr] = FLI_swap.get_lnlikelihood(x0_swap)#,FLI_swap.resres,FLI_swap.logdet,FLI_swap.pos,FLI_swap.pdist,FLI_swap.NN,FLI_swap.MMs)
 
-                safe_reset_swap(FLI_swap,x0_swap,params,FLI_mem0)
-
-                #copy back in chol_Sigmas for safety
-                for ii in range(Npsr):
-                    FLI_swap.chol_Sigmas[ii][:] = chol_Sigmas_save[ii]
-
-            #copy back in chol_Sigmas for safety
-            for ii in range(Npsr):
-                FLI_swap.chol_Sigmas[ii][:] = chol_Sigmas_save[ii]
+                rollback_swap(FLI_swap,x0_swap,params)
 
     #double check everything is reset although it shouldn't actually be necessary here
-    safe_reset_swap(FLI_swap,x0_swap,params,FLI_mem0)
+    x0_swap.update_params(params)
+    FLI_swap.validate_consistent(x0_swap)
 
     return pp1s,mm1s,nn1s,helper_tuple0,pps_gwb,mms_gwb,nns_gwb
 
-def safe_reset_swap(FLI_swap,x0_swap,params_old,FLI_mem0):
-    """safely reset everything back to the initial values as input for self consistency in future calculations
+def rollback_swap(FLI_swap,x0_swap,params_old):
+    """roll back the transaction open on FLI_swap and reset x0_swap to the initial values as input for self consistency in future calculations
 
-    :param FLI_swap:    FastLikeInfo object to be reset
+    :param FLI_swap:    FastLikeInfo object with an open transaction
     :param x0_swap:     CWInfo object
     :param params_old:  Parameters to which we want to reset
-    :param FLI_mem0:    Parts of FLI object saved to memory
     """
-    MMs0,NN0,resres_array0,logdet_array0,logdet_base_old = FLI_mem0
+    FLI_swap.rollback()
     x0_swap.update_params(params_old)
 
-    FLI_swap.cos_gwtheta = x0_swap.cos_gwtheta
-    FLI_swap.gwphi = x0_swap.gwphi
-    FLI_swap.log10_fgw = x0_swap.log10_fgw
-    FLI_swap.log10_mc = x0_swap.log10_mc
-    FLI_swap.gwb_gamma = x0_swap.gwb_gamma
-    FLI_swap.gwb_log10_A = x0_swap.gwb_log10_A
-    FLI_swap.rn_gammas = x0_swap.rn_gammas.copy()
-    FLI_swap.rn_log10_As = x0_swap.rn_log10_As.copy()
-    FLI_swap.cw_p_dists = x0_swap.cw_p_dists.copy()
-
-    FLI_swap.MMs[:] = MMs0
-    FLI_swap.NN[:] = NN0
-
-    FLI_swap.set_resres_logdet(resres_array0,logdet_array0,logdet_base_old)
-
     FLI_swap.validate_consistent(x0_swap)
     x0_swap.validate_consistent(params_old)
 
@@ -618,7 +557,6 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
                                                                    par_names,epsilon_gammas,epsilon_log10_As,Npsr,\
                                                                    get_intrinsic_diag=get_intrinsic_diag,start_safe=start_safe,\
                                                                    get_gwb=(get_intrinsic_diag and not cm.use_default_gwb_sigma))
-    (_,FLI_mem0) = helper_tuple0
 
     if get_intrinsic_diag:
         pps[x0_swap.idx_rn_gammas] = pp2s[:,0]
@@ -633,8 +571,6 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
         mms[x0_swap.idx_gwb] = mms_gwb[:]
         nns[x0_swap.idx_gwb] = nns_gwb[:]
 
-        safe_reset_swap(FLI_swap,x0_swap,samples_fisher,FLI_mem0)
-
         helper_tuple_dists_PP = params_perturb_helper(samples_fisher,x0_swap,FLI_swap,flm,par_names,x0_swap.idx_dists,epsilon_dists,dist_mode=False)
         helper_tuple_dists_MM = params_perturb_helper(samples_fisher,x0_swap,FLI_swap,flm,par_names,x0_swap.idx_dists,-epsilon_dists,dist_mode=False)
 
@@ -642,8 +578,6 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
         mms[x0_swap.idx_dists] = fisher_synthetic_FLI_helper(helper_tuple_dists_MM,x0_swap,FLI_swap,samples_fisher,dist_mode=True)
         nns[x0_swap.idx_dists] = fisher_synthetic_FLI_helper(helper_tuple0,x0_swap,FLI_swap,samples_fisher,dist_mode=True)
 
-    safe_reset_swap(FLI_swap,x0_swap,samples_fisher,FLI_mem0)
-
     epsilon_phases = np.zeros(Npsr)+2*cm.eps['cw0_p_phase']
     helper_tuple_phases_PP = params_perturb_helper(samples_fisher,x0_swap,FLI_swap,flm,par_names,x0_swap.idx_phases,epsilon_phases,phase_mode=True)
     helper_tuple_phases_MM = params_perturb_helper(samples_fisher,x0_swap,FLI_swap,flm,par_names,x0_swap.idx_phases,-epsilon_phases,phase_mode=True)
@@ -656,10 +590,6 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
 
     assert np.all(fisher_diag>=0.)
 
-    chol_Sigmas_save = []
-    for ii in range(Npsr):
-        chol_Sigmas_save.append(FLI_swap.chol_Sigmas[ii].copy())
-
     #calculate diagonal elements
     for i in range(dim):
         paramsPP = np.copy(samples_fisher)
@@ -677,9 +607,8 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
             paramsPP[i] += 2*epsilon
             paramsMM[i] -= 2*epsilon
 
-            FLI_swap.logdet_array[:] = 0.
-            FLI_swap.resres_array[:] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+            FLI_swap.begin()
+            FLI_swap.drop_resres_logdet(np.arange(Npsr))
 
             nns[i] = FLI_swap.get_lnlikelihood(x0_swap)#,FLI_swap.resres,FLI_swap.logdet,FLI_swap.pos,FLI_swap.pdist,FLI_swap.NN,FLI_swap.MMs)
 
@@ -693,7 +622,7 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
             mms[i] = FLI_swap.get_lnlikelihood(x0_swap)#FLI_swap.resres,FLI_swap.logdet,FLI_swap.pos,FLI_swap.pdist,FLI_swap.NN,FLI_swap.MMs)
 
             #revert changes
-            safe_reset_swap(FLI_swap,x0_swap,samples_fisher,FLI_mem0)
+            rollback_swap(FLI_swap,x0_swap,samples_fisher)
 
         elif i in x0_swap.idx_dists:
             if cm.use_default_cw0_p_sigma or not get_intrinsic_diag:
@@ -721,9 +650,8 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
             paramsPP[i] += 2*epsilon
             paramsMM[i] -= 2*epsilon
 
-            FLI_swap.logdet_array[:] = 0.
-            FLI_swap.resres_array[:] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+            FLI_swap.begin()
+            FLI_swap.drop_resres_logdet(np.arange(Npsr))
 
             nns[i] = FLI_swap.get_lnlikelihood(x0_swap)
 
@@ -732,15 +660,13 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
             x0_swap.update_params(paramsPP)
 
             FLI_swap.update_intrinsic_params(x0_swap)
-            FLI_swap.resres_array[:] = 0. #these are reset to nonzero by calling update_intrinsic, but they do not vary so don't include them in the likelihood
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+            FLI_swap.drop_resres_logdet(np.arange(Npsr)) #these are reset to nonzero by calling update_intrinsic, but they do not vary so don't include them in the likelihood
             pps[i] = FLI_swap.get_lnlikelihood(x0_swap)#FLI_swap.resres,FLI_swap.logdet,FLI_swap.pos,FLI_swap.pdist,FLI_swap.NN,FLI_swap.MMs)
 
             x0_swap.update_params(paramsMM)
 
             FLI_swap.update_intrinsic_params(x0_swap)
-            FLI_swap.resres_array[:] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+            FLI_swap.drop_resres_logdet(np.arange(Npsr))
             mms[i] = FLI_swap.get_lnlikelihood(x0_swap)#,FLI_swap.resres,FLI_swap.logdet,FLI_swap.pos,FLI_swap.pdist,FLI_swap.NN,FLI_swap.MMs)
 
             #calculate diagonal elements of the Hessian from a central finite element scheme
@@ -755,7 +681,7 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
             #FLI_swap.log10_fgw = x0_swap.log10_fgw
             #FLI_swap.log10_mc = x0_swap.log10_mc#
 
-            safe_reset_swap(FLI_swap,x0_swap,samples_fisher,FLI_mem0)
+            rollback_swap(FLI_swap,x0_swap,samples_fisher)
 
     for ii in range(dim):
         #calculate diagonal elements of the Hessian from a central finite element scheme
@@ -770,7 +696,9 @@ def get_fisher_diagonal(samples_fisher, par_names, x0_swap, flm, FLI_swap,get_in
             fisher_diag[ii] = 1/sigma_defaults[ii]**2#1./cm.sigma_noise_default**2#1/cm.sigma_cw0_p_phase_default**2
 
     #double check FLI_swap and x0_swap are a self consistent state
-    safe_reset_swap(FLI_swap,x0_swap,samples_fisher,FLI_mem0)
+    x0_swap.update_params(samples_fisher)
+    FLI_swap.validate_consistent(x0_swap)
+    x0_swap.validate_consistent(samples_fisher)
 
     #filer out nans and negative values - set them to 1.0 which will result in
     fisher_diag[(~np.isfinite(fisher_diag))|(fisher_diag<0.)] = 1.
@@ -805,8 +733,8 @@ def get_fisher_eigenvectors_common(params, x0_swap, FLI_swap, diagonal_data, eps
     dim = 4
     idx_to_perturb = x0_swap.idx_cw_int[:dim]
     #par_names_to_perturb = par_names_cw_int[:4]
-    _,_,_,epsilons_diag,helper_tuple0,pps,mms,nns = diagonal_data
-    (_,FLI_mem0) = helper_tuple0
+    _,_,_,epsilons_diag,_,pps,mms,nns = diagonal_data
+    Npsr = x0_swap.Npsr
 
     fisher = np.zeros((dim,dim))
     sigma_defaults = np.array([cm.sigma_noise_default,cm.sigma_noise_default,cm.sigma_log10_fgw_default,cm.sigma_noise_default])
@@ -860,40 +788,35 @@ def get_fisher_eigenvectors_common(params, x0_swap, FLI_swap, diagonal_data, eps
             paramsMP[idx_to_perturb[i]] -= epsilon
             paramsMP[idx_to_perturb[j]] += epsilon
 
-            FLI_swap.logdet_array[:] = 0.
-            FLI_swap.resres_array[:] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+            FLI_swap.begin()
+            FLI_swap.drop_resres_logdet(np.arange(Npsr))
 
             x0_swap.update_params(paramsPP)
 
             FLI_swap.update_intrinsic_params(x0_swap)
             #these are reset to nonzero by calling update_intrinsic, but they do not vary so don't include them in the likelihood
-            FLI_swap.resres_array[:] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+            FLI_swap.drop_resres_logdet(np.arange(Npsr))
             pp = FLI_swap.get_lnlikelihood(x0_swap)
 
             x0_swap.update_params(paramsMM)
 
             FLI_swap.update_intrinsic_params(x0_swap)
-            FLI_swap.resres_array[:] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+            FLI_swap.drop_resres_logdet(np.arange(Npsr))
             mm = FLI_swap.get_lnlikelihood(x0_swap)
 
             x0_swap.update_params(paramsPM)
 
             FLI_swap.update_intrinsic_params(x0_swap)
-            FLI_swap.resres_array[:] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+            FLI_swap.drop_resres_logdet(np.arange(Npsr))
             pm = FLI_swap.get_lnlikelihood(x0_swap)
 
             x0_swap.update_params(paramsMP)
 
             FLI_swap.update_intrinsic_params(x0_swap)
-            FLI_swap.resres_array[:] = 0.
-            FLI_swap.set_resres_logdet(FLI_swap.resres_array,FLI_swap.logdet_array,0.)
+            FLI_swap.drop_resres_logdet(np.arange(Npsr))
             mp= FLI_swap.get_lnlikelihood(x0_swap)
 
-            safe_reset_swap(FLI_swap,x0_swap,params,FLI_mem0)
+            rollback_swap(FLI_swap,x0_swap,params)
 
 
             #calculate off-diagonal elements of the Hessian from a central finite element scheme
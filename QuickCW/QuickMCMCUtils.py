@@ -19,7 +19,8 @@ import QuickCW.const_mcmc as cm
 import QuickCW.CWFastLikelihoodNumba as CWFastLikelihoodNumba
 from QuickCW.QuickFisherHelpers import get_fishers
 from QuickCW.QuickMTHelpers import do_intrinsic_update_mt,add_rn_eig_jump
-from QuickCW.OutputUtils import print_acceptance_progress,output_hdf5_loop,output_hdf5_end
+from QuickCW.QuickROQHelpers import load_roq
+from QuickCW.OutputUtils import print_acceptance_progress,print_mt_try_progress,output_hdf5_loop,output_hdf5_end
 
 ################################################################################
 #
@@ -34,7 +35,7 @@ from QuickCW.OutputUtils import print_acceptance_progress,output_hdf5_loop,outpu
 #
 ################################################################################
 @njit(parallel=True)
-def do_extrinsic_block(n_chain, samples, itrb, Ts, x0s, FLIs, FPI, n_par_tot, log_likelihood, n_int_block, fisher_diag, a_yes, a_no):
+def do_extrinsic_block(n_chain, samples, itrb, Ts, x0s, FLIs, FLI_bufs, FLI_buf_stale, FPI, n_par_tot, log_likelihood, n_int_block, fisher_diag, a_yes, a_no):
     """do blocks of just the extrinsic parameters, which should be very fast
 
     :param n_chain:         Number of PT chains
@@ -43,6 +44,8 @@ def do_extrinsic_block(n_chain, samples, itrb, Ts, x0s, FLIs, FPI, n_par_tot, lo
     :param Ts:              List of PT temperatures
     :param x0s:             List of CWInfo objects
     :param FLIs:            List of FastLikeInfo objects
+    :param FLI_bufs:        List of inactive FastLikeInfo buffers of each chain
+    :param FLI_buf_stale:   (n_chain, Npsr) array of the pulsars whose noise blocks in FLI_bufs differ from FLIs
     :param FPI:             FastPriorInfo object
     :param n_par_tot:       Number of total parameters
     :param log_likelihood:  Array holding log likelihood values
@@ -120,7 +123,7 @@ def do_extrinsic_block(n_chain, samples, itrb, Ts, x0s, FLIs, FPI, n_par_tot, lo
 
                 x0s[j].update_params(samples_current)
 
-        do_pt_swap(n_chain, samples, itrb+k+1, Ts, a_yes, a_no, x0s, FLIs, log_likelihood,fisher_diag)
+        do_pt_swap(n_chain, samples, itrb+k+1, Ts, a_yes, a_no, x0s, FLIs, FLI_bufs, FLI_buf_stale, log_likelihood,fisher_diag)
 
 
 ################################################################################
@@ -129,7 +132,7 @@ def do_extrinsic_block(n_chain, samples, itrb, Ts, x0s, FLIs, FPI, n_par_tot, lo
 #
 ################################################################################
 @njit()
-def do_pt_swap(n_chain, samples, itrb, Ts, a_yes, a_no, x0s, FLIs, log_likelihood,fisher_diag):
+def do_pt_swap(n_chain, samples, itrb, Ts, a_yes, a_no, x0s, FLIs, FLI_bufs, FLI_buf_stale, log_likelihood,fisher_diag):
     """do the parallel tempering swap
 
     :param n_chain:         Number of PT chains
@@ -140,6 +143,8 @@ def do_pt_swap(n_chain, samples, itrb, Ts, a_yes, a_no, x0s, FLIs, log_likelihoo
     :param a_no:            Array to hold number of rejected steps
     :param x0s:             List of CWInfo objects
     :param FLIs:            List of FastLikeInfo objects
+    :param FLI_bufs:        List of inactive FastLikeInfo buffers of each chain, swapped along with FLIs
+    :param FLI_buf_stale:   (n_chain, Npsr) array of the pulsars whose noise blocks in FLI_bufs differ from FLIs
     :param log_likelihood:  Array holding log likelihood values
     :param fisher_diag:     Diagonal fisher
     """
@@ -173,17 +178,23 @@ def do_pt_swap(n_chain, samples, itrb, Ts, a_yes, a_no, x0s, FLIs, log_likelihoo
 
     #loop through the chains and record the new samples and log_Ls
     FLIs_new = []
+    FLI_bufs_new = []
     x0s_new = []
     fisher_diag_new = np.zeros_like(fisher_diag)
+    FLI_buf_stale_new = np.zeros_like(FLI_buf_stale)
     for j in range(n_chain):
         samples[j,itrb+1,:] = samples[swap_map[j],itrb,:]
         fisher_diag_new[j,:] = fisher_diag[swap_map[j],:]
         log_likelihood[j,itrb+1] = log_likelihood[swap_map[j],itrb]
         FLIs_new.append(FLIs[swap_map[j]])
+        FLI_bufs_new.append(FLI_bufs[swap_map[j]])
+        FLI_buf_stale_new[j,:] = FLI_buf_stale[swap_map[j],:]
         x0s_new.append(x0s[swap_map[j]])
 
     fisher_diag[:] = fisher_diag_new
     FLIs[:] = List(FLIs_new)
+    FLI_bufs[:] = List(FLI_bufs_new)
+    FLI_buf_stale[:] = FLI_buf_stale_new
     x0s[:] = List(x0s_new)
 
 def add_rn_eig_starting_point(samples,par_names,x0_swap,flm,FLI_swap,chain_params,Npsr,FPI):
@@ -416,6 +427,26 @@ class ChainParams():
     :param zero_rn:                 If True, we fix per psr RN amplitude to a very low value effectively turning it off [False]
     :param fix_gwb:                 If True, we fix GWB parameters to the value it starts at [False]
     :param zero_gwb:                If True, we fix GWB amplitude to a very low value effectively turning it off [False]
+    :param use_float32:             If True, compute the CW filters in single precision, falls back to double precision if a startup accuracy check fails [False]
+    :param rel_bin_n_bin:           Number of TOA bins per pulsar for relative binning of the filter inner products in local shape parameter jumps, 0 to always use the exact filters [0]
+    :param rel_bin_tol:             Largest allowed error of the linear interpolation of the filter ratios over a bin before falling back to the exact filters [1.e-7]
+    :param rel_bin_check_every:     Number of relative binning updates per chain between comparisons to the exact likelihood, which are reported in the status updates [100]
+    :param roq_file:                File with reduced order quadratures of the filter inner products made with QuickROQHelpers.build_roq and save_roq, None to use the exact filters [None]
+    :param compress_epochs:         If True, average the TOAs of each observing epoch for the filter inner products, accurate up to the upper bound of freq_bounds [False]
+    :param compress_dphase_max:     Largest phase change of the filter products across an epoch at the highest frequency if compress_epochs [1.e-2]
+    :param sigma_cache_mb:          Memory budget in MB for caching the noise dependent Cholesky blocks of each pulsar by noise parameters, 0 to disable [0.]
+    :param common_rn_basis:         If True, model the per psr RN on the Fourier basis of the GWB with the array Tspan, so the two share the basis columns of the GWB frequencies [False]
+    :param adaptive_rn_comps:       If True, pick the number of RN components of each psr from its RN parameters in the noise dictionary instead of using 30 for all [False]
+    :param rn_comps_tol:            Largest RN prior variance of the left out components relative to the white noise variance of a component if adaptive_rn_comps [1.e-2]
+    :param ecorr_kernel:            If True, apply ECORR as a block diagonal white noise with a Sherman-Morrison update per epoch instead of as basis columns of Sigma, checked against the basis model at startup; not compatible with rel_bin_n_bin>0, roq_file or compress_epochs [False]
+    :param phase_series:            If True, use the series expansion of the phase evolution in the filter kernels where its truncation error is below machine precision instead of the exact expressions [False]
+    :param jit_intrinsic:           If True, do the intrinsic multiple try updates of all chains in one compiled call where possible (native phiinv, no rn_emp_dist_file, no prior_recovery), otherwise recompute the noise blocks from python [True]
+    :param concurrent_chains:       If True and the intrinsic updates are compiled, evaluate the multiple tries of all chains in one parallel loop instead of one chain after the other [False]
+    :param adaptive_n_try:          If True, tune the number of multiple tries of each chain during burn in so the effective sample size of the multiple try weights is near n_try_ess_target [False]
+    :param n_try_min:               Smallest number of multiple tries of a chain if adaptive_n_try [200]
+    :param n_try_max:               Largest number of multiple tries of a chain if adaptive_n_try [8000]
+    :param n_try_ess_target:        Target effective sample size of the multiple try weights if adaptive_n_try [100.]
+    :param n_try_burn_in:           Number of iterations after which the number of multiple tries is frozen if adaptive_n_try [100_000]
     """
 
     def __init__(self, T_max: float, n_chain: int, n_block_status_update: int, n_int_block: int = 1000,
@@ -433,7 +464,15 @@ class ChainParams():
                  dist_jump_weight: float = 0.2, rn_jump_weight: float = 0.3, gwb_jump_weight: float = 0.1,
                  common_jump_weight: float = 0.2,
                  all_jump_weight: float = 0.2,
-                 fix_rn: bool = False, zero_rn: bool = False, fix_gwb: bool = False, zero_gwb: bool = False):
+                 fix_rn: bool = False, zero_rn: bool = False, fix_gwb: bool = False, zero_gwb: bool = False,
+                 use_float32: bool = False,
+                 rel_bin_n_bin: int = 0, rel_bin_tol: float = 1.e-7, rel_bin_check_every: int = 100,
+                 roq_file: str = None, compress_epochs: bool = False, compress_dphase_max: float = 1.e-2,
+                 sigma_cache_mb: float = 0., common_rn_basis: bool = False,
+                 adaptive_rn_comps: bool = False, rn_comps_tol: float = 1.e-2, ecorr_kernel: bool = False, phase_series: bool = False,
+                 jit_intrinsic: bool = True, concurrent_chains: bool = False,
+                 adaptive_n_try: bool = False, n_try_min: int = 200, n_try_max: int = 8_000, n_try_ess_target: float = 100.,
+                 n_try_burn_in: int = 100_000):
         assert n_int_block % 2 == 0 and n_int_block >= 4  # need to have n_int block>=4 a multiple of 2
         # in order to always do at least n*(1 extrinsic+1 pt swap)+(1 intrinsic+1 pt swaps)
         assert save_every_n % n_int_block == 0  # or we won't save
@@ -459,6 +498,26 @@ class ChainParams():
         self.log_fishers = log_fishers
         self.log_mean_likelihoods = log_mean_likelihoods
         self.rn_emp_dist_file = rn_emp_dist_file
+        self.use_float32 = use_float32
+        self.rel_bin_n_bin = rel_bin_n_bin
+        self.rel_bin_tol = rel_bin_tol
+        self.rel_bin_check_every = rel_bin_check_every
+        self.roq_file = roq_file
+        self.compress_epochs = compress_epochs
+        self.compress_dphase_max = compress_dphase_max
+        self.sigma_cache_mb = sigma_cache_mb
+        self.common_rn_basis = common_rn_basis
+        self.adaptive_rn_comps = adaptive_rn_comps
+        self.rn_comps_tol = rn_comps_tol
+        self.ecorr_kernel = ecorr_kernel
+        self.phase_series = phase_series
+        self.jit_intrinsic = jit_intrinsic
+        self.concurrent_chains = concurrent_chains
+        self.adaptive_n_try = adaptive_n_try
+        self.n_try_min = n_try_min
+        self.n_try_max = n_try_max
+        self.n_try_ess_target = n_try_ess_target
+        self.n_try_burn_in = n_try_burn_in
 
         if T_ladder is None:
             #using geometric spacing
@@ -617,8 +676,24 @@ class MCMCChain():
         #TODO why was this distance zeroing here? Shouldn't change from initialized state
         #self.samples[:,0,self.x0_swap.idx_dists] = 0.
 
+        if self.chain_params.compress_epochs:
+            compress_f_max = self.chain_params.freq_bounds[1]
+        else:
+            compress_f_max = None
+        #the accuracy checks of the approximate filter paths are done at the largest amplitude allowed by the prior
+        log10_h_max = -11.
+        if self.x0_swap.idx_log10_h in self.FPI.uniform_par_ids:
+            log10_h_max = self.FPI.uniform_highs[list(self.FPI.uniform_par_ids).index(self.x0_swap.idx_log10_h)]
+        elif self.x0_swap.idx_log10_h in self.FPI.lin_exp_par_ids:
+            log10_h_max = self.FPI.lin_exp_highs[list(self.FPI.lin_exp_par_ids).index(self.x0_swap.idx_log10_h)]
         self.flm = CWFastLikelihoodNumba.FastLikeMaster(self.psrs,self.pta,dict(zip(self.par_names, self.samples[0, 0, :])),self.x0_swap,
-                                                        includeCW=self.includeCW,prior_recovery=self.prior_recovery)
+                                                        includeCW=self.includeCW,prior_recovery=self.prior_recovery,
+                                                        use_float32=self.chain_params.use_float32,
+                                                        compress_f_max=compress_f_max,compress_dphase_max=self.chain_params.compress_dphase_max,
+                                                        sigma_cache_mb=self.chain_params.sigma_cache_mb,ecorr_kernel=self.chain_params.ecorr_kernel,
+                                                        phase_series=self.chain_params.phase_series,log10_h_max=log10_h_max)
+        if self.chain_params.roq_file is not None:
+            self.flm.set_roq(load_roq(self.chain_params.roq_file,self.flm))
         self.FLI_swap = self.flm.get_new_FastLike(self.x0_swap, dict(zip(self.par_names, self.samples[0, 0, :])))
 
         #add a random fisher eigenvalue jump to the starting point for the j>0 chains to get more diversity in the initial fisher matrices
@@ -630,10 +705,29 @@ class MCMCChain():
             self.x0s.append( CWFastLikelihoodNumba.CWInfo(self.Npsr,self.samples[j,0],self.par_names,self.par_names_cw_ext,self.par_names_cw_int))
             self.FLIs.append(self.flm.get_new_FastLike(self.x0s[j], dict(zip(self.par_names, self.samples[j, 0, :]))))
 
-        #make extra x0s to help parallelizing MTMCMC updates
-        self.x0_extras = List([])
-        for k in range(cm.n_x0_extra):
-            self.x0_extras.append(CWFastLikelihoodNumba.CWInfo(len(self.pta.pulsars),self.samples[0,0],self.par_names,self.par_names_cw_ext,self.par_names_cw_int))
+        #each chain also owns an inactive FastLikeInfo buffer the intrinsic proposals are written into,
+        #accepting a proposal swaps it with FLIs[j] and rejecting it leaves both alone
+        #FLI_buf_stale tracks the pulsars whose Cholesky factors in the buffer differ from the ones in FLIs[j]
+        self.FLI_bufs = List([])
+        for j in range(self.n_chain):
+            self.FLI_bufs.append(self.flm.get_new_FastLike(self.x0s[j], dict(zip(self.par_names, self.samples[j, 0, :]))))
+        self.FLI_buf_stale = np.ones((self.n_chain,self.Npsr),dtype=np.bool_)
+
+        #relative binning references are per chain, they get set the first time they are used
+        #the list stays empty if relative binning is not used
+        self.RBIs = List.empty_list(CWFastLikelihoodNumba.RelBinInfo.class_type.instance_type)
+        if self.chain_params.rel_bin_n_bin>0:
+            for j in range(self.n_chain):
+                self.RBIs.append(self.flm.get_new_RelBinInfo(self.chain_params.rel_bin_n_bin,tol=self.chain_params.rel_bin_tol,check_every=self.chain_params.rel_bin_check_every))
+
+        #the noise blocks can only be recomputed in compiled code with the native phiinv, and the RN empirical distributions are python objects
+        self.jit_intrinsic = self.chain_params.jit_intrinsic and self.flm.native_noise_args is not None and self.rn_emp_dist is None and not self.prior_recovery
+        if self.jit_intrinsic and self.chain_params.concurrent_chains:
+            print("Doing the intrinsic updates in compiled code with the multiple tries of all chains evaluated concurrently")
+        elif self.jit_intrinsic:
+            print("Doing the intrinsic updates in compiled code")
+        else:
+            print("Doing the intrinsic updates with the noise recomputes in python")
 
         t1 = perf_counter()
         print("Finished Creating Shared Info Objects at %8.3fs"%(t1-self.ti))
@@ -689,6 +783,17 @@ class MCMCChain():
         self.a_yes = np.zeros((32,self.n_chain),dtype=np.int64)
         self.a_no = np.zeros((32,self.n_chain),dtype=np.int64)
 
+        #number of multiple tries of each chain, tuned during burn in if adaptive_n_try
+        self.n_tries = np.full(self.n_chain,cm.n_multi_try,dtype=np.int64)
+        self.n_try_frozen = not self.chain_params.adaptive_n_try
+        if self.chain_params.adaptive_n_try:
+            self.n_tries[:] = self.round_n_try(cm.n_multi_try)
+        #effective sample size of the multiple try weights summed over the steps since the last retuning and the number of those steps
+        self.mt_ess_stats = np.zeros((self.n_chain,2))
+        self.mt_ess = np.full(self.n_chain,np.nan)
+        #number of multiple try likelihoods evaluated and skipped because the try has zero prior density
+        self.mt_like_counts = np.zeros((self.n_chain,2),dtype=np.int64)
+
         with np.errstate(invalid='ignore'):
             self.acc_fraction = self.a_yes/(self.a_no+self.a_yes)
 
@@ -728,21 +833,23 @@ class MCMCChain():
         itrb = itrn%self.chain_params.save_every_n  # index within the block of saved values
         self.validate_consistent(itrb)  # check FLIs and x0s appear to have internally consistent parameters
         #always do pt steps in extrinsic
-        do_extrinsic_block(self.n_chain, self.samples, itrb, self.chain_params.Ts, self.x0s, self.FLIs, self.FPI, self.n_par_tot, self.log_likelihood, self.n_int_block-2, self.fisher_diag, self.a_yes, self.a_no)
+        do_extrinsic_block(self.n_chain, self.samples, itrb, self.chain_params.Ts, self.x0s, self.FLIs, self.FLI_bufs, self.FLI_buf_stale, self.FPI, self.n_par_tot, self.log_likelihood, self.n_int_block-2, self.fisher_diag, self.a_yes, self.a_no)
 
         self.update_fishers_partial(itrn,itrn+self.n_int_block-1)
 
         #update intrinsic parameters once a block
-        self.FLI_swap = do_intrinsic_update_mt(self, itrb+self.n_int_block-2)
+        do_intrinsic_update_mt(self, itrb+self.n_int_block-2)
         self.validate_consistent(itrb+self.n_int_block-1,full_validate=False)  # check FLIs and x0s appear to have internally consistent parameters
 
-        do_pt_swap(self.n_chain, self.samples, itrb+self.n_int_block-1, self.chain_params.Ts, self.a_yes,self.a_no, self.x0s, self.FLIs, self.log_likelihood, self.fisher_diag)
+        do_pt_swap(self.n_chain, self.samples, itrb+self.n_int_block-1, self.chain_params.Ts, self.a_yes,self.a_no, self.x0s, self.FLIs, self.FLI_bufs, self.FLI_buf_stale, self.log_likelihood, self.fisher_diag)
         self.update_fishers_partial(itrn+self.n_int_block-1,itrn+self.n_int_block+1)
 
         self.update_de_history(itrn) #update de history array
 
         self.update_fishers(itrn) #do fisher updates as necessary
 
+        self.update_n_tries(itrn) #tune the number of multiple tries as necessary
+
 
         #update acceptance rate
         with np.errstate(invalid='ignore'):
@@ -780,6 +887,27 @@ class MCMCChain():
             print(np.where( np.diff(self.log_likelihood[:,:itrb+self.n_int_block],axis=1)[:,::2].T<-300.*self.chain_params.Ts ))
             assert False
 
+    def round_n_try(self,n_try):
+        """clip a number of multiple tries to the bounds in chain_params and round it to a multiple of cm.n_try_round like cm.n_multi_try"""
+        n_try = min(max(n_try,self.chain_params.n_try_min),self.chain_params.n_try_max)
+        return max(cm.n_try_round*np.int64(np.round(n_try/cm.n_try_round)),cm.n_try_round)
+
+    def update_n_tries(self,itrn):
+        """retune the number of multiple tries of each chain from the effective sample size of its multiple try weights,
+        which grows about linearly with the number of tries, and freeze them after burn in so the chains keep detailed balance"""
+        for j in range(self.n_chain):
+            if self.mt_ess_stats[j,1]<cm.n_try_adapt_window:
+                continue
+            self.mt_ess[j] = self.mt_ess_stats[j,0]/self.mt_ess_stats[j,1]
+            self.mt_ess_stats[j] = 0.
+            if not self.n_try_frozen:
+                factor = min(max(self.chain_params.n_try_ess_target/self.mt_ess[j],1./cm.n_try_adapt_max_factor),cm.n_try_adapt_max_factor)
+                self.n_tries[j] = self.round_n_try(self.n_tries[j]*factor)
+
+        if not self.n_try_frozen and itrn+self.n_int_block>=self.chain_params.n_try_burn_in:
+            self.n_try_frozen = True
+            print("Freezing the number of multiple tries after burn in at",self.n_tries)
+
     def update_de_history(self,itrn):
         """update de history array"""
         for j in range(self.n_chain):
@@ -934,6 +1062,20 @@ class MCMCChain():
         else:
             mean_likelihood = self.FLIs[0].get_lnlikelihood(self.x0s[0])
         print("New log_L=%+12.3f Mean T=1 last block=%+12.3f Best T=1 log_L=%+12.3f best overall log_L=%+12.3f"%(self.FLIs[0].get_lnlikelihood(self.x0s[0]),mean_likelihood,self.best_logL,self.best_logL_global))#,FLIs[0].resres,FLIs[0].logdet,FLIs[0].pos,FLIs[0].pdist,FLIs[0].NN,FLIs[0].MMs)))
+        if len(self.RBIs)>0:
+            n_binned = sum([rbi.n_binned for rbi in self.RBIs])
+            n_exact = sum([rbi.n_exact for rbi in self.RBIs])
+            n_check = sum([rbi.n_check for rbi in self.RBIs])
+            bias_mean = sum([rbi.bias_sum for rbi in self.RBIs])/max(n_check,1)
+            bias_max = max([rbi.bias_max for rbi in self.RBIs])
+            print("Relative binning used for %.1f%% of pulsar updates, log_L bias vs exact mean=%.3e max=%.3e over %d checks"%(100*n_binned/max(n_binned+n_exact,1),bias_mean,bias_max,n_check))
+        if self.flm.sigma_cache.n_slot>0:
+            n_hit = np.sum(self.flm.sigma_cache.n_hit)
+            n_miss = np.sum(self.flm.sigma_cache.n_miss)
+            print("Sigma cache hit rate %.1f%% over %d pulsar updates with %d slots per pulsar"%(100*n_hit/max(n_hit+n_miss,1),n_hit+n_miss,self.flm.sigma_cache.n_slot))
+        n_slot,n_live = self.flm.chol_store.count_slots()
+        print_mt_try_progress(self.n_tries,self.mt_ess,self.n_try_frozen,self.mt_like_counts)
+        print("Cholesky store holds %d factors in use (%d allocated) for %d pulsars in %d FastLikeInfo objects, %d shared instead of factorized"%(n_live,n_slot,self.Npsr,2*self.n_chain+1,np.sum(self.flm.chol_store.n_shared)))
         #itrb = itrn%self.chain_params.save_every_n #index within the block of saved values
         #print(itrb)
         #print(self.samples[0,itrb,:])
@@ -3,12 +3,13 @@ MCMC for CW fast likelihood (w/ Neil Cornish and Matthew Digman)"""
 import numpy as np
 
 from numba import njit,prange
+from numba.typed import List
 from numpy.random import uniform
 
 import QuickCW.CWFastPrior as CWFastPrior
 import QuickCW.const_mcmc as cm
 from QuickCW.QuickCorrectionUtils import check_merged,correct_intrinsic,correct_extrinsic_array
-from QuickCW.QuickFisherHelpers import safe_reset_swap,get_FLI_mem
+from QuickCW.CWFastLikelihoodNumba import sync_FLI_buffer,recompute_noise_native,get_lnlikelihood_proj_helper
 from time import perf_counter
 
 ################################################################################
@@ -19,620 +20,808 @@ from time import perf_counter
 #version using multiple try mcmc (based on Table 6 of https://vixra.org/pdf/1712.0244v3.pdf)
 #@profile
 def do_intrinsic_update_mt(mcc, itrb):
-    """do the intrinsic update using the multiple try mcmc algorithm
+    """do the intrinsic update using the multiple try mcmc algorithm,
+    entirely in do_intrinsic_block_mt if mcc.jit_intrinsic, otherwise with the noise recomputes and empirical distribution draws done in python
 
     :param mcc:             MCMCChain onject
     :param itrb:            Index within saved values (as opposed to block index itri or overall index itrn)
-
-    :return mcc.FLI_swap:   FastLikeInfo object
     """
-    Npsr = mcc.x0s[0].Npsr
-    Ts = mcc.chain_params.Ts
-    for j in range(mcc.n_chain):
-        assert mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]) == mcc.log_likelihood[j,itrb]
-        #print('k',j,mcc.log_likelihood[j,itrb])
-
-    #print("EXT")
+    cp = mcc.chain_params
+    jump_weights = np.array([cp.dist_jump_weight,cp.rn_jump_weight,cp.gwb_jump_weight,cp.common_jump_weight,cp.all_jump_weight])
+    if mcc.jit_intrinsic:
+        fail_points,new_points,samples_currents = \
+            do_intrinsic_block_mt(mcc.n_chain,mcc.samples,itrb,cp.Ts,mcc.x0s,mcc.FLIs,mcc.FLI_bufs,mcc.FLI_buf_stale,mcc.FPI,mcc.log_likelihood,
+                                  mcc.fisher_diag,mcc.eig_rn,mcc.eig_common,mcc.de_history,mcc.dist_prior_sigmas,jump_weights,
+                                  cp.prior_draw_prob,cp.de_prob,cp.fisher_prob,cp.big_de_jump_prob,cp.n_dist_main,cp.freq_bounds,
+                                  mcc.RBIs,mcc.flm.native_noise_args,mcc.a_yes,mcc.a_no,mcc.n_tries,mcc.mt_ess_stats,mcc.mt_like_counts,concurrent=cp.concurrent_chains)
+        if np.any(fail_points):
+            for j in np.flatnonzero(fail_points):
+                save_err_state(new_points[j],samples_currents[j])
+            #something went wrong so do extra test of self consistency
+            mcc.validate_consistent(itrb+1)
+        return
+
+    Npsr = mcc.Npsr
+    fail_point = False
     for j in range(mcc.n_chain):
-        #print(mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]),mcc.log_likelihood[j,itrb])
-        assert mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]) == mcc.log_likelihood[j,itrb]
-        mcc.FLIs[j].validate_consistent(mcc.x0s[j])
-
-        #save MMs and NN so we can revert them if the chain is rejected
-        FLI_mem_save = get_FLI_mem(mcc.FLIs[j])
-
         samples_current = np.copy(mcc.samples[j,itrb,:])
-        #print('0',mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]),mcc.log_likelihood[j,itrb])
 
         #should already be at this value
         mcc.x0s[j].validate_consistent(samples_current)
-        mcc.x0s[j].update_params(samples_current)
-
-        total_weight = (mcc.chain_params.dist_jump_weight + mcc.chain_params.rn_jump_weight + mcc.chain_params.gwb_jump_weight +
-                        mcc.chain_params.common_jump_weight + mcc.chain_params.all_jump_weight)
-        which_jump = np.random.choice(5, p=[mcc.chain_params.dist_jump_weight/total_weight,
-                                            mcc.chain_params.rn_jump_weight/total_weight,
-                                            mcc.chain_params.gwb_jump_weight/total_weight,
-                                            mcc.chain_params.common_jump_weight/total_weight,
-                                            mcc.chain_params.all_jump_weight/total_weight])
 
-        #replace checking which_jump==1 etc with indicator values for desired behavior so that more jump types can be added in the future
-        recompute_rn = False
-        recompute_gwb = False
-        recompute_int = False
-        recompute_dist = False
-        all_eigs = False
-
-        fail_point = False
-        merged_point = False
-
-        if which_jump==0:  # update psr distances
-            recompute_dist = True
-            n_dist_loc = min(Npsr,mcc.chain_params.n_dist_main)#max(1,np.int64(cm.n_dist_main*mcc.chain_params.Ts[j])))
-            idx_choose_psr_dist = np.random.choice(Npsr,n_dist_loc,replace=False)
-            n_jump_loc = n_dist_loc
-            #idx_choose_psr[0] = pta.pulsars.index(par_names_cw_int[jump_select][:-11])
-            idx_choose = mcc.x0s[j].idx_dists[idx_choose_psr_dist]
-            scaling = 2.38*np.sqrt(Ts[j])/np.sqrt(n_jump_loc)
-            #scaling = 1.0
-            #scaling = 0.5
-        elif which_jump==1:  # update per psr RN
-            recompute_rn = True
-            all_eigs = True
-            n_jump_loc = 2*Npsr
-            idx_choose_psr = list(range(Npsr))
-            idx_choose_psr_dist = idx_choose_psr
-            idx_choose = np.concatenate((mcc.x0s[j].idx_rn_gammas,mcc.x0s[j].idx_rn_log10_As))
-            scaling = 2.38*np.sqrt(Ts[j])/np.sqrt(n_jump_loc)
-            #scaling = 1/np.sqrt(n_jump_loc)
-        elif which_jump==2:  # update common RN
-            recompute_gwb = True
-            n_jump_loc = 2
-            idx_choose = np.array([mcc.x0s[j].idx_gwb_gamma, mcc.x0s[j].idx_gwb_log10_A])
-            idx_choose_psr_dist = list(range(Npsr)) #all pulsars need to be updated in everything here
-            scaling = 2.38*np.sqrt(Ts[j])/np.sqrt(n_jump_loc/2)
-            #scaling = 1/np.sqrt(n_jump_loc)
-        elif which_jump==3:  # update common intrinsic parameters (chirp mass, frequency, sky location[2])
-            recompute_int = True
-
-            n_jump_loc = 4 #  2+mcc.chain_params.ndist_extra
-            idx_choose = mcc.x0s[j].idx_cw_int[:4]  # np.array([par_names.index(par_names_cw_int[itrk]) for itrk in range(4)])
-
-            #don't count parameters where jump sizes are probably saturated for the purposes of determining the appropriate jump sizing
-            saturated_idxs = np.sum((2.38*np.sqrt(Ts[j])*mcc.fisher_diag[j][idx_choose])>0.5)
-            if saturated_idxs==n_jump_loc:
-                saturated_idxs = n_jump_loc-1
-
-            scaling = 2.38*np.sqrt(Ts[j])/np.sqrt(n_jump_loc-saturated_idxs)
-            idx_choose_psr_dist = list(range(Npsr)) #all pulsars need to be updated in everything here
-            all_eigs = True
-            #scaling = 1.0
-            #scaling = 0.5
-        elif which_jump==4: # do every possible jump
-            #including this ensures any point in parameter space has some finite probability density to be reached in a single jump
-            recompute_rn = True
-            recompute_gwb = True
-            recompute_int = True
-            recompute_dist = True
-            all_eigs = True
-            n_dist_loc = min(Npsr,mcc.chain_params.n_dist_main)#max(1,np.int64(cm.n_dist_main*mcc.chain_params.Ts[j])))
-            idx_choose_psr_dist = np.random.choice(Npsr,n_dist_loc,replace=False)
-            idx_choose_psr = list(range(Npsr))
-            n_jump_loc = 2*Npsr+4+2 #distance+RN+common_pars+crn
-            idx_choose = np.concatenate((mcc.x0s[j].idx_cw_int[:4],
-                                         mcc.x0s[j].idx_rn_gammas, mcc.x0s[j].idx_rn_log10_As,
-                                         [mcc.x0s[j].idx_gwb_gamma, mcc.x0s[j].idx_gwb_log10_A]))
-            scaling = 2.38*np.sqrt(Ts[j])/np.sqrt(n_jump_loc)
-        else:
-            raise ValueError('jump index unrecognized',which_jump)
-
-        #decide what kind of jump we do
-        if recompute_rn and not recompute_gwb:
-            if mcc.rn_emp_dist is None:  # RN jump w/o emp dist --> only do fisher
-                prior_draw_prob = 0
-                de_prob = 0
-                fisher_prob = mcc.chain_params.fisher_prob
-            else: # RN jump w/ emp dist --> do fisher and emp dist (called prior here)
-                prior_draw_prob = mcc.chain_params.prior_draw_prob
-                de_prob = 0
-                fisher_prob = mcc.chain_params.fisher_prob
-        elif recompute_gwb and not recompute_rn and not recompute_int: # GWB --> do fisher and DE
-            prior_draw_prob = 0
-            #if j==(mcc.n_chain-1): #never do DE on hottest chain
-            #    de_prob = 0.
-            #else:
-            de_prob = mcc.chain_params.de_prob
-            fisher_prob = mcc.chain_params.fisher_prob
-        elif recompute_gwb and recompute_rn: #all --> do fisher and de only
-            prior_draw_prob = 0#mcc.chain_params.prior_draw_prob
-            #if j==(mcc.n_chain-1): #never do DE on hottest chain
-            #    de_prob = 0.
-            #else:
-            de_prob = mcc.chain_params.de_prob
-            fisher_prob = mcc.chain_params.fisher_prob
-        elif j==(mcc.n_chain-1) and which_jump==3: #distance of common parameters and hottest chain --> only do prior draws
-            prior_draw_prob = mcc.chain_params.prior_draw_prob
-            de_prob = 0
-            fisher_prob = 0
-        elif which_jump!=3: #distance jump --> do prior draws and fisher
-            prior_draw_prob = mcc.chain_params.prior_draw_prob
-            de_prob = 0
-            fisher_prob = mcc.chain_params.fisher_prob
-        else: #common jump --> do everything
-            prior_draw_prob = mcc.chain_params.prior_draw_prob
-            de_prob = mcc.chain_params.de_prob
-            fisher_prob = mcc.chain_params.fisher_prob
-
-
-
-        total_type_weight = prior_draw_prob + de_prob + fisher_prob
-        which_jump_type = np.random.choice(3, p=[prior_draw_prob/total_type_weight,
-                                                 de_prob/total_type_weight,
-                                                 fisher_prob/total_type_weight])
-        if which_jump_type==1 and which_jump==4:
-            #force 'all' differential evolution jumps to be in both gwb and common parameters only
-            idx_choose = np.concatenate((mcc.x0s[j].idx_cw_int[:4],[mcc.x0s[j].idx_gwb_gamma, mcc.x0s[j].idx_gwb_log10_A]))
-            n_jump_loc = 6
-            scaling = 2.38*np.sqrt(Ts[j])/np.sqrt(n_jump_loc)
-            idx_choose_psr = []
-            idx_choose_psr_dist = []
-            recompute_int = True
-            recompute_gwb = True
-            recompute_rn = False
-            recompute_dist = False
-
-
-        if which_jump_type==0:  # do prior draw (or empirical distribution in case of RN)
-            if which_jump==1: # updateing RN --> do empirical distribution step
-                new_point = samples_current.copy()
-                log_proposal_ratio = 0.
-
-                #overwrite the list of pulsars to update,
-                #because we might want to update fewer pulsars when using empirical distributions
-                #to help acceptence despite the penalty factors
-                #scale number of dimensions by a factor related to the temperature if it goes to T>~50 to avoid under-aggressive jumps
-                n_noise_emp_dist_loc = max(min(Npsr,np.int64(mcc.chain_params.n_noise_emp_dist*(Ts[j]/400.+1))),1)
-                idx_choose_psr = np.random.choice(Npsr,n_noise_emp_dist_loc,replace=False)
-
-                #log_proposal_ratio = 0.0
-                for psr_idx in idx_choose_psr:
-                    #use temperature adapted empirical distributions if possible
-                    #if mcc.rn_emp_dist_adapt is None:
-                    rn_emp_dist_loc = mcc.rn_emp_dist
-                    #else:
-                    #    rn_emp_dist_loc = mcc.rn_emp_dist_adapt[j]
-                    #rn_draw = mcc.rn_emp_dist[psr_idx].draw()
-                    rn_draw = rn_emp_dist_loc[psr_idx].draw()
-                    new_point[mcc.x0s[j].idx_rn_log10_As[psr_idx]] = rn_draw[0]
-                    new_point[mcc.x0s[j].idx_rn_gammas[psr_idx]] = rn_draw[1]
-
-                    log_proposal_ratio += rn_emp_dist_loc[psr_idx].logprob(np.array([samples_current[mcc.x0s[j].idx_rn_log10_As[psr_idx]],
-                                                                                     samples_current[mcc.x0s[j].idx_rn_gammas[psr_idx]]]))
-                    log_proposal_ratio +=-rn_emp_dist_loc[psr_idx].logprob(rn_draw)
-                    #if j==0: print("RNEmpDist--psr="+mcc.psrs[psr_idx].name)
-                    #if j==0: print("RNEmpDist--log_prop_ratio="+str(log_proposal_ratio))
-
-            else: # other parameter --> do actual prior draw
-                new_point = CWFastPrior.get_sample_idxs(samples_current.copy(),idx_choose,mcc.FPI)
-
-                log_prior_old = CWFastPrior.get_lnprior(samples_current, mcc.FPI)
-                log_prior_new = CWFastPrior.get_lnprior(new_point, mcc.FPI)
-                #backwards/forwards proposal ratio not necessarily 1 (e.g. for distances with non-flat priors)
-                log_proposal_ratio = log_prior_old - log_prior_new
-        elif which_jump_type==1:  # do differential evolution step
-            de_indices = np.random.choice(mcc.de_history.shape[1], size=2, replace=False)
-            ndim = idx_choose.size
-            #alpha0 = 2.38/np.sqrt(2*ndim)
-            alpha0 = 1.68/np.sqrt(ndim)*np.sqrt(Ts[j])
-            alpha = alpha0*np.random.normal(0.,1.)
-
-            x1 = np.copy(mcc.de_history[j,de_indices[0],idx_choose])
-            x2 = np.copy(mcc.de_history[j,de_indices[1],idx_choose])
-
-            new_point = np.copy(samples_current)
-            #new_point[idx_choose] += alpha0*(x1-x2)
-            #new_point[idx_choose] += alpha0*(1+alpha)*(x1-x2)
-
-            #backwards/forwards proposal ratio is always one for Gaussian jumps
-            log_proposal_ratio = 0.0
-
-            big_jump_decide = np.random.uniform(0.0, 1.0)
-            if big_jump_decide<mcc.chain_params.big_de_jump_prob: #do big jump
-                #new_point[idx_choose] += (1+alpha)*(x1-x2)
-                #TODO does this actually need to be scaled by a random amount?
-                new_point[idx_choose] += (x1-x2)
-            else: #do smaller jump scaled by alpha0
-                #new_point[idx_choose] += alpha0*(1+alpha)*(x1-x2)
-                new_point[idx_choose] += alpha*(x1-x2)
-        elif which_jump_type==2:  # do regular fisher jump
-            #jumps don't necessarily need to be mutually exclusive so use the indicator variables
-            new_point = samples_current.copy()
-            jump = np.zeros(mcc.n_par_tot)
-
-            #backwards/forwards proposal ratio is always one for Gaussian jumps
-            log_proposal_ratio = 0.0
-
-            if recompute_rn:  # use RN eigenvectors
-                scale_eig0 = scaling*mcc.eig_rn[j,:,0,:]
-                scale_eig1 = scaling*mcc.eig_rn[j,:,1,:]
-                new_point = add_rn_eig_jump(scale_eig0,scale_eig1,new_point,new_point[mcc.x0s[j].idx_rn],mcc.x0s[j].idx_rn,Npsr,all_eigs=all_eigs)
-
-            if recompute_gwb: # use diagonal fishers
-                idx_loc = np.array([mcc.x0s[j].idx_gwb_gamma, mcc.x0s[j].idx_gwb_log10_A])
-                fisher_diag_loc = scaling * mcc.fisher_diag[j][idx_loc]
-                jump[idx_loc] += fisher_diag_loc*np.random.normal(0.,1.,idx_loc.size)
-
-            if recompute_int:  # use common parameter eigenvectors
-                if all_eigs:
-                    #allows attempting all of the eigenvalue jumps simultaneously
-                    for itrp in range(0,4):
-                        jump[mcc.x0s[j].idx_cw_int[:4]] += scaling*mcc.eig_common[j,itrp,:].flatten()*np.random.normal(0., 1.)
-                else:
-                    which_eig = np.random.choice(4, size=1)
-                    jump[mcc.x0s[j].idx_cw_int[:4]] += scaling*mcc.eig_common[j,which_eig,:].flatten()*np.random.normal(0., 1.)
-
-            if recompute_dist:  # use diagonal fishers
-                idx_loc = mcc.x0s[j].idx_dists[idx_choose_psr_dist]
-                fisher_diag_loc = scaling * mcc.fisher_diag[j][idx_loc]
-                #smoothly saturate the jump sizes by adding the prior - takes into account the approximate width of the priors
-                fisher_diag_loc = np.sqrt(1./(1./fisher_diag_loc**2+n_jump_loc/(2.38*mcc.dist_prior_sigmas[idx_choose_psr_dist])**2))
-                jump[idx_loc] += fisher_diag_loc*np.random.normal(0.,1.,idx_loc.size)
-
-            new_point = new_point + jump
-
-        else:
-            raise ValueError('jump type unrecognized',which_jump_type)
-
-        #TODO check wrapping is working right
-        new_point = correct_intrinsic(new_point,mcc.x0s[j],mcc.chain_params.freq_bounds,mcc.FPI.cut_par_ids, mcc.FPI.cut_lows, mcc.FPI.cut_highs)
-
-        #more thorough jump types take precedence
-        mask = None
+        new_point,log_proposal_ratio,which_jump,which_jump_type,recompute_noise,recompute_int,idx_psr_dist,small_jump,draw_rn_emp = \
+            get_intrinsic_proposal(samples_current,mcc.x0s[j],cp.Ts[j],j==mcc.n_chain-1,mcc.FPI,mcc.fisher_diag[j],mcc.eig_rn[j],mcc.eig_common[j],mcc.de_history[j],
+                                   mcc.dist_prior_sigmas,jump_weights,cp.prior_draw_prob,cp.de_prob,cp.fisher_prob,cp.big_de_jump_prob,cp.n_dist_main,cp.freq_bounds,
+                                   mcc.rn_emp_dist is not None)
+        if draw_rn_emp:
+            new_point,log_proposal_ratio = get_rn_emp_dist_proposal(mcc,j,samples_current)
 
         if check_merged(new_point[mcc.x0s[j].idx_log10_fgw],new_point[mcc.x0s[j].idx_log10_mc],mcc.FLIs[j].max_toa):
             #do not do anything if already merged
-            mcc.x0s[j].validate_consistent(samples_current)
-            mcc.FLIs[j].validate_consistent(mcc.x0s[j])
-            new_point = samples_current.copy()
-            merged_point = True
-        elif recompute_rn or recompute_gwb:  # update per psr RN or GWB
-            #TODO check_merged should be done before this
-            if recompute_rn: #if rn update, set up mask to only update pulsars we need to update
-                mask = np.ones(Npsr,dtype=np.bool_)
-                mask[idx_choose_psr] = False
-                #don't necessarily need to update choleskys for distances
-                #if not in red noise mask but do need to update MM and NN so remove them from the mask
-                mask[idx_choose_psr_dist] = False
-
-                #print(mask)
-
-            #make sure FLI_swap corresponds to current chain and sample so that we can partially modify it
-            safe_reset_swap(mcc.FLI_swap,mcc.x0s[j],samples_current,FLI_mem_save)
-            for ii in range(Npsr):
-                mcc.FLI_swap.chol_Sigmas[ii][:] = mcc.FLIs[j].chol_Sigmas[ii]
-            assert mcc.FLI_swap.logdet == mcc.FLIs[j].logdet
-
+            print("Rejected due to too fast evolution.")
+            success = False
+        elif recompute_noise:  # update per psr RN or GWB
+            #sync the inactive buffer of this chain to the current sample except for the noise blocks recomputed below
+            FLI_buf = get_synced_FLI_buf(mcc,j,np.ones(Npsr,dtype=np.bool_))
             mcc.x0s[j].update_params(new_point)
             try:
-                mcc.flm.recompute_FastLike(mcc.FLI_swap,mcc.x0s[j],dict(zip(mcc.par_names, new_point)), mask=mask)
+                mcc.flm.recompute_FastLike(FLI_buf,mcc.x0s[j],dict(zip(mcc.par_names, new_point)))
+                success = True
             except np.linalg.LinAlgError:
                 print("failed to update parameters to requested point, rejecting proposal")
                 print("jump selections: ",which_jump,which_jump_type)
-                print("idx choose",idx_choose)
                 print("log proposal ratio",log_proposal_ratio)
-
-                if which_jump_type==1:
-                    print("de jump selections: ",de_indices,big_jump_decide,alpha0,alpha)
-                    print("de point 1",x1)
-                    print("de point 2",x2)
-                elif which_jump_type==2:
-                    print("fisher jump selections",jump)
-
-                t_err = perf_counter()
-                old_file = "err_state_old_"+str(t_err)+".npy"
-                new_file = "err_state_new_"+str(t_err)+".npy"
-                print("failure point:",new_point)
-                print("failure point output to:",new_file)
-                print("old point:",samples_current)
-                print("old point output to:",old_file)
-                np.save(new_file,new_point)
-                np.save(old_file,samples_current)
+                save_err_state(new_point,samples_current)
                 print("attempting recovery to old point")
+                #FLIs[j] was not touched and the pulsars being recomputed in the buffer are already marked stale
                 mcc.x0s[j].update_params(samples_current)
-                safe_reset_swap(mcc.FLI_swap,mcc.x0s[j],samples_current,FLI_mem_save)
-                for ii in range(Npsr):
-                    mcc.FLI_swap.chol_Sigmas[ii][:] = mcc.FLIs[j].chol_Sigmas[ii]
+                print("Rejected due to error in point")
 
+                success = False
                 fail_point = True
+        else:  # update common intrinsic parameters or psr distances
+            update_intrinsic_proposal(mcc.FLIs[j],mcc.FLI_bufs[j],mcc.FLI_buf_stale[j],mcc.x0s[j],new_point,recompute_int,idx_psr_dist,
+                                      small_jump and len(mcc.RBIs)>0,mcc.RBIs,j)
+            success = True
 
-            mcc.FLI_swap.validate_consistent(mcc.x0s[j])
-        elif recompute_int:  # update common intrinsic parameters (chirp mass, frequency, sky location[2])
-            mcc.x0s[j].update_params(new_point)
-            mcc.FLIs[j].update_intrinsic_params(mcc.x0s[j])
-            mcc.FLIs[j].validate_consistent(mcc.x0s[j])
-        elif recompute_dist:  # update psr distances
-            mcc.x0s[j].update_params(new_point)
-            mcc.FLIs[j].update_pulsar_distances(mcc.x0s[j], idx_choose_psr_dist)
-            mcc.FLIs[j].validate_consistent(mcc.x0s[j])
-        else:
-            raise ValueError('no recompute type selected')
+        finish_intrinsic_step(j,itrb,success,new_point,samples_current,log_proposal_ratio,6*which_jump+2*which_jump_type,cp.Ts[j],
+                              mcc.samples,mcc.log_likelihood,mcc.x0s,mcc.FLIs,mcc.FLI_bufs,mcc.fisher_diag[j],mcc.FPI,mcc.a_yes,mcc.a_no,mcc.n_tries[j],mcc.mt_ess_stats,mcc.mt_like_counts)
 
-        #save current MM and NN
-        FLI_mem_new = get_FLI_mem(mcc.FLIs[j])
+    if fail_point:
+        #something went wrong so do extra test of self consistency
+        mcc.validate_consistent(itrb+1)
 
-        #check_not_merged(mcc.x0s[j].log10_fgw,mcc.x0s[j].log10_mc,FLIs[j].max_toa)
-        #w0 = np.pi * 10.0**mcc.x0s[j].log10_fgw
-        #mc = 10.0**mcc.x0s[j].log10_mc# * const.Tsun
+def save_err_state(new_point,samples_current):
+    """save the proposed and the old point of a proposal the noise blocks could not be recomputed at
 
-        #check the maximum toa is not such that the source has already merged, and if so automatically reject the proposal
-        if fail_point:
+    :param new_point:           Proposed point which failed
+    :param samples_current:     Point the chain stays at
+    """
+    t_err = perf_counter()
+    old_file = "err_state_old_"+str(t_err)+".npy"
+    new_file = "err_state_new_"+str(t_err)+".npy"
+    print("failure point:",new_point)
+    print("failure point output to:",new_file)
+    print("old point:",samples_current)
+    print("old point output to:",old_file)
+    np.save(new_file,new_point)
+    np.save(old_file,samples_current)
+
+@njit()
+def do_intrinsic_block_mt(n_chain,samples,itrb,Ts,x0s,FLIs,FLI_bufs,FLI_buf_stale,FPI,log_likelihood,fisher_diag,eig_rn,eig_common,de_history,dist_prior_sigmas,
+                          jump_weights,prior_draw_prob,de_prob,fisher_prob,big_de_jump_prob,n_dist_main,freq_bounds,RBIs,noise_args,a_yes,a_no,n_tries,mt_ess_stats,
+                          mt_like_counts,concurrent=False):
+    """do the intrinsic update of every chain using the multiple try mcmc algorithm without returning to python,
+    needs the native phiinv of FastLikeMaster and no RN empirical distributions
+
+    :param n_chain:             Number of PT chains
+    :param samples:             Array holding posterior samples
+    :param itrb:                Index within saved values (as opposed to block index itri or overall index itrn)
+    :param Ts:                  List of PT temperatures
+    :param x0s:                 List of CWInfo objects
+    :param FLIs:                List of FastLikeInfo objects
+    :param FLI_bufs:            List of inactive FastLikeInfo buffers of each chain
+    :param FLI_buf_stale:       (n_chain, Npsr) array of the pulsars whose noise blocks in FLI_bufs differ from FLIs
+    :param FPI:                 FastPriorInfo object
+    :param log_likelihood:      Array holding log likelihood values
+    :param fisher_diag:         Diagonal fisher
+    :param eig_rn:              RN eigenvectors
+    :param eig_common:          Common parameter eigenvectors
+    :param de_history:          Differential evolution history
+    :param dist_prior_sigmas:   Approximate widths of the pulsar distance priors
+    :param jump_weights:        Weights of the distance, per psr RN, GWB, common and all parameter jumps
+    :param prior_draw_prob:     Weight of prior draws
+    :param de_prob:             Weight of differential evolution jumps
+    :param fisher_prob:         Weight of fisher jumps
+    :param big_de_jump_prob:    Probability of a differential evolution jump not being scaled down
+    :param n_dist_main:         Largest number of pulsar distances to jump in at once
+    :param freq_bounds:         Lower and upper prior bounds of GW frequency
+    :param RBIs:                List of RelBinInfo objects of each chain, empty to always use the exact filters
+    :param noise_args:          FastLikeMaster.native_noise_args
+    :param a_yes:               Array to hold number of accepted steps
+    :param a_no:                Array to hold number of rejected steps
+    :param n_tries:             Number of multiple tries of each chain
+    :param mt_ess_stats:        (n_chain, 2) array accumulating the effective sample size of the multiple try weights and the number of steps it was recorded for
+    :param mt_like_counts:      (n_chain, 2) array counting the multiple try likelihoods evaluated and skipped for zero prior density
+    :param concurrent:          If True, evaluate the multiple tries of all chains together in one parallel loop,
+                                instead of finishing the step of one chain before proposing for the next [False]
+
+    :return fail_points:        Array indicating the chains whose noise blocks could not be recomputed at the proposed point
+    :return new_points:         Proposed point of each chain
+    :return samples_currents:   Point each chain started the step from
+    """
+    samples_currents = samples[:,itrb,:].copy()
+    new_points = samples_currents.copy()
+    log_proposal_ratios = np.zeros(n_chain)
+    idx_accs = np.zeros(n_chain,dtype=np.int64)
+    successes = np.zeros(n_chain,dtype=np.bool_)
+    fail_points = np.zeros(n_chain,dtype=np.bool_)
+    if not concurrent:
+        for j in range(n_chain):
+            new_points[j],log_proposal_ratios[j],idx_accs[j],successes[j],fail_points[j] = \
+                propose_intrinsic_step_native(j,samples_currents[j],n_chain,Ts[j],x0s,FLIs,FLI_bufs,FLI_buf_stale,FPI,fisher_diag[j],eig_rn[j],eig_common[j],de_history[j],
+                                              dist_prior_sigmas,jump_weights,prior_draw_prob,de_prob,fisher_prob,big_de_jump_prob,n_dist_main,freq_bounds,RBIs,noise_args)
+            finish_intrinsic_step(j,itrb,successes[j],new_points[j],samples_currents[j],log_proposal_ratios[j],idx_accs[j],Ts[j],
+                                  samples,log_likelihood,x0s,FLIs,FLI_bufs,fisher_diag[j],FPI,a_yes,a_no,n_tries[j],mt_ess_stats,mt_like_counts)
+        return fail_points,new_points,samples_currents
+
+    #the proposals stay sequential, the noise recomputes share the cholesky store and the native scratch of FastLikeMaster,
+    #but each of them is already parallel over the pulsars
+    n_par = samples.shape[2]
+    log_posterior_olds = np.zeros(n_chain)
+    #chains with fewer tries only fill the start of their rows
+    n_try_max = np.max(n_tries)
+    n_tries_use = np.zeros(n_chain,dtype=np.int64)
+    tries = np.zeros((n_chain,n_try_max,n_par))
+    log_prior_news = np.zeros((n_chain,n_try_max))
+    jumps_all = List()
+    fisher_masks = List()
+    random_draws_all = List()
+    for j in range(n_chain):
+        new_points[j],log_proposal_ratios[j],idx_accs[j],successes[j],fail_points[j] = \
+            propose_intrinsic_step_native(j,samples_currents[j],n_chain,Ts[j],x0s,FLIs,FLI_bufs,FLI_buf_stale,FPI,fisher_diag[j],eig_rn[j],eig_common[j],de_history[j],
+                                          dist_prior_sigmas,jump_weights,prior_draw_prob,de_prob,fisher_prob,big_de_jump_prob,n_dist_main,freq_bounds,RBIs,noise_args)
+        if successes[j]:
+            log_posterior_olds[j] = get_log_posterior_old(samples_currents[j],log_likelihood[j,itrb],Ts[j],FPI)
+            n_tries_use[j] = n_tries[j]
+            tries[j,:n_tries[j]],log_prior_news[j,:n_tries[j]],jumps,fisher_mask,random_draws_from_prior = get_mt_tries(x0s[j],Ts[j],fisher_diag[j],FPI,new_points[j],n_tries[j])
+        else:
+            jumps = np.zeros((0,0))
+            fisher_mask = np.zeros(0,dtype=np.bool_)
+            random_draws_from_prior = np.zeros((0,0))
+        jumps_all.append(jumps)
+        fisher_masks.append(fisher_mask)
+        random_draws_all.append(random_draws_from_prior)
+
+    #the likelihoods of the tries of all chains at once, every chain at its proposed shape parameters
+    log_Ls = get_batch_lnlikelihoods_chains(x0s[0],FLI_bufs,tries,log_prior_news,n_tries_use,mt_like_counts)
+
+    ref_tries = np.zeros((n_chain,n_try_max,n_par))
+    log_prior_refs = np.zeros((n_chain,n_try_max))
+    n_refs_use = np.zeros(n_chain,dtype=np.int64)
+    mt_weights = np.zeros((n_chain,n_try_max))
+    log_mt_norm_shifts = np.zeros(n_chain)
+    chosen_trials = np.full(n_chain,-1)
+    for j in range(n_chain):
+        if not successes[j]:
+            continue
+        n_try = n_tries[j]
+        mt_weights[j,:n_try],log_mt_norm_shifts[j] = get_mt_weights_from_lnlikelihoods(log_Ls[j,:n_try],Ts[j],log_posterior_olds[j],log_prior_news[j,:n_try])
+        assert np.all(np.isfinite(mt_weights[j]))
+        if np.sum(mt_weights[j])!=0.0:
+            add_mt_ess(mt_ess_stats,j,mt_weights[j,:n_try])
+            chosen_trials[j] = choose_weighted(mt_weights[j,:n_try])
+            ref_tries[j,:n_try],log_prior_refs[j,:n_try] = get_mt_ref_tries(x0s[j],FPI,samples_currents[j],tries[j,chosen_trials[j]],jumps_all[j],fisher_masks[j],random_draws_all[j])
+            n_refs_use[j] = n_try
+
+    #the likelihoods of the reference points of all chains at once, FLIs are still at the current shape parameters
+    log_L_refs = get_batch_lnlikelihoods_chains(x0s[0],FLIs,ref_tries,log_prior_refs,n_refs_use,mt_like_counts)
+
+    for j in range(n_chain):
+        if n_refs_use[j]>0:
+            n_try = n_tries[j]
+            ref_mt_weights,log_ref_mt_norm_shift = get_ref_mt_weights_from_lnlikelihoods(log_L_refs[j,:n_try],Ts[j],log_posterior_olds[j],chosen_trials[j],log_prior_refs[j,:n_try])
+            log_acc_ratio = np.log(np.sum(mt_weights[j]))-np.log(np.sum(ref_mt_weights))+log_mt_norm_shifts[j]-log_ref_mt_norm_shift+log_proposal_ratios[j]
+            sample_choose = tries[j,chosen_trials[j]].copy()
+            log_L_choose = log_Ls[j,chosen_trials[j]]
+        else:
             log_acc_ratio = -np.inf
-            log_acc_decide = 1.
+            sample_choose = samples_currents[j]
             log_L_choose = -np.inf
-            chosen_trial = -1
+        accept_intrinsic_step(j,itrb,log_acc_ratio,chosen_trials[j],sample_choose,log_L_choose,samples_currents[j],idx_accs[j],
+                              samples,log_likelihood,x0s,FLIs,FLI_bufs,a_yes,a_no)
+    return fail_points,new_points,samples_currents
+
+@njit()
+def propose_intrinsic_step_native(j,samples_current,n_chain,T,x0s,FLIs,FLI_bufs,FLI_buf_stale,FPI,fisher_diag,eig_rn,eig_common,de_history,dist_prior_sigmas,
+                                  jump_weights,prior_draw_prob,de_prob,fisher_prob,big_de_jump_prob,n_dist_main,freq_bounds,RBIs,noise_args):
+    """propose a new shape point for chain j and write it into FLI_bufs[j], recomputing the noise blocks with the native phiinv if needed
+
+    :param j:                   Index of PT chain
+    :param samples_current:     Current point of the chain
+    :param n_chain:             Number of PT chains
+    :param T:                   Temperature of the chain
+    :param x0s:                 List of CWInfo objects, x0s[j] is left at the proposed point
+    :param FLIs:                List of FastLikeInfo objects
+    :param FLI_bufs:            List of inactive FastLikeInfo buffers of each chain
+    :param FLI_buf_stale:       (n_chain, Npsr) array of the pulsars whose noise blocks in FLI_bufs differ from FLIs
+    :param FPI:                 FastPriorInfo object
+    :param fisher_diag:         Diagonal fisher of the chain
+    :param eig_rn:              RN eigenvectors of the chain
+    :param eig_common:          Common parameter eigenvectors of the chain
+    :param de_history:          Differential evolution history of the chain
+    :param dist_prior_sigmas:   Approximate widths of the pulsar distance priors
+    :param jump_weights:        Weights of the distance, per psr RN, GWB, common and all parameter jumps
+    :param prior_draw_prob:     Weight of prior draws
+    :param de_prob:             Weight of differential evolution jumps
+    :param fisher_prob:         Weight of fisher jumps
+    :param big_de_jump_prob:    Probability of a differential evolution jump not being scaled down
+    :param n_dist_main:         Largest number of pulsar distances to jump in at once
+    :param freq_bounds:         Lower and upper prior bounds of GW frequency
+    :param RBIs:                List of RelBinInfo objects of each chain, empty to always use the exact filters
+    :param noise_args:          FastLikeMaster.native_noise_args
+
+    :return new_point:          Proposed point
+    :return log_proposal_ratio: Log of the backwards/forwards proposal ratio
+    :return idx_acc:            Row of a_yes and a_no counting the jump type
+    :return success:            False if the proposal is rejected without trying (merged or not computable)
+    :return fail_point:         True if the noise blocks could not be recomputed at the proposed point
+    """
+    Npsr = x0s[j].Npsr
+    new_point,log_proposal_ratio,which_jump,which_jump_type,recompute_noise,recompute_int,idx_psr_dist,small_jump,draw_rn_emp = \
+        get_intrinsic_proposal(samples_current,x0s[j],T,j==n_chain-1,FPI,fisher_diag,eig_rn,eig_common,de_history,
+                               dist_prior_sigmas,jump_weights,prior_draw_prob,de_prob,fisher_prob,big_de_jump_prob,n_dist_main,freq_bounds,False)
+
+    if check_merged(new_point[x0s[j].idx_log10_fgw],new_point[x0s[j].idx_log10_mc],FLIs[j].max_toa):
+        #do not do anything if already merged
+        print("Rejected due to too fast evolution.")
+        success = False
+        fail_point = False
+    elif recompute_noise:  # update per psr RN or GWB
+        sync_FLI_buf(FLIs[j],FLI_bufs[j],FLI_buf_stale[j],np.ones(Npsr,dtype=np.bool_))
+        x0s[j].update_params(new_point)
+        infos = recompute_noise_native(FLI_bufs[j],x0s[j],np.zeros(Npsr,dtype=np.bool_),noise_args)
+        success = not np.any(infos!=0)
+        fail_point = not success
+        if fail_point:
+            #the caller saves the failure and old points and checks the self consistency of all chains
+            print("failed to update parameters to requested point, rejecting proposal")
+            print("jump selections: ",which_jump,which_jump_type)
+            print("log proposal ratio",log_proposal_ratio)
+            #FLIs[j] was not touched and the pulsars being recomputed in the buffer are already marked stale
+            x0s[j].update_params(samples_current)
             print("Rejected due to error in point")
-            mcc.x0s[j].update_params(samples_current)
-            safe_reset_swap(mcc.FLIs[j],mcc.x0s[j],samples_current,FLI_mem_save)
-            mcc.x0s[j].validate_consistent(samples_current)
-            mcc.FLIs[j].validate_consistent(mcc.x0s[j])
-        elif merged_point:#check_merged(mcc.x0s[j].log10_fgw,mcc.x0s[j].log10_mc,mcc.FLIs[j].max_toa):
-            #TODO should do this check before updating choleskys
-            #set these so that the step is rejected
-            #acc_ratio = -1
-            #acc_decide = 0.
-            log_acc_ratio = -np.inf
-            log_acc_decide = 1.
-            log_L_choose = -np.inf
-            chosen_trial = -1
-            print("Rejected due to too fast evolution.")
-            #mcc.x0s[j].update_params(samples_current)
-            #safe_reset_swap(mcc.FLIs[j],mcc.x0s[j],samples_current,FLI_mem_save)
-            #for ii in range(Npsr):
-            #    mcc.FLI_swap.chol_Sigmas[ii][:] = mcc.FLIs[j].chol_Sigmas[ii]
-            mcc.x0s[j].validate_consistent(samples_current)
-            mcc.FLIs[j].validate_consistent(mcc.x0s[j])
+    else:  # update common intrinsic parameters or psr distances
+        update_intrinsic_proposal(FLIs[j],FLI_bufs[j],FLI_buf_stale[j],x0s[j],new_point,recompute_int,idx_psr_dist,small_jump and len(RBIs)>0,RBIs,j)
+        success = True
+        fail_point = False
+    return new_point,log_proposal_ratio,6*which_jump+2*which_jump_type,success,fail_point
+
+@njit()
+def choose_weighted(weights):
+    """draw an index with probability proportional to weights, like np.random.choice(weights.size,p=weights/np.sum(weights))
+
+    :param weights:     Array of non-negative weights, not all zero
+
+    :return:            Index drawn
+    """
+    cum_weights = np.cumsum(weights)
+    return min(np.searchsorted(cum_weights,uniform(0.,cum_weights[-1]),side='right'),weights.size-1)
+
+@njit()
+def get_intrinsic_proposal(samples_current,x0,T,is_hottest,FPI,fisher_diag,eig_rn,eig_common,de_history,dist_prior_sigmas,jump_weights,
+                           prior_draw_prob,de_prob,fisher_prob,big_de_jump_prob,n_dist_main,freq_bounds,has_rn_emp_dist):
+    """choose which intrinsic parameters to jump in and the type of jump, and propose a new point
+
+    :param samples_current:     Current point in parameter space
+    :param x0:                  CWInfo object
+    :param T:                   Temperature of the chain
+    :param is_hottest:          True for the hottest chain
+    :param FPI:                 FastPriorInfo object
+    :param fisher_diag:         Diagonal fisher of the chain
+    :param eig_rn:              RN eigenvectors of the chain
+    :param eig_common:          Common parameter eigenvectors of the chain
+    :param de_history:          Differential evolution history of the chain
+    :param dist_prior_sigmas:   Approximate widths of the pulsar distance priors
+    :param jump_weights:        Weights of the distance, per psr RN, GWB, common and all parameter jumps
+    :param prior_draw_prob:     Weight of prior draws (empirical distribution draws for RN)
+    :param de_prob:             Weight of differential evolution jumps
+    :param fisher_prob:         Weight of fisher jumps
+    :param big_de_jump_prob:    Probability of a differential evolution jump not being scaled down
+    :param n_dist_main:         Largest number of pulsar distances to jump in at once
+    :param freq_bounds:         Lower and upper prior bounds of GW frequency
+    :param has_rn_emp_dist:     True if there are RN empirical distributions to draw from
+
+    :return new_point:          Proposed point
+    :return log_proposal_ratio: Log of the backwards/forwards proposal ratio
+    :return which_jump:         Parameters jumped in (distances, per psr RN, GWB, common, all)
+    :return which_jump_type:    Type of jump (prior draw, differential evolution, fisher)
+    :return recompute_noise:    True if the noise blocks have to be recomputed
+    :return recompute_int:      True if the common intrinsic parameters changed
+    :return idx_psr_dist:       Indices of the pulsars whose distances may have changed
+    :return small_jump:         True if the jump stays close enough to the current point to use relative binning
+    :return draw_rn_emp:        True if the RN parameters still have to be drawn from the empirical distributions, new_point is then unchanged
+    """
+    Npsr = x0.Npsr
+    which_jump = choose_weighted(jump_weights)
+
+    #replace checking which_jump==1 etc with indicator values for desired behavior so that more jump types can be added in the future
+    recompute_rn = False
+    recompute_gwb = False
+    recompute_int = False
+    recompute_dist = False
+    all_eigs = False
+
+    idx_psr_dist = np.arange(Npsr)
+    if which_jump==0:  # update psr distances
+        recompute_dist = True
+        n_dist_loc = min(Npsr,n_dist_main)
+        idx_psr_dist = np.random.choice(Npsr,n_dist_loc,replace=False)
+        n_jump_loc = n_dist_loc
+        idx_choose = x0.idx_dists[idx_psr_dist]
+        scaling = 2.38*np.sqrt(T)/np.sqrt(n_jump_loc)
+    elif which_jump==1:  # update per psr RN
+        recompute_rn = True
+        all_eigs = True
+        n_jump_loc = 2*Npsr
+        idx_choose = x0.idx_rn.copy()
+        scaling = 2.38*np.sqrt(T)/np.sqrt(n_jump_loc)
+    elif which_jump==2:  # update common RN
+        recompute_gwb = True
+        n_jump_loc = 2
+        idx_choose = x0.idx_gwb.copy()
+        scaling = 2.38*np.sqrt(T)/np.sqrt(n_jump_loc/2)
+    elif which_jump==3:  # update common intrinsic parameters (chirp mass, frequency, sky location[2])
+        recompute_int = True
+        all_eigs = True
+        n_jump_loc = 4
+        idx_choose = x0.idx_cw_int[:4].copy()
+
+        #don't count parameters where jump sizes are probably saturated for the purposes of determining the appropriate jump sizing
+        saturated_idxs = np.sum((2.38*np.sqrt(T)*fisher_diag[idx_choose])>0.5)
+        if saturated_idxs==n_jump_loc:
+            saturated_idxs = n_jump_loc-1
+
+        scaling = 2.38*np.sqrt(T)/np.sqrt(n_jump_loc-saturated_idxs)
+    else:  # do every possible jump
+        #including this ensures any point in parameter space has some finite probability density to be reached in a single jump
+        recompute_rn = True
+        recompute_gwb = True
+        recompute_int = True
+        recompute_dist = True
+        all_eigs = True
+        n_dist_loc = min(Npsr,n_dist_main)
+        idx_psr_dist = np.random.choice(Npsr,n_dist_loc,replace=False)
+        n_jump_loc = 2*Npsr+4+2 #distance+RN+common_pars+crn
+        idx_choose = np.concatenate((x0.idx_cw_int[:4],x0.idx_rn,x0.idx_gwb))
+        scaling = 2.38*np.sqrt(T)/np.sqrt(n_jump_loc)
+
+    #decide what kind of jump we do
+    if recompute_rn and not recompute_gwb:
+        #RN jump w/o emp dist --> only do fisher, w/ emp dist --> do fisher and emp dist (called prior here)
+        type_weights = np.array([prior_draw_prob if has_rn_emp_dist else 0.,0.,fisher_prob])
+    elif recompute_gwb:  # GWB or all --> do fisher and DE only
+        type_weights = np.array([0.,de_prob,fisher_prob])
+    elif is_hottest and which_jump==3:  # common parameters and hottest chain --> only do prior draws
+        type_weights = np.array([prior_draw_prob,0.,0.])
+    elif which_jump!=3:  # distance jump --> do prior draws and fisher
+        type_weights = np.array([prior_draw_prob,0.,fisher_prob])
+    else:  # common jump --> do everything
+        type_weights = np.array([prior_draw_prob,de_prob,fisher_prob])
+    which_jump_type = choose_weighted(type_weights)
+
+    if which_jump_type==1 and which_jump==4:
+        #force 'all' differential evolution jumps to be in both gwb and common parameters only
+        idx_choose = np.concatenate((x0.idx_cw_int[:4],x0.idx_gwb))
+        n_jump_loc = 6
+        scaling = 2.38*np.sqrt(T)/np.sqrt(n_jump_loc)
+        idx_psr_dist = np.zeros(0,dtype=np.int64)
+        recompute_rn = False
+        recompute_dist = False
+
+    new_point = samples_current.copy()
+    #backwards/forwards proposal ratio is always one for Gaussian jumps
+    log_proposal_ratio = 0.
+    small_jump = False
+    draw_rn_emp = False
+    if which_jump_type==0:  # do prior draw (or empirical distribution in case of RN)
+        if which_jump==1:
+            #the empirical distributions are python objects, so the caller draws from them
+            draw_rn_emp = True
         else:
-            log_acc_ratio,chosen_trial,sample_choose,log_L_choose = do_mt_step(mcc,j,itrb,new_point,samples_current,FLI_mem_save,recompute_rn or recompute_gwb,log_proposal_ratio)
-            if np.isfinite(log_acc_ratio):
-                log_acc_decide = np.log(uniform(1.e-304, 1.0))
+            new_point = CWFastPrior.get_sample_idxs(new_point,idx_choose,FPI)
+            #backwards/forwards proposal ratio not necessarily 1 (e.g. for distances with non-flat priors)
+            log_proposal_ratio = CWFastPrior.get_lnprior(samples_current,FPI)-CWFastPrior.get_lnprior(new_point,FPI)
+    elif which_jump_type==1:  # do differential evolution step
+        de_indices = np.random.choice(de_history.shape[0],2,replace=False)
+        alpha0 = 1.68/np.sqrt(idx_choose.size)*np.sqrt(T)
+        alpha = alpha0*np.random.normal(0.,1.)
+
+        x1 = de_history[de_indices[0]][idx_choose]
+        x2 = de_history[de_indices[1]][idx_choose]
+
+        if uniform(0.0,1.0)<big_de_jump_prob:  # do big jump
+            new_point[idx_choose] += x1-x2
+        else:  # do smaller jump scaled by alpha0
+            new_point[idx_choose] += alpha*(x1-x2)
+            small_jump = True
+    else:  # do regular fisher jump
+        small_jump = True
+        #jumps don't necessarily need to be mutually exclusive so use the indicator variables
+        jump = np.zeros(new_point.size)
+
+        if recompute_rn:  # use RN eigenvectors
+            new_point = add_rn_eig_jump(scaling*eig_rn[:,0,:],scaling*eig_rn[:,1,:],new_point,new_point[x0.idx_rn],x0.idx_rn,Npsr,all_eigs=all_eigs)
+
+        if recompute_gwb:  # use diagonal fishers
+            jump[x0.idx_gwb] += scaling*fisher_diag[x0.idx_gwb]*np.random.normal(0.,1.,2)
+
+        if recompute_int:  # use common parameter eigenvectors
+            idx_common = x0.idx_cw_int[:4]
+            if all_eigs:
+                #allows attempting all of the eigenvalue jumps simultaneously
+                for itrp in range(0,4):
+                    jump[idx_common] += scaling*eig_common[itrp,:]*np.random.normal(0.,1.)
             else:
-                log_acc_decide = 1.
-
-            #if j==0 and which_jump_type==0 and which_jump==1:
-            #    print("RNEmpDist--log_acc_ratio="+str(log_acc_ratio))
-            #    print("RNEmpDist--log_L_current="+str(mcc.log_likelihood[j,itrb]))
-            #    print("RNEmpDist--log_L_choose="+str(log_L_choose))
-            #    print("RNEmpDist--log_L_choose_from_pta="+str(mcc.pta.get_lnlikelihood(sample_choose)))
-            #    print(samples_current)
-            #    print(sample_choose)
-            #    print(sample_choose-samples_current)
-
-        if log_acc_decide<=log_acc_ratio:
-            #if j==0 and which_jump_type==0 and which_jump==1: print("Accepted")
-            #accepted
-            mcc.x0s[j].update_params(sample_choose)
-
-            mcc.samples[j,itrb+1,:] = sample_choose
-
-            if recompute_rn or recompute_gwb:
-                #swap the temporary FLI for the old one
-                FLI_temp = mcc.FLIs[j]
-                mcc.FLIs[j] = mcc.FLI_swap
-                mcc.FLI_swap = FLI_temp
-                mcc.FLIs[j].validate_consistent(mcc.x0s[j])
-                mcc.x0s[j].validate_consistent(sample_choose)
-                #print('3',mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]))
-            else:
-                #since we reverted to old ones for calculating the reference point likelihoods, revert that
-                safe_reset_swap(mcc.FLIs[j],mcc.x0s[j],sample_choose,FLI_mem_new)
-                mcc.FLIs[j].validate_consistent(mcc.x0s[j])
-                mcc.x0s[j].validate_consistent(sample_choose)
-                #print('4',mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]))
-
-            mcc.log_likelihood[j,itrb+1] = log_L_choose
-            if chosen_trial==0:
-                mcc.a_yes[6*which_jump+2*which_jump_type,j] += 1
-            else:
-                mcc.a_no[6*which_jump+2*which_jump_type,j] += 1
-            mcc.a_yes[6*which_jump+2*which_jump_type+1,j] += 1
-            #print('1',mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]))
-        else:
-            #if j==0 and which_jump_type==0 and which_jump==1: print("Rejected")
-            #rejected
-            mcc.samples[j,itrb+1,:] = samples_current
+                jump[idx_common] += scaling*eig_common[np.random.randint(0,4),:]*np.random.normal(0.,1.)
 
-            mcc.log_likelihood[j,itrb+1] = mcc.log_likelihood[j,itrb]
+        if recompute_dist:  # use diagonal fishers
+            idx_loc = x0.idx_dists[idx_psr_dist]
+            fisher_diag_loc = scaling*fisher_diag[idx_loc]
+            #smoothly saturate the jump sizes by adding the prior - takes into account the approximate width of the priors
+            fisher_diag_loc = np.sqrt(1./(1./fisher_diag_loc**2+n_jump_loc/(2.38*dist_prior_sigmas[idx_psr_dist])**2))
+            jump[idx_loc] += fisher_diag_loc*np.random.normal(0.,1.,idx_loc.size)
 
-            #Add to both elements of a_no, so we can get acceptance over total jumps w/ and w/o projection perturbation
-            if chosen_trial==0 and np.isfinite(log_acc_ratio):
-                mcc.a_yes[6*which_jump+2*which_jump_type,j] += 1
-            else:
-                mcc.a_no[6*which_jump+2*which_jump_type,j] += 1
-            mcc.a_no[6*which_jump+2*which_jump_type+1,j] += 1
+        new_point = new_point+jump
 
-            mcc.x0s[j].update_params(samples_current)
+    if not draw_rn_emp:
+        new_point = correct_intrinsic(new_point,x0,freq_bounds,FPI.cut_par_ids,FPI.cut_lows,FPI.cut_highs)
 
-            #print('2',mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]))
-            if not recompute_rn and not recompute_gwb:
-                #don't needs to do anything if which_jump==1 because we didn't update FLIs[j] at all,
-                #and FLI_swap will just be completely overwritten next time it is used
+    return new_point,log_proposal_ratio,which_jump,which_jump_type,recompute_rn or recompute_gwb,recompute_int,idx_psr_dist,small_jump,draw_rn_emp
 
-                #revert the changes to FastLs
-                safe_reset_swap(mcc.FLIs[j],mcc.x0s[j],samples_current,FLI_mem_save)
-            else:
-                #revert swap to guaranteed self consistent state
-                safe_reset_swap(mcc.FLI_swap,mcc.x0s[j],samples_current,FLI_mem_save)
-                for ii in range(Npsr):
-                    mcc.FLI_swap.chol_Sigmas[ii][:] = mcc.FLIs[j].chol_Sigmas[ii]
-
-            #print('2',mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]))
-        #print(which_jump)
-        #print(mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]),mcc.log_likelihood[j,itrb+1])
-        mcc.FLIs[j].validate_consistent(mcc.x0s[j])
-        mcc.x0s[j].validate_consistent(mcc.samples[j,itrb+1,:])
-        assert mcc.FLIs[j].get_lnlikelihood(mcc.x0s[j]) == mcc.log_likelihood[j,itrb+1]
-        if not recompute_dist:
-            assert np.all(mcc.samples[j,itrb,mcc.x0_swap.idx_dists]==mcc.samples[j,itrb+1,mcc.x0_swap.idx_dists])
-        if not recompute_gwb:
-            assert np.all(mcc.samples[j,itrb,mcc.x0_swap.idx_gwb]==mcc.samples[j,itrb+1,mcc.x0_swap.idx_gwb])
-        if not recompute_int:
-            assert np.all(mcc.samples[j,itrb,mcc.x0_swap.idx_cw_int[:4]]==mcc.samples[j,itrb+1,mcc.x0_swap.idx_cw_int[:4]])
-        if not recompute_rn:
-            assert np.all(mcc.samples[j,itrb,mcc.x0_swap.idx_rn]==mcc.samples[j,itrb+1,mcc.x0_swap.idx_rn])
-        if fail_point or merged_point or log_acc_decide>log_acc_ratio:
-            #check nothing changed if the point failed
-            assert np.all(mcc.samples[j,itrb,:]==mcc.samples[j,itrb+1,:])
-            assert mcc.log_likelihood[j,itrb+1]==mcc.log_likelihood[j,itrb]
-
-        if mask is not None:
-            if np.any(mask):
-                #no updating gwb or common unless everything was updated
-                assert np.all(mcc.samples[j,itrb,mcc.x0_swap.idx_cw_int[:4]]==mcc.samples[j,itrb+1,mcc.x0_swap.idx_cw_int[:4]])
-                assert np.all(mcc.samples[j,itrb,mcc.x0_swap.idx_gwb]==mcc.samples[j,itrb+1,mcc.x0_swap.idx_gwb])
-                #no distance updates for parameters that were masked
-                assert np.all(mcc.samples[j,itrb,mcc.x0_swap.idx_dists[mask]]==mcc.samples[j,itrb+1,mcc.x0_swap.idx_dists[mask]])
-                #no red noise updates for parameters that were masked
-                assert np.all(mcc.samples[j,itrb,mcc.x0_swap.idx_rn_log10_As[mask]]==mcc.samples[j,itrb+1,mcc.x0_swap.idx_rn_log10_As[mask]])
-                assert np.all(mcc.samples[j,itrb,mcc.x0_swap.idx_rn_gammas[mask]]==mcc.samples[j,itrb+1,mcc.x0_swap.idx_rn_gammas[mask]])
-            #no red noise updates for parameters that were not masked
-
-        #print(j,Ts[j],which_jump,which_jump_type,recompute_dist,recompute_gwb,recompute_int,recompute_rn,log_acc_decide,log_acc_ratio,log_acc_decide<log_acc_ratio,log_L_choose,chosen_trial)
-        #print(idx_choose)
-        #print(mask)
-        #if log_acc_decide<=log_acc_ratio:
-        #    print(mcc.FLI_swap.logdet)
-        #    mcc.x0_swap.update_params(new_point)
-        #    mcc.flm.recompute_FastLike(mcc.FLI_swap,mcc.x0_swap,dict(zip(mcc.par_names, new_point)))
-        #    print(mcc.FLI_swap.logdet,mcc.FLIs[j].logdet)
-        #    assert mcc.FLI_swap.logdet==mcc.FLIs[j].logdet
-        #else:
-        #    print(mcc.FLI_swap.logdet)
-        #    mcc.x0_swap.update_params(samples_current)
-        #    mcc.flm.recompute_FastLike(mcc.FLI_swap,mcc.x0_swap,dict(zip(mcc.par_names, samples_current)))
-        #    print(mcc.FLI_swap.logdet,mcc.FLIs[j].logdet)
-        #    assert mcc.FLI_swap.logdet==mcc.FLIs[j].logdet
+def get_rn_emp_dist_proposal(mcc,j,samples_current):
+    """propose new RN parameters for some of the pulsars drawn from their empirical distributions
 
-    if fail_point:
-        #something went wrong so do extra test of self consistency
-        mcc.validate_consistent(itrb+1)
+    :param mcc:                     MCMCChain object
+    :param j:                       Index of PT chain
+    :param samples_current:         Current point in parameter space
+
+    :return new_point:              Proposed point
+    :return log_proposal_ratio:     Log of the backwards/forwards proposal ratio
+    """
+    Npsr = mcc.Npsr
+    new_point = samples_current.copy()
+    log_proposal_ratio = 0.
+
+    #only update some of the pulsars, because we might want to update fewer pulsars when using empirical distributions
+    #to help acceptence despite the penalty factors
+    #scale number of dimensions by a factor related to the temperature if it goes to T>~50 to avoid under-aggressive jumps
+    n_noise_emp_dist_loc = max(min(Npsr,np.int64(mcc.chain_params.n_noise_emp_dist*(mcc.chain_params.Ts[j]/400.+1))),1)
+    idx_choose_psr = np.random.choice(Npsr,n_noise_emp_dist_loc,replace=False)
+
+    for psr_idx in idx_choose_psr:
+        rn_draw = mcc.rn_emp_dist[psr_idx].draw()
+        new_point[mcc.x0s[j].idx_rn_log10_As[psr_idx]] = rn_draw[0]
+        new_point[mcc.x0s[j].idx_rn_gammas[psr_idx]] = rn_draw[1]
+
+        log_proposal_ratio += mcc.rn_emp_dist[psr_idx].logprob(np.array([samples_current[mcc.x0s[j].idx_rn_log10_As[psr_idx]],
+                                                                         samples_current[mcc.x0s[j].idx_rn_gammas[psr_idx]]]))
+        log_proposal_ratio +=-mcc.rn_emp_dist[psr_idx].logprob(rn_draw)
+
+    new_point = correct_intrinsic(new_point,mcc.x0s[j],mcc.chain_params.freq_bounds,mcc.FPI.cut_par_ids,mcc.FPI.cut_lows,mcc.FPI.cut_highs)
+    return new_point,log_proposal_ratio
+
+@njit()
+def sync_FLI_buf(FLI,FLI_buf,buf_stale,recompute_mask):
+    """sync FLI_buf to the state of FLI, except for the noise blocks of the pulsars that are about to be recomputed in it
+
+    :param FLI:             Active FastLikeInfo object of the chain
+    :param FLI_buf:         Inactive FastLikeInfo buffer of the chain
+    :param buf_stale:       Row of FLI_buf_stale for the chain, updated in place
+    :param recompute_mask:  Boolean array with the pulsars whose noise blocks the proposal recomputes set to True
+    """
+    sync_FLI_buffer(FLI,FLI_buf,np.where(buf_stale & ~recompute_mask)[0])
+    #whether the proposal is accepted (and the buffers are swapped) or rejected,
+    #afterwards the two buffers differ in exactly the recomputed pulsars
+    buf_stale[:] = recompute_mask
+
+def get_synced_FLI_buf(mcc,j,recompute_mask):
+    """get the inactive FastLikeInfo buffer of chain j synced to the state of mcc.FLIs[j],
+    except for the noise blocks of the pulsars that are about to be recomputed in it
+
+    :param mcc:             MCMCChain object
+    :param j:               Index of PT chain
+    :param recompute_mask:  Boolean array with the pulsars whose noise blocks the proposal recomputes set to True
+
+    :return FLI_buf:        FastLikeInfo object to write the proposal into
+    """
+    sync_FLI_buf(mcc.FLIs[j],mcc.FLI_bufs[j],mcc.FLI_buf_stale[j],recompute_mask)
+    return mcc.FLI_bufs[j]
+
+@njit()
+def update_intrinsic_proposal(FLI,FLI_buf,buf_stale,x0,new_point,recompute_int,idx_psr_dist,use_rel_bin,RBIs,j):
+    """write a proposal that keeps the noise parameters into the inactive buffer of a chain
+
+    :param FLI:             Active FastLikeInfo object of the chain, stays at the current point
+    :param FLI_buf:         Inactive FastLikeInfo buffer of the chain
+    :param buf_stale:       Row of FLI_buf_stale for the chain
+    :param x0:              CWInfo object of the chain, left at new_point
+    :param new_point:       Proposed point
+    :param recompute_int:   If True, the common intrinsic parameters changed, otherwise only the distances in idx_psr_dist
+    :param idx_psr_dist:    Indices of the pulsars whose distances changed
+    :param use_rel_bin:     If True, update the filters with relative binning
+    :param RBIs:            List of RelBinInfo objects of each chain
+    :param j:               Index of PT chain
+    """
+    if use_rel_bin and not RBIs[j].has_ref:
+        #local fisher and small DE jumps can use relative binning against a reference near the current point,
+        #prior draws and big DE jumps go too far so they always use the exact filters
+        FLI.set_rel_bin_reference(x0,RBIs[j])
+    sync_FLI_buf(FLI,FLI_buf,buf_stale,np.zeros(x0.Npsr,dtype=np.bool_))
+    x0.update_params(new_point)
+    if not recompute_int:
+        FLI_buf.update_pulsar_distances(x0,idx_psr_dist)
+    elif use_rel_bin:
+        FLI_buf.update_intrinsic_params_rel_bin(x0,RBIs[j])
+    else:
+        FLI_buf.update_intrinsic_params(x0)
+    FLI_buf.validate_consistent(x0)
+
+@njit()
+def finish_intrinsic_step(j,itrb,success,new_point,samples_current,log_proposal_ratio,idx_acc,T,samples,log_likelihood,x0s,FLIs,FLI_bufs,fisher_diag,FPI,a_yes,a_no,
+                          n_try,mt_ess_stats,mt_like_counts):
+    """do the multiple try step for a proposal written into FLI_bufs[j] and accept or reject it, swapping FLIs[j] and FLI_bufs[j] if accepted
+
+    :param j:                   Index of PT chain
+    :param itrb:                Index within saved values of the current point, the result goes to itrb+1
+    :param success:             False if the proposal is rejected without trying (merged or not computable)
+    :param new_point:           Proposed new point (with new shape parameters)
+    :param samples_current:     Current point in parameter space
+    :param log_proposal_ratio:  Log of the proposal ratio needed to calculate acceptance probability
+    :param idx_acc:             Row of a_yes and a_no counting the jump type, the acceptance with the projection parameters is counted in the next row
+    :param T:                   Temperature of the chain
+    :param samples:             Array holding posterior samples
+    :param log_likelihood:      Array holding log likelihood values
+    :param x0s:                 List of CWInfo objects
+    :param FLIs:                List of FastLikeInfo objects
+    :param FLI_bufs:            List of inactive FastLikeInfo buffers of each chain
+    :param fisher_diag:         Diagonal fisher of the chain
+    :param FPI:                 FastPriorInfo object
+    :param a_yes:               Array to hold number of accepted steps
+    :param a_no:                Array to hold number of rejected steps
+    :param n_try:               Number of multiple tries of the chain
+    :param mt_ess_stats:        (n_chain, 2) array accumulating the effective sample size of the multiple try weights and the number of steps it was recorded for
+    :param mt_like_counts:      (n_chain, 2) array counting the multiple try likelihoods evaluated and skipped for zero prior density
+    """
+    x0 = x0s[j]
+    if success:
+        log_acc_ratio,chosen_trial,sample_choose,log_L_choose,mt_weights = do_mt_step(x0,FLIs[j],FLI_bufs[j],T,log_likelihood[j,itrb],fisher_diag,FPI,
+                                                                                      new_point,samples_current,log_proposal_ratio,n_try,mt_like_counts[j])
+        if chosen_trial>=0:
+            add_mt_ess(mt_ess_stats,j,mt_weights)
+    else:
+        #set these so that the step is rejected
+        log_acc_ratio = -np.inf
+        chosen_trial = -1
+        sample_choose = samples_current
+        log_L_choose = -np.inf
+
+    accept_intrinsic_step(j,itrb,log_acc_ratio,chosen_trial,sample_choose,log_L_choose,samples_current,idx_acc,samples,log_likelihood,x0s,FLIs,FLI_bufs,a_yes,a_no)
+
+@njit()
+def accept_intrinsic_step(j,itrb,log_acc_ratio,chosen_trial,sample_choose,log_L_choose,samples_current,idx_acc,samples,log_likelihood,x0s,FLIs,FLI_bufs,a_yes,a_no):
+    """accept or reject the multiple try step of chain j, swapping FLIs[j] and FLI_bufs[j] if accepted
+
+    :param j:                   Index of PT chain
+    :param itrb:                Index within saved values of the current point, the result goes to itrb+1
+    :param log_acc_ratio:       Log of acceptance probability, -np.inf to always reject
+    :param chosen_trial:        Index of chosen trial
+    :param sample_choose:       Parameters of the chosen trial
+    :param log_L_choose:        Log likelihood of the chosen trial
+    :param samples_current:     Current point in parameter space
+    :param idx_acc:             Row of a_yes and a_no counting the jump type, the acceptance with the projection parameters is counted in the next row
+    :param samples:             Array holding posterior samples
+    :param log_likelihood:      Array holding log likelihood values
+    :param x0s:                 List of CWInfo objects
+    :param FLIs:                List of FastLikeInfo objects
+    :param FLI_bufs:            List of inactive FastLikeInfo buffers of each chain
+    :param a_yes:               Array to hold number of accepted steps
+    :param a_no:                Array to hold number of rejected steps
+    """
+    x0 = x0s[j]
+    if np.isfinite(log_acc_ratio):
+        log_acc_decide = np.log(uniform(1.e-304, 1.0))
+    else:
+        log_acc_decide = 1.
+
+    if log_acc_decide<=log_acc_ratio:
+        #accepted
+        x0.update_params(sample_choose)
+        samples[j,itrb+1,:] = sample_choose
+        log_likelihood[j,itrb+1] = log_L_choose
+
+        #the buffer holding the proposal becomes the active FLI and the old one the buffer
+        FLI_temp = FLIs[j]
+        FLIs[j] = FLI_bufs[j]
+        FLI_bufs[j] = FLI_temp
+
+        if chosen_trial==0:
+            a_yes[idx_acc,j] += 1
+        else:
+            a_no[idx_acc,j] += 1
+        a_yes[idx_acc+1,j] += 1
+    else:
+        #rejected
+        samples[j,itrb+1,:] = samples_current
+        log_likelihood[j,itrb+1] = log_likelihood[j,itrb]
+
+        #Add to both elements of a_no, so we can get acceptance over total jumps w/ and w/o projection perturbation
+        if chosen_trial==0 and np.isfinite(log_acc_ratio):
+            a_yes[idx_acc,j] += 1
+        else:
+            a_no[idx_acc,j] += 1
+        a_no[idx_acc+1,j] += 1
 
-    return mcc.FLI_swap
+        #FLIs[j] was never modified, so only the parameters need to be reverted
+        x0.update_params(samples_current)
 
+    FLIs[j].validate_consistent(x0)
+    x0.validate_consistent(samples[j,itrb+1,:])
 
-def do_mt_step(mcc,j,itrb,new_point,samples_current,FLI_mem_save,recompute_rn,log_proposal_ratio):
+@njit()
+def do_mt_step(x0,FLI,FLI_buf,T,log_L_old,fisher_diag,FPI,new_point,samples_current,log_proposal_ratio,n_try,like_counts):
     """compute the multiple tries and chose a sample
 
-    :param mcc:                     MCMCChain onject
-    :param j:                       Index of PT chain
-    :param itrb:                    Index within saved values (as opposed to block index itri or overall index itrn)
+    :param x0:                      CWInfo object of the chain
+    :param FLI:                     FastLikeInfo object at the current shape parameters
+    :param FLI_buf:                 FastLikeInfo object at the new shape parameters
+    :param T:                       Temperature of the chain
+    :param log_L_old:               Log likelihood at the current point
+    :param fisher_diag:             Diagonal fisher of the chain
+    :param FPI:                     FastPriorInfo object
     :param new_point:               Proposed new point (with new shape parameters)
     :param samples_current:         Current point in parameter space
-    :param FLI_mem_save:            Parts of FLI object saved to memory
-    :param recompute_rn:            If True, recompute everything needed to go to new RN parameters
     :param log_proposal_ratio:      Log of the proposal ratio needed to calculate acceptance probability
+    :param n_try:                   Number of multiple tries
+    :param like_counts:             Row of mt_like_counts for the chain, updated in place
 
     :return log_acc_ratio:          Log of acceptance probability
     :return chosen_trial:           Index of chosen trial
     :return sample_choose:          Parameters of the chosen trial
     :return log_Ls[chosen_trial]:   Log likelihood of the chosen trial
+    :return mt_weights:             Multiple try weights of the tries
     """
-    Ts = mcc.chain_params.Ts
+    log_posterior_old = get_log_posterior_old(samples_current,log_L_old,T,FPI)
+    tries,log_prior_news,jumps,fisher_mask,random_draws_from_prior = get_mt_tries(x0,T,fisher_diag,FPI,new_point,n_try)
+
+    mt_weights, log_Ls, log_mt_norm_shift, n_skip = get_mt_weights(x0, FLI_buf, T,log_posterior_old,tries,log_prior_news)
+    like_counts[0] += n_try-n_skip
+    like_counts[1] += n_skip
 
-    log_prior_old = CWFastPrior.get_lnprior(samples_current, mcc.FPI)
-    log_posterior_old = mcc.log_likelihood[j,itrb]/Ts[j] + log_prior_old
+    #not sure why but still can get nans here...
+    assert np.all(np.isfinite(mt_weights))
+
+    if np.sum(mt_weights)==0.0:
+        log_acc_ratio = -np.inf
+        chosen_trial = -1
+        sample_choose = new_point.copy()
+    else:
+        chosen_trial = choose_weighted(mt_weights)
+
+        #FLI is still at the current shape parameters needed for the reference points
+        ref_tries,log_prior_refs = get_mt_ref_tries(x0,FPI,samples_current,tries[chosen_trial],jumps,fisher_mask,random_draws_from_prior)
+
+        ref_mt_weights,log_ref_mt_norm_shift,n_skip = get_ref_mt_weights(x0, FLI, T,log_posterior_old,chosen_trial,ref_tries,log_prior_refs)
+        like_counts[0] += n_try-n_skip
+        like_counts[1] += n_skip
+
+        #must undo the normalization shifts; they aren't needed in log space anyway
+        log_acc_ratio = np.log(np.sum(mt_weights))-np.log(np.sum(ref_mt_weights))+log_mt_norm_shift-log_ref_mt_norm_shift+log_proposal_ratio
+
+        sample_choose = tries[chosen_trial].copy()
+    return log_acc_ratio,chosen_trial,sample_choose,log_Ls[chosen_trial],mt_weights
+
+@njit()
+def add_mt_ess(mt_ess_stats,j,mt_weights):
+    """record the effective sample size (sum of weights)^2/(sum of squared weights) of the multiple try weights of a step of chain j
+
+    :param mt_ess_stats:    (n_chain, 2) array accumulating the effective sample size and the number of steps it was recorded for
+    :param j:               Index of PT chain
+    :param mt_weights:      Multiple try weights, not all zero
+    """
+    mt_ess_stats[j,0] += np.sum(mt_weights)**2/np.sum(mt_weights**2)
+    mt_ess_stats[j,1] += 1.
+
+@njit()
+def get_log_posterior_old(samples_current,log_L_old,T,FPI):
+    """get the tempered log posterior at the current point the multiple try weights are relative to
+
+    :param samples_current:     Current point in parameter space
+    :param log_L_old:           Log likelihood at the current point
+    :param T:                   Temperature of the chain
+    :param FPI:                 FastPriorInfo object
+
+    :return log_posterior_old:  Tempered log posterior at the current point
+    """
+    log_posterior_old = log_L_old/T + CWFastPrior.get_lnprior(samples_current, FPI)
     assert np.isfinite(log_posterior_old)
+    return log_posterior_old
 
+@njit()
+def get_mt_tries(x0,T,fisher_diag,FPI,new_point,n_try):
+    """draw the multiple tries in the projection parameters around a proposed point
+
+    :param x0:                      CWInfo object (only used for the parameter indices)
+    :param T:                       Temperature of the chain
+    :param fisher_diag:             Diagonal fisher of the chain
+    :param FPI:                     FastPriorInfo object
+    :param new_point:               Proposed new point (with new shape parameters), kept as the 0th try
+    :param n_try:                   Number of multiple tries
+
+    :return tries:                  2D array holding samples at multiple trials
+    :return log_prior_news:         Log prior values at the tries
+    :return jumps:                  Fisher jumps used, needed for the reference tries
+    :return fisher_mask:            Projection parameters jumped in with fisher jumps instead of prior draws
+    :return random_draws_from_prior: Prior draws used, needed for the reference tries
+    """
     #do multiple try MCMC step with random draws of projection parameters
     #more parameters will be uniform at higher temperatures
-    fisher_mask = np.sqrt(Ts[j])*mcc.fisher_diag[j][mcc.x0s[0].idx_cw_ext]<0.5
+    fisher_ext = fisher_diag[x0.idx_cw_ext]
+    fisher_mask = np.sqrt(T)*fisher_ext<0.5
     #don't propose fisher jumps at all above some specified temperature
     fisher_norm = 1.
-    if Ts[j]>cm.proj_prior_all_temp:
+    if T>cm.proj_prior_all_temp:
         fisher_mask[:] = False
     elif fisher_mask.sum()>0:
         fisher_norm = 2.38/np.sqrt(fisher_mask.sum())
 
-    random_normals = np.random.normal(0.,fisher_norm,(cm.n_multi_try,fisher_mask.sum()))
-    jumps = random_normals*np.sqrt(Ts[j])*mcc.fisher_diag[j][mcc.x0s[0].idx_cw_ext][fisher_mask]
-    random_draws_from_prior = np.random.uniform(mcc.FPI.cw_ext_lows[~fisher_mask],mcc.FPI.cw_ext_highs[~fisher_mask],(cm.n_multi_try,(~fisher_mask).sum()))
-
-    #itrd = 0
-    #for ii,ll in enumerate(mcc.x0s[j].idx_cw_ext):
-    #    fisher_loc = mcc.fisher_diag[j][ll]
-    #    if fisher_loc<0.5: #not maxed out fisher --> do fisher update
-    #        jumps_old[:,ii] = jumps[:,itrj]#np.random.normal(0.,fisher_loc,cm.n_multi_try)
-    #        random_normals_old[:,ii] = random_normals[:,itrj]#jumps[:,itrj]/mcc.fisher_diag[j][mcc.x0s[0].idx_cw_ext][fisher_mask][itrj]
-    #        itrj += 1
-    #    else:
-    #        random_draws_from_prior_old[:,ii] = random_draws_from_prior[:,itrd]#np.random.uniform(FPI.cw_ext_lows[ii],FPI.cw_ext_highs[ii],cm.n_multi_try)
-    #        itrd += 1
+    jumps = np.random.normal(0.,fisher_norm,(n_try,fisher_mask.sum()))*np.sqrt(T)*fisher_ext[fisher_mask]
+    ext_lows = FPI.cw_ext_lows[~fisher_mask]
+    ext_highs = FPI.cw_ext_highs[~fisher_mask]
+    random_draws_from_prior = np.zeros((n_try,ext_lows.size))
+    for itrk in range(n_try):
+        for itrp in range(ext_lows.size):
+            random_draws_from_prior[itrk,itrp] = uniform(ext_lows[itrp],ext_highs[itrp])
 
     #make sure the jumps are null for the initial sample
     jumps[0,:] = 0.
-    random_draws_from_prior[0,:] = new_point[mcc.x0_swap.idx_cw_ext][~fisher_mask]
+    random_draws_from_prior[0,:] = new_point[x0.idx_cw_ext][~fisher_mask]
 
-    tries = set_params(new_point,jumps,fisher_mask,random_draws_from_prior,mcc.x0_swap)
+    tries = set_params(new_point,jumps,fisher_mask,random_draws_from_prior,x0)
     tries[0] = new_point  # just to make sure it didn't get reset
-    log_prior_news = CWFastPrior.get_lnprior_array(tries, mcc.FPI)
-
-    if recompute_rn:
-        FLI_use = mcc.FLI_swap
-    else:
-        FLI_use = mcc.FLIs[j]
-    mt_weights, log_Ls, log_mt_norm_shift = get_mt_weights(mcc.x0_extras, FLI_use, Ts[j],log_posterior_old,tries,log_prior_news)
-    #if j==0: print(mt_weights)
-
-    #not sure why but still can get nans here...
-    assert np.all(np.isfinite(mt_weights))
+    log_prior_news = CWFastPrior.get_lnprior_array(tries, FPI)
+    return tries,log_prior_news,jumps,fisher_mask,random_draws_from_prior
 
-    if np.sum(mt_weights)==0.0:
-        log_acc_ratio = -np.inf
-        chosen_trial = -1
-        sample_choose = new_point.copy()
-    else:
-        chosen_trial = np.random.choice(cm.n_multi_try, p=mt_weights/np.sum(mt_weights))
-
-        if not recompute_rn:  # need to set back FLIs to old state to calculate likelihoods at reference points
-            safe_reset_swap(mcc.FLIs[j],mcc.x0s[j],samples_current,FLI_mem_save)
-        else:
-            mcc.x0s[j].update_params(samples_current)
-
-        mcc.FLIs[j].validate_consistent(mcc.x0s[j])
-        mcc.x0s[j].validate_consistent(samples_current)
-
-        sample_ref = samples_current.copy()
-        sample_ref[mcc.x0s[j].idx_cw_ext] = tries[chosen_trial,mcc.x0s[j].idx_cw_ext]
-
-        ref_tries = set_params(sample_ref,jumps,fisher_mask,random_draws_from_prior,mcc.x0_swap)
-        ref_tries[0] = sample_ref  # fix if it got reset
+@njit()
+def get_mt_ref_tries(x0,FPI,samples_current,chosen_try,jumps,fisher_mask,random_draws_from_prior):
+    """get the reference tries around the current shape parameters with the projection parameters of the chosen try,
+    reusing the jumps and prior draws of the tries
 
-        log_prior_refs = CWFastPrior.get_lnprior_array(ref_tries, mcc.FPI)
+    :param x0:                      CWInfo object (only used for the parameter indices)
+    :param FPI:                     FastPriorInfo object
+    :param samples_current:         Current point in parameter space
+    :param chosen_try:              Parameters of the chosen trial
+    :param jumps:                   Fisher jumps from get_mt_tries
+    :param fisher_mask:             Fisher mask from get_mt_tries
+    :param random_draws_from_prior: Prior draws from get_mt_tries
 
-        ref_mt_weights,log_ref_mt_norm_shift = get_ref_mt_weights(mcc.x0_extras, mcc.FLIs[j], Ts[j],log_posterior_old,chosen_trial,ref_tries,log_prior_refs)
+    :return ref_tries:              2D array holding samples at multiple reference trials
+    :return log_prior_refs:         Log prior values at the reference tries
+    """
+    sample_ref = samples_current.copy()
+    sample_ref[x0.idx_cw_ext] = chosen_try[x0.idx_cw_ext]
 
-        #must undo the normalization shifts; they aren't needed in log space anyway
-        log_acc_ratio = np.log(np.sum(mt_weights))-np.log(np.sum(ref_mt_weights))+log_mt_norm_shift-log_ref_mt_norm_shift+log_proposal_ratio
+    ref_tries = set_params(sample_ref,jumps,fisher_mask,random_draws_from_prior,x0)
+    ref_tries[0] = sample_ref  # fix if it got reset
 
-        sample_choose = tries[chosen_trial].copy()
-#        if chosen_trial==0:
-#            print("selected trial was null?")
-#            print(sample_ref)
-#            print(sample_choose)
-#            print(samples_current)
-#            print(tries[1])
-#            print(new_point)
-#            print(log_ref_mt_norm_shift,log_mt_norm_shift)
-#            print(ref_mt_weights)
-#            print(mt_weights)
-#            print(log_Ls)
-#            print(log_prior_refs)
-    return log_acc_ratio,chosen_trial,sample_choose,log_Ls[chosen_trial]
+    log_prior_refs = CWFastPrior.get_lnprior_array(ref_tries, FPI)
+    return ref_tries,log_prior_refs
 
-@njit(parallel=True)
-def get_mt_weights(x0_extras, FLI_use, Ts, log_posterior_old,tries,log_prior_news):
+@njit()
+def get_mt_weights(x0, FLI_use, Ts, log_posterior_old,tries,log_prior_news):
     """Helper function to quickly return multiple tries and their likelihoods fo MTMCMC
 
-    :param x0_extras:           List of extra CWInfo objects for parallelizing multiple try
+    :param x0:                  CWInfo object (only used for the parameter indices)
     :param FLI_use:             FastLikeInfo object
     :param Ts:                  List of PT temperatures
     :param log_posterior_old:   Log posterior at old parameters
@@ -642,28 +831,36 @@ def get_mt_weights(x0_extras, FLI_use, Ts, log_posterior_old,tries,log_prior_new
     :return mt_weights:         Multiple try weights
     :return log_Ls:             Log likelihoods
     :return log_mt_norm_shift:  Amount to shift the multiple try weights (helps with using floating point precision efficiently)
+    :return n_skip:             Number of tries with zero prior density whose likelihood was not evaluated
+    """
+    log_Ls, n_skip = get_batch_lnlikelihoods(x0, FLI_use, tries, log_prior_news)
+    mt_weights, log_mt_norm_shift = get_mt_weights_from_lnlikelihoods(log_Ls, Ts, log_posterior_old, log_prior_news)
+    return mt_weights, log_Ls, log_mt_norm_shift, n_skip
+
+@njit(parallel=True)
+def get_mt_weights_from_lnlikelihoods(log_Ls, Ts, log_posterior_old, log_prior_news):
+    """get the multiple try weights from the likelihoods of the tries
+
+    :param log_Ls:              Log likelihoods at the tries
+    :param Ts:                  Temperature of the chain
+    :param log_posterior_old:   Log posterior at old parameters
+    :param log_prior_news:      Log prior values at propose new points
+
+    :return mt_weights:         Multiple try weights
+    :return log_mt_norm_shift:  Amount to shift the multiple try weights (helps with using floating point precision efficiently)
     """
     #NOTE isfinite does not work with fastmath enabled
     #set up needed arrays
-    log_mt_weights = np.zeros(cm.n_multi_try)
-    log_Ls = np.zeros(cm.n_multi_try)
+    log_mt_weights = np.zeros(log_Ls.size)
 
     #get mt_weights --------------------------------------------------------------------------------------------------------
-    for KK in prange(cm.n_x0_extra):
-        for kk in range(cm.n_block_try):
-            itrkk = KK*cm.n_block_try+kk
-
-            x0_extras[KK].update_params(tries[itrkk,:])
-            #print(x0_extras[KK].cos_gwtheta)
-
-            log_L = FLI_use.get_lnlikelihood(x0_extras[KK])
-            log_posterior_new = log_L/Ts + log_prior_news[itrkk]
+    for itrkk in prange(log_Ls.size):
+        log_posterior_new = log_Ls[itrkk]/Ts + log_prior_news[itrkk]
 
-            if np.isfinite(log_posterior_new):
-                log_mt_weights[itrkk] = log_posterior_new - log_posterior_old
-            else:
-                log_mt_weights[itrkk] = -np.inf
-            log_Ls[itrkk] = log_L
+        if np.isfinite(log_posterior_new):
+            log_mt_weights[itrkk] = log_posterior_new - log_posterior_old
+        else:
+            log_mt_weights[itrkk] = -np.inf
 
     #can apply the same multiplier to shift all the weights, prevents over/underflows in the exponential from breaking the code
     log_mt_norm_shift = np.max(log_mt_weights)
@@ -673,7 +870,85 @@ def get_mt_weights(x0_extras, FLI_use, Ts, log_posterior_old,tries,log_prior_new
     #get weights while preventing underflow (values which are <1.e-304 times as likely to be chosen as the most likely value are totally irrelevant)
     mt_weights[log_mt_weights>-700] = np.exp(log_mt_weights[log_mt_weights>-700])
 
-    return mt_weights, log_Ls, log_mt_norm_shift
+    return mt_weights, log_mt_norm_shift
+
+@njit()
+def get_batch_lnlikelihoods(x0, FLI_use, tries, log_priors):
+    """Helper function to get the likelihoods of multiple tries which only differ in the projection parameters with a single batch call,
+    tries with zero prior density get zero weight anyway, so they are left out of the batch so the threads only split the tries that count
+
+    :param x0:                  CWInfo object (only used for the parameter indices)
+    :param FLI_use:             FastLikeInfo object
+    :param tries:               Parameters at a set of multiple tries for which we want to calculate the likelihoods
+    :param log_priors:          Log prior values at the tries
+
+    :return log_Ls:             Log likelihoods, -np.inf for the skipped tries
+    :return n_skip:             Number of tries skipped
+    """
+    #the batch likelihood uses the shape parameters stored in FLI_use, so make sure the tries agree with them
+    assert FLI_use.cos_gwtheta==tries[0,x0.idx_cos_gwtheta]
+    assert FLI_use.gwphi==tries[0,x0.idx_gwphi]
+    assert FLI_use.log10_fgw==tries[0,x0.idx_log10_fgw]
+    assert FLI_use.log10_mc==tries[0,x0.idx_log10_mc]
+
+    idx_live = np.where(log_priors>-np.inf)[0]
+    if idx_live.size==tries.shape[0]:
+        live_tries = tries
+    else:
+        live_tries = tries[idx_live]
+
+    log_Ls = np.full(tries.shape[0],-np.inf)
+    log_Ls[idx_live] = FLI_use.get_lnlikelihood_batch(live_tries[:,x0.idx_cos_inc],live_tries[:,x0.idx_log10_h],live_tries[:,x0.idx_phase0],live_tries[:,x0.idx_psi],live_tries[:,x0.idx_phases])
+    return log_Ls, tries.shape[0]-idx_live.size
+
+@njit(parallel=True)
+def get_batch_lnlikelihoods_chains(x0, FLIs_use, tries, log_priors, n_tries, mt_like_counts):
+    """get the likelihoods of the multiple tries of several chains in one parallel loop over every (chain, try) pair with non-zero prior density,
+    so the threads are split between chains in proportion to their number of tries that count however many chains there are
+
+    :param x0:                  CWInfo object (only used for the parameter indices)
+    :param FLIs_use:            List of FastLikeInfo objects of each chain at the shape parameters of its tries
+    :param tries:               (n_chain, n_try_max, n_par) array of the tries of each chain
+    :param log_priors:          (n_chain, n_try_max) array of log prior values at the tries
+    :param n_tries:             Number of tries of each chain to get the likelihoods for, 0 to skip the chain
+    :param mt_like_counts:      (n_chain, 2) array counting the likelihoods evaluated and skipped for zero prior density
+
+    :return log_Ls:             (n_chain, n_try_max) array of log likelihoods, -np.inf for skipped tries and past the tries of each chain
+    """
+    n_chain = tries.shape[0]
+    idx_chains = np.where(n_tries>0)[0]
+    #compact the (chain, try) pairs with non-zero prior density into a flat list of work
+    work_chains = np.zeros(np.sum(n_tries),dtype=np.int64)
+    work_tries = np.zeros(np.sum(n_tries),dtype=np.int64)
+    n_work = 0
+    for j in idx_chains:
+        n_live = 0
+        for itrk in range(n_tries[j]):
+            if log_priors[j,itrk]>-np.inf:
+                work_chains[n_work] = j
+                work_tries[n_work] = itrk
+                n_work += 1
+                n_live += 1
+        mt_like_counts[j,0] += n_live
+        mt_like_counts[j,1] += n_tries[j]-n_live
+
+    for j in idx_chains:
+        FLI_use = FLIs_use[j]
+        assert FLI_use.cos_gwtheta==tries[j,0,x0.idx_cos_gwtheta]
+        assert FLI_use.gwphi==tries[j,0,x0.idx_gwphi]
+        assert FLI_use.log10_fgw==tries[j,0,x0.idx_log10_fgw]
+        assert FLI_use.log10_mc==tries[j,0,x0.idx_log10_mc]
+
+    cw_p_phases = tries[:,:,x0.idx_phases]
+    log_Ls = np.full((n_chain,tries.shape[1]),-np.inf)
+    for itrw in prange(n_work):
+        j = work_chains[itrw]
+        itrk = work_tries[itrw]
+        FLI_use = FLIs_use[j]
+        log_Ls[j,itrk] = get_lnlikelihood_proj_helper(FLI_use.log10_fgw,tries[j,itrk,x0.idx_cos_inc],tries[j,itrk,x0.idx_log10_h],tries[j,itrk,x0.idx_phase0],tries[j,itrk,x0.idx_psi],
+                                                      cw_p_phases[j,itrk],FLI_use.resres,FLI_use.logdet,FLI_use.F_ps,FLI_use.F_cs,FLI_use.amp_psr_facs,FLI_use.NN,FLI_use.MMs,
+                                                      includeCW=FLI_use.includeCW,prior_recovery=FLI_use.prior_recovery)
+    return log_Ls
 
 @njit()
 def add_rn_eig_jump(scale_eig0,scale_eig1,new_point,rn_base,idx_rn,Npsr,all_eigs=False):
@@ -716,7 +991,7 @@ def set_params(sample_set,jumps,fisher_mask,random_draws_from_prior,x0):
 
     :return ref_tries:              2D array holding samples at multiple trials
     """
-    ref_tries = np.zeros((cm.n_multi_try, sample_set.size))
+    ref_tries = np.zeros((jumps.shape[0], sample_set.size))
     #jumps and random_draws_from_prior should give a null jump for the 0th value
 
     #copy in intrinsic parameters
@@ -735,11 +1010,11 @@ def set_params(sample_set,jumps,fisher_mask,random_draws_from_prior,x0):
 
 
 
-@njit(parallel=True)
-def get_ref_mt_weights(x0_extras, FLI_use, Ts, log_posterior_old, chosen_trial,ref_tries,log_prior_refs):
+@njit()
+def get_ref_mt_weights(x0, FLI_use, Ts, log_posterior_old, chosen_trial,ref_tries,log_prior_refs):
     """Helper function to quickly return multiple tries and their likelihoods fo MTMCMC
 
-    :param x0_extras:           List of extra CWInfo objects for parallelizing multiple try
+    :param x0:                  CWInfo object (only used for the parameter indices)
     :param FLI_use:             FastLikeInfo object
     :param Ts:                  List of PT temperatures
     :param log_posterior_old:   Log posterior at old parameters
@@ -749,27 +1024,38 @@ def get_ref_mt_weights(x0_extras, FLI_use, Ts, log_posterior_old, chosen_trial,r
 
     :return ref_mt_weights:     Reference point multiply try weights
     :return log_ref_mt_norm_shift: Amount to shift the reference point multiple try weights (helps with using floating point precision efficiently)
+    :return n_skip:             Number of reference tries with zero prior density whose likelihood was not evaluated
     """
-    #NOTE isfinite does not work with fastmath enabled
-    #set up needed arrays
-    log_ref_mt_weights = np.zeros(cm.n_multi_try)
+    log_Ls, n_skip = get_batch_lnlikelihoods(x0, FLI_use, ref_tries, log_prior_refs)
+    ref_mt_weights,log_ref_mt_norm_shift = get_ref_mt_weights_from_lnlikelihoods(log_Ls, Ts, log_posterior_old, chosen_trial, log_prior_refs)
+    return ref_mt_weights,log_ref_mt_norm_shift,n_skip
 
+@njit(parallel=True)
+def get_ref_mt_weights_from_lnlikelihoods(log_Ls, Ts, log_posterior_old, chosen_trial, log_prior_refs):
+    """get the reference point multiple try weights from the likelihoods of the reference tries
 
-    ##get ref_mt_weights ----------------------------------------------------------------------------------------------------
-    for KK in prange(cm.n_x0_extra):
-        for kk in range(cm.n_block_try):
-            itrkk = KK*cm.n_block_try+kk
+    :param log_Ls:              Log likelihoods at the reference tries
+    :param Ts:                  Temperature of the chain
+    :param log_posterior_old:   Log posterior at old parameters
+    :param chosen_trial:        Index of chosen trial
+    :param log_prior_refs:      Log prior values at reference points
 
-            x0_extras[KK].update_params(ref_tries[itrkk,:])
+    :return ref_mt_weights:     Reference point multiply try weights
+    :return log_ref_mt_norm_shift: Amount to shift the reference point multiple try weights (helps with using floating point precision efficiently)
+    """
+    #NOTE isfinite does not work with fastmath enabled
+    #set up needed arrays
+    log_ref_mt_weights = np.zeros(log_Ls.size)
 
-            log_L = FLI_use.get_lnlikelihood(x0_extras[KK])
 
-            log_posterior_ref = log_L/Ts + log_prior_refs[itrkk]
+    ##get ref_mt_weights ----------------------------------------------------------------------------------------------------
+    for itrkk in prange(log_Ls.size):
+        log_posterior_ref = log_Ls[itrkk]/Ts + log_prior_refs[itrkk]
 
-            if np.isfinite(log_posterior_ref):
-                log_ref_mt_weights[itrkk] = log_posterior_ref - log_posterior_old
-            else:
-                log_ref_mt_weights[itrkk] = -np.inf
+        if np.isfinite(log_posterior_ref):
+            log_ref_mt_weights[itrkk] = log_posterior_ref - log_posterior_old
+        else:
+            log_ref_mt_weights[itrkk] = -np.inf
 
     #can apply the same multiplier to shift all the weights, prevents over/underflows in the exponential from breaking the code
     log_ref_mt_weights[chosen_trial] = 0.  # np.log(1)=0. is the value it should be at the chosen trial pre-shift
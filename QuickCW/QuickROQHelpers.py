@@ -0,0 +1,250 @@
+"""C 2021 Bence Becsy
+MCMC for CW fast likelihood (w/ Neil Cornish and Matthew Digman)
+Offline builder for reduced order quadratures of the filter inner products"""
+import numpy as np
+from numba import njit,prange
+from numba.typed import List
+
+import QuickCW.const_mcmc as cm
+import enterprise.constants as const
+from QuickCW.CWFastLikelihoodNumba import ROQInfo,get_filter_phases,get_term_series_order
+from QuickCW.QuickCorrectionUtils import check_merged
+
+@njit(parallel=True)
+def get_training_filters(toas_loc,log10_fgws,log10_mcs,Ls):
+    """get the complex earth and pulsar term filters omega**(-1/3)*exp(2i*phase) (not yet multiplied by the inverse squareroot N vector) at a set of shape parameters
+
+    :param toas_loc:        TOAs relative to cm.tref
+    :param log10_fgws:      Array of log10 GW frequencies
+    :param log10_mcs:       Array of log10 chirp masses
+    :param Ls:              Array of p_dist*(1-cosMu) in seconds
+
+    :return filters:        (2, number of draws, number of TOAs) array holding the earth and pulsar term filters
+    """
+    n_draw = log10_fgws.size
+    n1 = toas_loc.size
+    t_max = np.max(np.abs(toas_loc))
+    filters = np.zeros((2,n_draw,n1),dtype=np.complex128)
+    for itrd in prange(n_draw):
+        w0 = np.pi * 10.0**log10_fgws[itrd]
+        mc = 10.0**log10_mcs[itrd] * const.Tsun
+        x_scale = 256./5. * mc**(5/3) * w0**(8/3)
+        omega_p013 = np.sqrt(np.sqrt(np.sqrt((1. + x_scale * Ls[itrd]))))
+        n_term = get_term_series_order(x_scale*t_max,omega_p013)
+        for itrk in range(n1):
+            #only p_dist*(1-cosMu) enters the filters, so pass it as the distance with cosMu=0
+            omega13,phase,omega_p13,phase_p = get_filter_phases(toas_loc[itrk],w0,mc,x_scale,omega_p013,Ls[itrd],0.,n_term)
+            filters[0,itrd,itrk] = omega13*(np.cos(2*phase)+1j*np.sin(2*phase))
+            filters[1,itrd,itrk] = omega_p13*(np.cos(2*phase_p)+1j*np.sin(2*phase_p))
+    return filters
+
+def draw_training_params(rng,n_draw,log10_fgw_bounds,log10_mc_bounds,L_max,max_toa):
+    """draw shape parameters uniformly in log10_fgw, log10_mc and p_dist*(1-cosMu), skipping sources which have merged before max_toa
+
+    :param rng:                 numpy random Generator
+    :param n_draw:              Number of draws
+    :param log10_fgw_bounds:    Range of log10 GW frequencies
+    :param log10_mc_bounds:     Range of log10 chirp masses
+    :param L_max:               Largest p_dist*(1-cosMu) in seconds
+    :param max_toa:             Latest TOA of the pulsar
+
+    :return log10_fgws:         Array of log10 GW frequencies
+    :return log10_mcs:          Array of log10 chirp masses
+    :return Ls:                 Array of p_dist*(1-cosMu) in seconds
+    """
+    log10_fgws = np.zeros(n_draw)
+    log10_mcs = np.zeros(n_draw)
+    itrd = 0
+    while itrd<n_draw:
+        log10_fgw = rng.uniform(log10_fgw_bounds[0],log10_fgw_bounds[1])
+        log10_mc = rng.uniform(log10_mc_bounds[0],log10_mc_bounds[1])
+        if not check_merged(log10_fgw,log10_mc,max_toa):
+            log10_fgws[itrd] = log10_fgw
+            log10_mcs[itrd] = log10_mc
+            itrd += 1
+    Ls = rng.uniform(0.,L_max,n_draw)
+    return log10_fgws,log10_mcs,Ls
+
+def get_training_products(filters):
+    """get the products of two filters appearing in the inner products: e*e, e*conj(e), p*p, p*conj(p), e*p, e*conj(p)
+
+    :param filters:         Output of get_training_filters
+
+    :return products:       (number of TOAs, 6*number of draws) array with the products as columns
+    """
+    e = filters[0]
+    p = filters[1]
+    return np.vstack((e*e,e*np.conj(e),p*p,p*np.conj(p),e*p,e*np.conj(p))).T
+
+def add_to_reduced_basis(basis,X,tol):
+    """greedily extend an orthonormal basis until every column of X is represented to a relative accuracy of tol
+
+    :param basis:           (number of TOAs, number of basis vectors) array with orthonormal columns
+    :param X:               (number of TOAs, number of training vectors) array of training vectors
+    :param tol:             Largest allowed relative norm of the part of a training vector outside the basis
+
+    :return basis:          Extended basis
+    """
+    norms = np.linalg.norm(X,axis=0)
+    norms[norms==0.] = 1.
+    X = X.copy()
+    #project out twice for numerical stability
+    for itr in range(2):
+        X -= basis@(basis.conj().T@X)
+    res = np.linalg.norm(X,axis=0)/norms
+
+    new_vecs = []
+    while np.max(res)>tol:
+        itrm = np.argmax(res)
+        vec = X[:,itrm]/np.linalg.norm(X[:,itrm])
+        #reorthogonalize against everything so far
+        vec -= basis@(basis.conj().T@vec)
+        for vec_old in new_vecs:
+            vec -= vec_old*np.vdot(vec_old,vec)
+        vec /= np.linalg.norm(vec)
+        new_vecs.append(vec)
+        X -= np.outer(vec,vec.conj()@X)
+        res = np.linalg.norm(X,axis=0)/norms
+
+    if len(new_vecs)==0:
+        return basis
+    return np.hstack((basis,np.array(new_vecs).T))
+
+def get_eim_interpolant(basis):
+    """choose empirical interpolation nodes for a reduced basis and get the matrix which interpolates any vector in the basis from its values at the nodes
+
+    :param basis:           (number of TOAs, number of basis vectors) array
+
+    :return nodes:          Indices of the nodes
+    :return interpolant:    (number of TOAs, number of nodes) array B such that v=B@v[nodes] for v in the span of the basis
+    """
+    n_basis = basis.shape[1]
+    nodes = np.zeros(n_basis,dtype=np.int64)
+    nodes[0] = np.argmax(np.abs(basis[:,0]))
+    for itrm in range(1,n_basis):
+        coeffs = np.linalg.solve(basis[nodes[:itrm],:itrm],basis[nodes[:itrm],itrm])
+        res = basis[:,itrm]-basis[:,:itrm]@coeffs
+        nodes[itrm] = np.argmax(np.abs(res))
+    interpolant = np.linalg.solve(basis[nodes].T,basis.T).T
+    return nodes,interpolant
+
+def build_roq(flm,log10_fgw_bounds,log10_mc_bounds,n_train=400,n_chunk=50,tol=1.e-9,dist_sigma_max=5.,n_validate=50,seed=None,verbosity=1):
+    """build reduced order quadratures for the filter inner products of every pulsar over a range of shape parameters.
+    This only has to be done once per data set and noise model, save the result with save_roq and load it with load_roq
+
+    :param flm:                 FastLikeMaster object
+    :param log10_fgw_bounds:    Range of log10 GW frequencies to cover (should contain the prior range)
+    :param log10_mc_bounds:     Range of log10 chirp masses to cover (should contain the prior range)
+    :param n_train:             Number of training draws per pulsar [400]
+    :param n_chunk:             Number of training draws to generate at once [50]
+    :param tol:                 Relative accuracy of the reduced bases on the training set [1.e-9]
+    :param dist_sigma_max:      Pulsar distances up to this many sigma from the mean are covered [5.]
+    :param n_validate:          Number of random draws to measure the interpolation error at [50]
+    :param seed:                Seed for the training draws [None]
+    :param verbosity:           Print the number of nodes and interpolation error of each pulsar if >0 [1]
+
+    :return roq:                ROQInfo object
+    """
+    rng = np.random.default_rng(seed)
+    log10_fgw_bounds = np.array(log10_fgw_bounds,dtype=np.float64)
+    log10_mc_bounds = np.array(log10_mc_bounds,dtype=np.float64)
+
+    has_roq = np.ones(flm.Npsr,dtype=np.bool_)
+    L_maxs = np.zeros(flm.Npsr)
+    node_toas = List()
+    node_toas2 = List()
+    w_nrs = List()
+    w_tns = List()
+    w_prods = List()
+    for ii in range(flm.Npsr):
+        toas_loc = flm.toas[ii]-cm.tref
+        max_toa = np.max(flm.toas[ii])
+        n1 = toas_loc.size
+        L_maxs[ii] = 2*(flm.pdist[ii,0]+dist_sigma_max*flm.pdist[ii,1])*(const.kpc/const.c)
+
+        basis = np.zeros((n1,0),dtype=np.complex128)
+        basis2 = np.zeros((n1,0),dtype=np.complex128)
+        for itrc in range(0,n_train,n_chunk):
+            params = draw_training_params(rng,min(n_chunk,n_train-itrc),log10_fgw_bounds,log10_mc_bounds,L_maxs[ii],max_toa)
+            filters = get_training_filters(toas_loc,*params)
+            basis = add_to_reduced_basis(basis,np.vstack((filters[0],filters[1])).T,tol)
+            basis2 = add_to_reduced_basis(basis2,get_training_products(filters),tol)
+
+        nodes,interpolant = get_eim_interpolant(basis)
+        nodes2,interpolant2 = get_eim_interpolant(basis2)
+
+        #fold the inverse squareroot N vectors into the weights
+        isqrNvec = flm.isqrNvecs[ii]
+        node_toas.append(toas_loc[nodes].copy())
+        node_toas2.append(toas_loc[nodes2].copy())
+        w_nrs.append(interpolant.T@(flm.Nrs[ii]*isqrNvec))
+        w_tns.append(np.ascontiguousarray(interpolant.T@(flm.TNvs[ii]*isqrNvec[:,None])))
+        w_prods.append(interpolant2.T@(isqrNvec**2))
+
+        if verbosity>0:
+            #relative interpolation error in the noise weighted norm at fresh draws
+            params = draw_training_params(rng,n_validate,log10_fgw_bounds,log10_mc_bounds,L_maxs[ii],max_toa)
+            filters = get_training_filters(toas_loc,*params)
+            X = np.vstack((filters[0],filters[1])).T
+            X2 = get_training_products(filters)
+            err = np.max(np.linalg.norm(isqrNvec[:,None]*(interpolant@X[nodes]-X),axis=0)/np.linalg.norm(isqrNvec[:,None]*X,axis=0))
+            err2 = np.max(np.linalg.norm(isqrNvec[:,None]**2*(interpolant2@X2[nodes2]-X2),axis=0)/np.linalg.norm(isqrNvec[:,None]**2*X2,axis=0))
+            print("ROQ pulsar %d: %d TOAs, %d linear nodes (max rel. error %.3e), %d quadratic nodes (max rel. error %.3e)"%(ii,n1,nodes.size,err,nodes2.size,err2))
+
+    return ROQInfo(has_roq,log10_fgw_bounds,log10_mc_bounds,L_maxs,node_toas,node_toas2,w_nrs,w_tns,w_prods)
+
+def get_roq_checks(flm):
+    """get numbers identifying the data and noise model the quadratures were built for, to make sure a saved quadrature is not used with different data
+
+    :param flm:             FastLikeMaster object
+
+    :return checks:         (number of pulsars, 4) array holding the number of TOAs, the number of basis vectors, the sum of the TOAs and the sum of |TNv|
+    """
+    checks = np.zeros((flm.Npsr,4))
+    for ii in range(flm.Npsr):
+        checks[ii,0] = flm.TNvs[ii].shape[0]
+        checks[ii,1] = flm.TNvs[ii].shape[1]
+        checks[ii,2] = np.sum(flm.toas[ii]-cm.tref)
+        checks[ii,3] = np.sum(np.abs(flm.TNvs[ii]))
+    return checks
+
+def save_roq(filename,roq,flm):
+    """save reduced order quadratures to a .npz file
+
+    :param filename:        File name
+    :param roq:             ROQInfo object
+    :param flm:             FastLikeMaster object the quadratures were built with
+    """
+    arrays = {'has_roq':roq.has_roq,'log10_fgw_bounds':roq.log10_fgw_bounds,'log10_mc_bounds':roq.log10_mc_bounds,'L_maxs':roq.L_maxs,'checks':get_roq_checks(flm)}
+    for ii in range(flm.Npsr):
+        arrays['node_toas_%d'%ii] = roq.node_toas[ii]
+        arrays['node_toas2_%d'%ii] = roq.node_toas2[ii]
+        arrays['w_nrs_%d'%ii] = roq.w_nrs[ii]
+        arrays['w_tns_%d'%ii] = roq.w_tns[ii]
+        arrays['w_prods_%d'%ii] = roq.w_prods[ii]
+    np.savez(filename,**arrays)
+
+def load_roq(filename,flm):
+    """load reduced order quadratures saved with save_roq, checking they were built for the same data as flm
+
+    :param filename:        File name
+    :param flm:             FastLikeMaster object
+
+    :return roq:            ROQInfo object
+    """
+    with np.load(filename) as data:
+        checks = get_roq_checks(flm)
+        if data['checks'].shape!=checks.shape or not np.allclose(data['checks'],checks,rtol=1.e-10,atol=0.):
+            raise ValueError("ROQ file "+filename+" was built for different TOAs or noise basis")
+        node_toas = List()
+        node_toas2 = List()
+        w_nrs = List()
+        w_tns = List()
+        w_prods = List()
+        for ii in range(flm.Npsr):
+            node_toas.append(data['node_toas_%d'%ii])
+            node_toas2.append(data['node_toas2_%d'%ii])
+            w_nrs.append(data['w_nrs_%d'%ii])
+            w_tns.append(np.ascontiguousarray(data['w_tns_%d'%ii]))
+            w_prods.append(data['w_prods_%d'%ii])
+        return ROQInfo(data['has_roq'],data['log10_fgw_bounds'],data['log10_mc_bounds'],data['L_maxs'],node_toas,node_toas2,w_nrs,w_tns,w_prods)
@@ -0,0 +1,88 @@
+"""C 2021 Bence Becsy
+MCMC for CW fast likelihood (w/ Neil Cornish and Matthew Digman)
+benchmark the diagonal Cholesky up/downdates of CWFastLikelihoodNumba against scipy.linalg.cho_factor, used to calibrate cm.chol_update_cost_fac"""
+from time import perf_counter
+
+import numpy as np
+import scipy.linalg
+
+from QuickCW.CWFastLikelihoodNumba import cholupdate_diag_inplace
+import QuickCW.const_mcmc as cm
+
+def get_test_matrix(rng,n):
+    """get a random positive definite matrix with a Sigma-like spread of diagonal elements
+
+    :param rng:         numpy random generator
+    :param n:           Size of the matrix
+
+    :return Sigma:      n x n positive definite matrix
+    """
+    A = rng.normal(0.,1.,(n,2*n))
+    return A@A.T+np.diag(10**rng.uniform(0.,4.,n))
+
+def time_call(func,n_rep):
+    """get the fastest of n_rep timings of func in seconds"""
+    t_min = np.inf
+    for itr in range(n_rep):
+        t0 = perf_counter()
+        func()
+        t_min = min(t_min,perf_counter()-t0)
+    return t_min
+
+def benchmark_cholupdate(ns=(20,40,60,100,160),n_changes=(1,2,5,10,20,60),n_rep=20,seed=1):
+    """time cho_factor and cholupdate_diag_inplace for changing the last n_change and n_change random diagonal elements of n x n matrices
+
+    :param ns:          Matrix sizes to test
+    :param n_changes:   Numbers of changed diagonal elements to test
+    :param n_rep:       Number of repetitions of each timing
+    :param seed:        Random seed
+
+    :return cost_facs:  Array of measured update to refactorization cost ratios normalized as in cm.chol_update_cost_fac
+    """
+    rng = np.random.default_rng(seed)
+    #compile first
+    L = np.asfortranarray(np.linalg.cholesky(get_test_matrix(rng,4)))
+    cholupdate_diag_inplace(L,np.array([1,3]),np.array([1.,-0.1]),cm.chol_downdate_min_ratio)
+
+    cost_facs = []
+    print("%5s %8s %8s %12s %12s %12s %10s %10s"%("n","n_change","where","t_cho [us]","t_upd [us]","max err","t_upd/t_cho","cost_fac"))
+    for n in ns:
+        Sigma = get_test_matrix(rng,n)
+        t_cho = time_call(lambda: scipy.linalg.cho_factor(Sigma,lower=True,check_finite=False),n_rep)
+        L0 = np.asfortranarray(np.linalg.cholesky(Sigma))
+        for n_change in n_changes:
+            if n_change>n:
+                continue
+            for where in ("last","random"):
+                if where=="last":
+                    idxs = np.arange(n-n_change,n)
+                else:
+                    idxs = np.sort(rng.choice(n,n_change,replace=False))
+                #up to a factor 3 changes of either sign, increases first as in update_chol_Sigma22
+                diffs = np.diag(Sigma)[idxs]*rng.uniform(-0.6,2.,n_change)
+                order = np.argsort(diffs<0.,kind='stable')
+                idxs = idxs[order]
+                diffs = diffs[order]
+
+                Ls = [L0.copy(order='F') for itr in range(n_rep)]
+                t_upd = np.inf
+                for itr in range(n_rep):
+                    t0 = perf_counter()
+                    success = cholupdate_diag_inplace(Ls[itr],idxs,diffs,cm.chol_downdate_min_ratio)
+                    t_upd = min(t_upd,perf_counter()-t0)
+
+                Sigma_new = Sigma.copy()
+                Sigma_new[idxs,idxs] += diffs
+                L_new = np.linalg.cholesky(Sigma_new)
+                err = np.max(np.abs(np.tril(Ls[0])-L_new))/np.max(np.abs(L_new)) if success else np.nan
+
+                cost = np.sum((n-idxs)**2)
+                cost_fac = t_cho/t_upd*cost/n**3
+                cost_facs.append(cost_fac)
+                print("%5d %8d %8s %12.2f %12.2f %12.3e %10.3f %10.4f"%(n,n_change,where,t_cho*1.e6,t_upd*1.e6,err,t_upd/t_cho,cost_fac))
+    cost_facs = np.array(cost_facs)
+    print("update is faster than cho_factor if sum over changed idx of (n-idx)**2 < cost_fac*n**3, median measured cost_fac=%.4f (cm.chol_update_cost_fac=%.4f)"%(np.median(cost_facs),cm.chol_update_cost_fac))
+    return cost_facs
+
+if __name__ == '__main__':
+    benchmark_cholupdate()
@@ -0,0 +1,82 @@
+"""C 2021 Bence Becsy
+MCMC for CW fast likelihood (w/ Neil Cornish and Matthew Digman)
+benchmark the series expansion of the phase evolution in the filter kernels of CWFastLikelihoodNumba (FastLikeMaster phase_series option)
+against the exact expressions on the FastLikeInfo of a data set, e.g. benchmark_phase_series(mcc.FLIs[0],mcc.x0s[0],mcc.samples[0,0])"""
+from time import perf_counter
+
+import numpy as np
+
+from enterprise import constants as const
+from QuickCW.CWFastLikelihoodNumba import get_phase_series_order
+import QuickCW.const_mcmc as cm
+
+def benchmark_phase_series(FLI,x0,params,n_draw=100,log10_fgw_bounds=(-9.,-7.),log10_mc_bounds=(7.,10.),seed=None):
+    """time full shape updates at random shape parameters with and without the series expansion of the phase evolution,
+    and report how often the series can be used and how much it changes the likelihood
+
+    :param FLI:                 FastLikeInfo object
+    :param x0:                  CWInfo object consistent with FLI
+    :param params:              Parameter vector x0 was set up with, FLI and x0 are reset to this at the end
+    :param n_draw:              Number of shape parameter draws [100]
+    :param log10_fgw_bounds:    Range to draw log10 GW frequencies from [(-9.,-7.)]
+    :param log10_mc_bounds:     Range to draw log10 chirp masses from [(7.,10.)]
+    :param seed:                Seed for the random draws [None]
+
+    :return results:            Dictionary with the fraction of pulsar updates that used the series, the total time spent with and without it,
+                                the speedup and the largest absolute log likelihood difference between the two
+    """
+    rng = np.random.default_rng(seed)
+    use_phase_series_old = FLI.ws.use_phase_series
+    params_loc = params.copy()
+
+    #make sure compilation is not included in the timing
+    for use_phase_series in [True,False]:
+        FLI.ws.use_phase_series = use_phase_series
+        FLI.update_intrinsic_params(x0)
+
+    n_series = 0
+    n_used = 0
+    time_series = 0.
+    time_exact = 0.
+    max_diff = 0.
+    for itrd in range(n_draw):
+        params_loc[x0.idx_cos_gwtheta] = rng.uniform(-1.,1.)
+        params_loc[x0.idx_gwphi] = rng.uniform(0.,2*np.pi)
+        params_loc[x0.idx_log10_fgw] = rng.uniform(log10_fgw_bounds[0],log10_fgw_bounds[1])
+        params_loc[x0.idx_log10_mc] = rng.uniform(log10_mc_bounds[0],log10_mc_bounds[1])
+        x0.update_params(params_loc)
+
+        #skip draws which merge before the last TOA, the sampler rejects them anyway
+        w0 = np.pi*10.**x0.log10_fgw
+        mc = 10.**x0.log10_mc*const.Tsun
+        x_scale = 256./5.*mc**(5/3)*w0**(8/3)
+        if x_scale*(FLI.max_toa-cm.tref)>=1.:
+            continue
+        n_used += 1
+        for ii in range(x0.Npsr):
+            if get_phase_series_order(x_scale*FLI.ws.toa_dt_maxs[ii])>0:
+                n_series += 1
+
+        FLI.ws.use_phase_series = True
+        t0 = perf_counter()
+        FLI.update_intrinsic_params(x0)
+        time_series += perf_counter()-t0
+        log_L_series = FLI.get_lnlikelihood(x0)
+
+        FLI.ws.use_phase_series = False
+        t0 = perf_counter()
+        FLI.update_intrinsic_params(x0)
+        time_exact += perf_counter()-t0
+        log_L_exact = FLI.get_lnlikelihood(x0)
+
+        max_diff = max(max_diff,np.abs(log_L_series-log_L_exact))
+
+    FLI.ws.use_phase_series = use_phase_series_old
+    x0.update_params(params)
+    FLI.update_intrinsic_params(x0)
+
+    results = {'series_fraction':n_series/max(1,n_used*x0.Npsr),'time_series':time_series,'time_exact':time_exact,
+               'speedup':time_exact/max(time_series,1.e-300),'max_lnL_diff':max_diff,'n_draw':n_used}
+    print("Series phase used in %.1f%% of %d pulsar updates, %.3fs vs %.3fs exact (speedup %.2f), max log likelihood difference %.3e"%
+          (100*results['series_fraction'],n_used*x0.Npsr,time_series,time_exact,results['speedup'],max_diff))
+    return results
@@ -0,0 +1,122 @@
+"""C 2021 Bence Becsy
+MCMC for CW fast likelihood (w/ Neil Cornish and Matthew Digman)
+check that the filter kernels of CWFastLikelihoodNumba (update_intrinsic_params2) do not allocate, as all their scratch space comes from the FilterWorkspace"""
+import os
+#numba only counts allocations if this is set before it is imported
+os.environ['NUMBA_NRT_STATS'] = '1'
+
+import numpy as np
+import numba as nb
+from numba import njit
+from numba.typed import List
+from numba.core.runtime import rtsys
+
+from QuickCW.CWFastLikelihoodNumba import CWInfo,FilterWorkspace,get_empty_ROQInfo,update_intrinsic_params2
+import QuickCW.const_mcmc as cm
+
+def get_test_problem(rng,n1s,n2s):
+    """get random pulsars with the array layouts FastLikeMaster and FastLikeInfo pass to the filter kernels
+
+    :param rng:         numpy random generator
+    :param n1s:         Number of TOAs of each pulsar
+    :param n2s:         Number of basis vectors of each pulsar
+
+    :return x0:         CWInfo object
+    :return args:       Tuple of the arguments of update_intrinsic_params2 after x0, without the pulsar indices and resres_array
+    """
+    Npsr = len(n1s)
+    par_names_cw_ext = ['0_cos_inc','0_log10_h','0_phase0','0_psi']
+    par_names_cw_int = ['0_cos_gwtheta','0_gwphi','0_log10_fgw','0_log10_mc']
+    par_names = par_names_cw_ext+par_names_cw_int+['gwb_gamma','gwb_log10_A']
+    params = [0.3,-15.,1.,0.5,0.2,1.,-8.3,8.7,13/3,-15.]
+    for ii in range(Npsr):
+        par_names_psr = ['psr%d_cw0_p_phase'%ii,'psr%d_cw0_p_dist'%ii,'psr%d_red_noise_gamma'%ii,'psr%d_red_noise_log10_A'%ii]
+        par_names += par_names_psr
+        params += [1.,0.,3.,-14.]
+        par_names_cw_ext.append(par_names_psr[0])
+        par_names_cw_int.append(par_names_psr[1])
+    x0 = CWInfo(Npsr,np.array(params),par_names,par_names_cw_ext,par_names_cw_int)
+
+    pos = rng.normal(0.,1.,(Npsr,3))
+    pos /= np.sqrt(np.sum(pos**2,axis=1))[:,None]
+    pdist = np.zeros((Npsr,2))
+    pdist[:,0] = rng.uniform(0.5,2.,Npsr)
+    pdist[:,1] = 0.1*pdist[:,0]
+
+    toas = List()
+    isqrNvecs = List()
+    Nrs = List()
+    TNvs = List()
+    chol_Sigmas = List()
+    dotTNrs = List()
+    TNvs32 = List()
+    isqrNvecs32 = List()
+    for ii in range(Npsr):
+        n1 = n1s[ii]
+        n2 = n2s[ii]
+        toas.append(np.sort(rng.uniform(cm.tref-5*365.25*86400,cm.tref+5*365.25*86400,n1)))
+        isqrNvecs.append(1./rng.uniform(0.5e-7,2.e-7,n1))
+        Nrs.append(rng.normal(0.,1.,n1))
+        TNvs.append(np.asfortranarray(rng.normal(0.,1.,(n1,n2))))
+        dotTNrs.append(np.dot(Nrs[ii],TNvs[ii]))
+        Sigma = TNvs[ii].T@TNvs[ii]+np.diag(10**rng.uniform(0.,4.,n2))
+        chol_Sigmas.append(np.asfortranarray(np.linalg.cholesky(Sigma)))
+        TNvs32.append(np.asfortranarray(TNvs[ii],dtype=np.float32))
+        isqrNvecs32.append(isqrNvecs[ii].astype(np.float32))
+
+    NN = np.zeros((Npsr,4))
+    MMs = np.zeros((Npsr,4,4))
+    ws = FilterWorkspace(TNvs,toas,nb.config.NUMBA_NUM_THREADS)
+    return x0,(isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,dotTNrs,TNvs32,isqrNvecs32,ws,get_empty_ROQInfo(Npsr))
+
+@njit()
+def repeat_filter_update(n_call,x0,psr_idxs,resres_array,use_float32,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,dotTNrs,TNvs32,isqrNvecs32,ws,roq):
+    """call update_intrinsic_params2 n_call times"""
+    for itr in range(n_call):
+        update_intrinsic_params2(x0,isqrNvecs,Nrs,pos,pdist,toas,NN,MMs,TNvs,chol_Sigmas,psr_idxs,resres_array,dotTNrs,TNvs32,isqrNvecs32,use_float32,ws,roq)
+
+def get_filter_allocations(x0,args,psr_idxs,use_float32):
+    """count the heap allocations numba makes inside one call of update_intrinsic_params2
+
+    :param x0:              CWInfo object
+    :param args:            Remaining arguments from get_test_problem
+    :param psr_idxs:        Indices of pulsars to update
+    :param use_float32:     Whether to use the single precision kernels
+
+    :return n_alloc:        Number of allocations per call
+    """
+    resres_array = np.zeros(x0.Npsr)
+    #compile and warm up first
+    repeat_filter_update(1,x0,psr_idxs,resres_array,use_float32,*args)
+
+    n_allocs = np.zeros(2,dtype=np.int64)
+    for itr in range(2):
+        stats_before = rtsys.get_allocation_stats()
+        repeat_filter_update(itr+1,x0,psr_idxs,resres_array,use_float32,*args)
+        n_allocs[itr] = rtsys.get_allocation_stats().alloc-stats_before.alloc
+    #passing the arguments into numba allocates too, so only the difference between 2 calls and 1 call is due to the kernels
+    return n_allocs[1]-n_allocs[0]
+
+def check_filter_allocations(seed=1):
+    """assert the filter kernels do not allocate for a mix of pulsar sizes, so both the serial and the parallel kernels run,
+    with and without single precision and the series expansion of the phase
+
+    :param seed:        Random seed
+    """
+    rng = np.random.default_rng(seed)
+    #one big pulsar which gets the parallel loops over TOAs and several small ones which are binned
+    n1s = [20_000]+[500]*7
+    n2s = [120]+[40]*7
+    x0,args = get_test_problem(rng,n1s,n2s)
+    ws = args[-2]
+    for psr_idxs in [np.arange(len(n1s)),np.array([0]),np.arange(1,len(n1s))]:
+        for use_float32 in [False,True]:
+            for use_phase_series in [False,True]:
+                ws.use_phase_series = use_phase_series
+                n_alloc = get_filter_allocations(x0,args,psr_idxs,use_float32)
+                print("pulsars %s, use_float32=%s, use_phase_series=%s: %d allocations per call"%(psr_idxs,use_float32,use_phase_series,n_alloc))
+                assert n_alloc==0
+    print("filter kernels do not allocate")
+
+if __name__ == '__main__':
+    check_filter_allocations()
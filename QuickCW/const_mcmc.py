@@ -1,9 +1,24 @@
 """store mcmc constants for global reference"""
 from numba import config
-import numpy as np
 
 tref = 53000*86400
 
+#series expansion of the phase evolution used in the filter kernels when the frequency evolution over the TOA span is small
+#relative truncation error the series has to reach to be used and maximum number of terms before falling back to the exact expression
+phase_series_tol = 2.**-53
+phase_series_max_terms = 8
+
+#the filter kernels split the TOAs of a pulsar into at most toa_chunks_per_thread*(number of threads) chunks of at least toa_chunk_min TOAs,
+#which are evaluated in parallel with their own partial inner products
+toa_chunk_min = 256
+toa_chunks_per_thread = 4
+
+#Cholesky up/downdates of Sigma on diagonal phiinv changes: an update is used instead of refactorizing the varying block of size n when
+#sum over changed columns idx of (n-idx)**2 is below chol_update_cost_fac*n**3, calibrated with benchmark_cholupdate.py,
+#and a downdate is abandoned for a refactorization if it would shrink a squared diagonal element of the factor by more than chol_downdate_min_ratio
+chol_update_cost_fac = 0.03
+chol_downdate_min_ratio = 1.e-3
+
 #fisher size parameters
 eps = {'0_cos_gwtheta':1.e-4,'0_cos_inc':1.e-4,'0_gwphi':1.e-4,'0_log10_fgw':1.e-5,'0_log10_h':1.e-5,'0_log10_mc':1.e-4,'0_phase0':1.e-4,'0_psi':1.e-4,'cw0_p_phase':1.e-3,'cw0_p_dist':1.e-3,'red_noise_gamma':1.e-4,'red_noise_log10_A':1.e-4,'gwb_gamma':1.e-2,'gwb_log10_A':1.e-2}
 #eps = {'0_cos_gwtheta':1.e-4,'0_cos_inc':1.e-4,'0_gwphi':1.e-4,'0_log10_fgw':1.e-5,'0_log10_h':1.e-5,'0_log10_mc':1.e-4,'0_phase0':1.e-4,'0_psi':1.e-4,'cw0_p_phase':1.e-3,'cw0_p_dist':1.e-3,'red_noise_gamma':1.e-3,'red_noise_log10_A':1.e-3}
@@ -72,20 +87,23 @@ idx_full = -1
 sigma_de = 0.1
 
 #multiple try MCMC parameters
-n_x0_extra = config.NUMBA_NUM_THREADS
+#numbers of multiple tries are rounded to a multiple of this, so the parallel loops over the tries keep all threads busy
+n_try_round = config.NUMBA_NUM_THREADS
 n_multi_try = 2000#3_000
 #n_multi_try = 1
 
-if n_multi_try < n_x0_extra:
-    print("Reset n_x0_extra from "+str(n_x0_extra)+" to "+str(n_multi_try)+" in order to not exceed n_multi_try")
-    n_x0_extra = n_multi_try
+if n_multi_try < n_try_round:
+    print("Reset n_try_round from "+str(n_try_round)+" to "+str(n_multi_try)+" in order to not exceed n_multi_try")
+    n_try_round = n_multi_try
 
-n_block_try = np.int64(n_multi_try//n_x0_extra)
-if n_multi_try%n_x0_extra!=0:
+if n_multi_try%n_try_round!=0:
     n_multi_try_old = n_multi_try
-    n_block_try = n_block_try+1
-    n_multi_try = n_block_try*n_x0_extra
-    print("adjusted number multiple tries from "+str(n_multi_try_old)+" to be next even divisor of n_x0_extra="+str(n_x0_extra)+", "+str(n_multi_try))
+    n_multi_try = (n_multi_try//n_try_round+1)*n_try_round
+    print("adjusted number multiple tries from "+str(n_multi_try_old)+" to be next multiple of n_try_round="+str(n_try_round)+", "+str(n_multi_try))
+
+assert n_multi_try%n_try_round == 0
 
-assert n_multi_try%n_x0_extra == 0
-    
+#number of multiple try steps of a chain averaged over before each retuning of its number of tries if adaptive_n_try
+n_try_adapt_window = 10
+#largest factor the number of tries of a chain can change by in one retuning
+n_try_adapt_max_factor = 2.
@@ -1,5 +1,5 @@
 """C 2021 Matthew Digman
-various jit compatible interfaces to cython lapack functions """
+various jit compatible interfaces to cython lapack and blas functions """
 import ctypes
 from numba.extending import get_cython_function_address
 from numba import njit
@@ -8,11 +8,13 @@ import numpy as np
 _PTR  = ctypes.POINTER
 
 _dble = ctypes.c_double
+_flt  = ctypes.c_float
 _char = ctypes.c_char
 _int  = ctypes.c_int
 
 _ptr_select = ctypes.c_voidp
 _ptr_dble = _PTR(_dble)
+_ptr_flt  = _PTR(_flt)
 _ptr_char = _PTR(_char)
 _ptr_int  = _PTR(_int)
 
@@ -124,3 +126,249 @@ def solve_triangular(x,y,lower_a=True,trans_a=True,unitdiag=False,overwrite_b=Fa
 
     check_info(INFO)
     return B
+
+@njit()
+def solve_triangular_inplace(x,B,n,nrhs,ldb,lapack_ints,lower_a=True,trans_a=False):
+    """solve x*B=y in place without allocating anything, for use inside hot loops
+
+    :param x:           triangular matrix (must be fortran ordered)
+    :param B:           array holding the right hand sides, interpreted as fortran ordered with leading dimension ldb, overwritten by the solution
+    :param n:           size of the system
+    :param nrhs:        number of right hand sides
+    :param ldb:         leading dimension of B
+    :param lapack_ints: int32 scratch array of at least 8 elements used to pass arguments to lapack
+    :param lower_a:     whether x is lower triangular [True]
+    :param trans_a:     whether to solve with the transpose of x [False]
+    """
+    if not x.flags.f_contiguous:
+        raise ValueError('x must be fortran contiguous')
+    if x.shape[0]!=n or x.shape[1]!=n or ldb<n or B.size<ldb*(nrhs-1)+n:
+        raise ValueError('inconsistent dimensions')
+
+    if lower_a:
+        lapack_ints[0] = ord('L')
+    else:
+        lapack_ints[0] = ord('U')
+    if trans_a:
+        lapack_ints[1] = ord('T')
+    else:
+        lapack_ints[1] = ord('N')
+    lapack_ints[2] = ord('N')
+    lapack_ints[3] = n
+    lapack_ints[4] = nrhs
+    lapack_ints[5] = n
+    lapack_ints[6] = ldb
+    lapack_ints[7] = 0
+
+    dtrtrs_fn(lapack_ints[0:1].ctypes,
+             lapack_ints[1:2].ctypes,
+             lapack_ints[2:3].ctypes,
+             lapack_ints[3:4].ctypes,
+             lapack_ints[4:5].ctypes,
+             x.ctypes,
+             lapack_ints[5:6].ctypes,
+             B.ctypes,
+             lapack_ints[6:7].ctypes,
+             lapack_ints[7:8].ctypes)
+
+    if lapack_ints[7] != 0:
+        print(lapack_ints[7])
+        raise RuntimeError("INFO indicates problem with dtrtrs")
+
+# signature is:
+# void dpotrf(
+#  char *UPLO,
+#  int *N,
+#  d *A,
+#  int *LDA,
+#  int *info
+# )
+addr = get_cython_function_address('scipy.linalg.cython_lapack', 'dpotrf')
+functype = ctypes.CFUNCTYPE(None,
+                            _ptr_int, # UPLO
+                            _ptr_int, # N
+                            _ptr_dble, # A
+                            _ptr_int, # LDA
+                            _ptr_int, # INFO
+                            )
+dpotrf_fn = functype(addr)
+@njit()
+def cholesky_inplace(A,n,lda,lapack_ints,lower_a=True):
+    """compute the Cholesky decomposition of a symmetric positive definite matrix in place without allocating anything, for use inside hot loops
+    only the lower (or upper) triangle of A is read and overwritten, the other triangle is left untouched
+
+    :param A:           array holding the matrix, interpreted as fortran ordered with leading dimension lda, may be a view into the trailing block of a larger fortran ordered matrix
+    :param n:           size of the matrix
+    :param lda:         leading dimension of A
+    :param lapack_ints: int32 scratch array of at least 4 elements used to pass arguments to lapack
+    :param lower_a:     whether to compute the lower triangular factor [True]
+
+    :return info:       0 on success, >0 if the leading minor of that order is not positive definite
+    """
+    if A.shape[0]<n or A.shape[1]<n or lda<max(1,n):
+        raise ValueError('inconsistent dimensions')
+    if n>0 and (A.strides[0]!=A.itemsize or (n>1 and A.strides[1]!=A.itemsize*lda)):
+        raise ValueError('A must be fortran ordered with leading dimension lda')
+
+    if lower_a:
+        lapack_ints[0] = ord('L')
+    else:
+        lapack_ints[0] = ord('U')
+    lapack_ints[1] = n
+    lapack_ints[2] = lda
+    lapack_ints[3] = 0
+
+    dpotrf_fn(lapack_ints[0:1].ctypes,
+              lapack_ints[1:2].ctypes,
+              A.ctypes,
+              lapack_ints[2:3].ctypes,
+              lapack_ints[3:4].ctypes)
+    return lapack_ints[3]
+
+# signature is:
+# void dgemm(
+#  char *TRANSA,
+#  char *TRANSB,
+#  int *M,
+#  int *N,
+#  int *K,
+#  d *ALPHA,
+#  d *A,
+#  int *LDA,
+#  d *B,
+#  int *LDB,
+#  d *BETA,
+#  d *C,
+#  int *LDC
+# )
+addr = get_cython_function_address('scipy.linalg.cython_blas', 'dgemm')
+functype = ctypes.CFUNCTYPE(None,
+                            _ptr_int, # TRANSA
+                            _ptr_int, # TRANSB
+                            _ptr_int, # M
+                            _ptr_int, # N
+                            _ptr_int, # K
+                            _ptr_dble, # ALPHA
+                            _ptr_dble, # A
+                            _ptr_int, # LDA
+                            _ptr_dble, # B
+                            _ptr_int, # LDB
+                            _ptr_dble, # BETA
+                            _ptr_dble, # C
+                            _ptr_int, # LDC
+                            )
+dgemm_fn = functype(addr)
+
+# sgemm has the same signature with single precision ALPHA, A, B, BETA and C
+addr = get_cython_function_address('scipy.linalg.cython_blas', 'sgemm')
+functype = ctypes.CFUNCTYPE(None,
+                            _ptr_int, # TRANSA
+                            _ptr_int, # TRANSB
+                            _ptr_int, # M
+                            _ptr_int, # N
+                            _ptr_int, # K
+                            _ptr_flt, # ALPHA
+                            _ptr_flt, # A
+                            _ptr_int, # LDA
+                            _ptr_flt, # B
+                            _ptr_int, # LDB
+                            _ptr_flt, # BETA
+                            _ptr_flt, # C
+                            _ptr_int, # LDC
+                            )
+sgemm_fn = functype(addr)
+
+@njit()
+def set_gemm_ints(A,B,C,m,n,k,lda,ldb,ldc,blas_ints,trans_a,trans_b):
+    """check the dimensions of a gemm call and put its integer arguments into blas_ints, see matmul_inplace"""
+    if trans_a:
+        rows_a,cols_a = k,m
+    else:
+        rows_a,cols_a = m,k
+    if trans_b:
+        rows_b,cols_b = n,k
+    else:
+        rows_b,cols_b = k,n
+    if lda<max(1,rows_a) or ldb<max(1,rows_b) or ldc<max(1,m):
+        raise ValueError('leading dimensions too small')
+    if A.size<lda*(cols_a-1)+rows_a or B.size<ldb*(cols_b-1)+rows_b or C.size<ldc*(n-1)+m:
+        raise ValueError('inconsistent dimensions')
+
+    if trans_a:
+        blas_ints[0] = ord('T')
+    else:
+        blas_ints[0] = ord('N')
+    if trans_b:
+        blas_ints[1] = ord('T')
+    else:
+        blas_ints[1] = ord('N')
+    blas_ints[2] = m
+    blas_ints[3] = n
+    blas_ints[4] = k
+    blas_ints[5] = lda
+    blas_ints[6] = ldb
+    blas_ints[7] = ldc
+
+@njit()
+def matmul_inplace(A,B,C,m,n,k,lda,ldb,ldc,blas_ints,blas_dbls,trans_a=False,trans_b=False,alpha=1.,beta=0.):
+    """compute C = alpha*op(A)*op(B)+beta*C in place without allocating anything, for use inside hot loops
+    all matrices are interpreted as fortran ordered with the given leading dimensions
+
+    :param A:           array holding A, op(A) is m x k
+    :param B:           array holding B, op(B) is k x n
+    :param C:           array holding C, m x n, overwritten with the result
+    :param m:           number of rows of op(A) and C
+    :param n:           number of columns of op(B) and C
+    :param k:           number of columns of op(A) and rows of op(B)
+    :param lda:         leading dimension of A
+    :param ldb:         leading dimension of B
+    :param ldc:         leading dimension of C
+    :param blas_ints:   int32 scratch array of at least 8 elements used to pass arguments to blas
+    :param blas_dbls:   float64 scratch array of at least 2 elements used to pass arguments to blas
+    :param trans_a:     whether op(A) is the transpose of A [False]
+    :param trans_b:     whether op(B) is the transpose of B [False]
+    :param alpha:       scalar multiplying op(A)*op(B) [1.]
+    :param beta:        scalar multiplying the input C [0.]
+    """
+    set_gemm_ints(A,B,C,m,n,k,lda,ldb,ldc,blas_ints,trans_a,trans_b)
+    blas_dbls[0] = alpha
+    blas_dbls[1] = beta
+
+    dgemm_fn(blas_ints[0:1].ctypes,
+             blas_ints[1:2].ctypes,
+             blas_ints[2:3].ctypes,
+             blas_ints[3:4].ctypes,
+             blas_ints[4:5].ctypes,
+             blas_dbls[0:1].ctypes,
+             A.ctypes,
+             blas_ints[5:6].ctypes,
+             B.ctypes,
+             blas_ints[6:7].ctypes,
+             blas_dbls[1:2].ctypes,
+             C.ctypes,
+             blas_ints[7:8].ctypes)
+
+@njit()
+def matmul_inplace32(A,B,C,m,n,k,lda,ldb,ldc,blas_ints,blas_flts,trans_a=False,trans_b=False,alpha=1.,beta=0.):
+    """single precision version of matmul_inplace, A, B and C have to be float32
+
+    :param blas_flts:   float32 scratch array of at least 2 elements used to pass arguments to blas
+    (remaining parameters as in matmul_inplace)
+    """
+    set_gemm_ints(A,B,C,m,n,k,lda,ldb,ldc,blas_ints,trans_a,trans_b)
+    blas_flts[0] = alpha
+    blas_flts[1] = beta
+
+    sgemm_fn(blas_ints[0:1].ctypes,
+             blas_ints[1:2].ctypes,
+             blas_ints[2:3].ctypes,
+             blas_ints[3:4].ctypes,
+             blas_ints[4:5].ctypes,
+             blas_flts[0:1].ctypes,
+             A.ctypes,
+             blas_ints[5:6].ctypes,
+             B.ctypes,
+             blas_ints[6:7].ctypes,
+             blas_flts[1:2].ctypes,
+             C.ctypes,
+             blas_ints[7:8].ctypes)